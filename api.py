@@ -0,0 +1,157 @@
+import hashlib
+from datetime import timezone
+
+from flask import Blueprint, current_app, jsonify, request, session, Response
+
+from models import db, User, Feedback
+from replicas import read_only
+
+api_bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+USER_FIELDS = ("username", "email", "first_name", "last_name", "updated_at")
+FEEDBACK_FIELDS = ("id", "title", "content", "username", "updated_at")
+
+
+class APIError(Exception):
+    """An error returned to API clients as JSON."""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+@api_bp.errorhandler(APIError)
+def api_error(e):
+    return jsonify(error=e.message), e.status
+
+@api_bp.errorhandler(404)
+def api_not_found(e):
+    return jsonify(error="Not found."), 404
+
+@api_bp.before_request
+def require_login():
+    """The API uses the same login session as the site."""
+    if 'username' not in session:
+        return jsonify(error="Please log in first."), 401
+
+
+def selected_fields(allowed):
+    """Return the fields asked for with ?fields=a,b (all of allowed by default)."""
+    fields = request.args.get('fields')
+    if not fields:
+        return allowed
+    fields = tuple(dict.fromkeys(field.strip() for field in fields.split(',') if field.strip()))
+    if not fields:
+        raise APIError(f"No fields requested.  Choose from {', '.join(allowed)}.", 400)
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise APIError(f"Unknown fields: {', '.join(unknown)}.  Choose from {', '.join(allowed)}.", 400)
+    return fields
+
+def make_etag(*parts):
+    """Build a strong ETag from the values that identify a representation."""
+    return hashlib.sha1("\x1f".join(str(part) for part in parts).encode("utf8")).hexdigest()
+
+def not_modified(etag, last_modified):
+    """Return a 304 response if the client's copy is current, otherwise None."""
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified:
+        fresh = last_modified.replace(microsecond=0) <= request.if_modified_since
+    else:
+        fresh = False
+    return with_validators(Response(status=304), etag, last_modified) if fresh else None
+
+def with_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # Per-user data: caches may keep it but must check back with us before reusing it
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add("Cookie")
+    return response
+
+def utc(timestamp):
+    return timestamp.replace(tzinfo=timezone.utc)
+
+def serialize(row, fields):
+    data = {}
+    for field in fields:
+        value = getattr(row, field)
+        data[field] = utc(value).isoformat().replace("+00:00", "Z") if field == "updated_at" else value
+    return data
+
+
+@api_bp.route('/users/<username>')
+@read_only
+def get_user(username):
+    """Return a user's profile."""
+    fields = selected_fields(USER_FIELDS)
+
+    # Validate against updated_at alone, so an unchanged profile costs one tiny indexed lookup
+    updated_at = db.session.query(User.updated_at).filter(User.username == username).scalar()
+    if updated_at is None:
+        raise APIError("No such user.", 404)
+    etag = make_etag("user", username, updated_at.isoformat(), *fields)
+    cached = not_modified(etag, utc(updated_at))
+    if cached is not None:
+        return cached
+
+    user = db.session.query(*(getattr(User, field) for field in fields)).filter(User.username == username).one()
+    return with_validators(jsonify(serialize(user, fields)), etag, utc(updated_at))
+
+@api_bp.route('/users/<username>/feedback')
+@read_only
+def list_feedback(username):
+    """Return one page of a user's feedback, oldest first.  Pass ?after=<next_cursor> for the next page."""
+    fields = selected_fields(FEEDBACK_FIELDS)
+    limit = request.args.get('limit', current_app.config["FEEDBACK_PAGE_SIZE"], type=int)
+    limit = max(1, min(limit, current_app.config["FEEDBACK_MAX_PAGE_SIZE"]))
+    after = request.args.get('after', type=int)
+
+    # Fetch just (id, updated_at) for the page first; that's enough to answer a conditional request
+    query = db.session.query(Feedback.id, Feedback.updated_at).filter(Feedback.username == username)
+    if after is not None:
+        query = query.filter(Feedback.id > after)
+    versions = query.order_by(Feedback.id).limit(limit + 1).all()
+    has_more = len(versions) > limit
+    versions = versions[:limit]
+    if not versions and not db.session.query(User.username).filter(User.username == username).first():
+        raise APIError("No such user.", 404)
+
+    next_cursor = versions[-1].id if has_more else None
+    last_modified = utc(max(row.updated_at for row in versions)) if versions else None
+    etag = make_etag("feedback", username, after, limit, next_cursor, *fields, *(f"{row.id}@{row.updated_at.isoformat()}" for row in versions))
+    cached = not_modified(etag, last_modified)
+    if cached is not None:
+        return cached
+
+    rows = []
+    if versions:
+        columns = [getattr(Feedback, field) for field in fields]
+        rows = (
+            db.session.query(*columns)
+            .filter(Feedback.id.in_([row.id for row in versions]))
+            .order_by(Feedback.id)
+            .all()
+        )
+    body = {"feedback": [serialize(row, fields) for row in rows], "next_cursor": next_cursor}
+    return with_validators(jsonify(body), etag, last_modified)
+
+@api_bp.route('/feedback/<int:feedback_id>')
+@read_only
+def get_feedback(feedback_id):
+    """Return one piece of feedback."""
+    fields = selected_fields(FEEDBACK_FIELDS)
+
+    updated_at = db.session.query(Feedback.updated_at).filter(Feedback.id == feedback_id).scalar()
+    if updated_at is None:
+        raise APIError("No such feedback.", 404)
+    etag = make_etag("feedback", feedback_id, updated_at.isoformat(), *fields)
+    cached = not_modified(etag, utc(updated_at))
+    if cached is not None:
+        return cached
+
+    feedback = db.session.query(*(getattr(Feedback, field) for field in fields)).filter(Feedback.id == feedback_id).one()
+    return with_validators(jsonify(serialize(feedback, fields)), etag, utc(updated_at))
@@ -0,0 +1,13 @@
+"""Entry point for ASGI servers, e.g.
+
+    uvicorn asgi:app
+
+Builds the app with ASYNC_MODE on, so the feedback write routes run as async views on the
+async engine.  Those are awaited on the server's event loop, so requests waiting on the
+database for them don't take up a thread each.  Every other route is still sync and runs on
+a pool of ASGI_THREADS threads, so it's bounded by that pool as under a WSGI server.
+"""
+from app import create_app
+from async_db import AsyncViewsAsgi
+
+app = AsyncViewsAsgi(create_app({"ASYNC_MODE": True}))
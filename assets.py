@@ -0,0 +1,214 @@
+import base64
+import hashlib
+import os
+import re
+import urllib.request
+
+import click
+from flask import current_app, render_template, send_from_directory, session, url_for
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+from werkzeug.exceptions import NotFound
+
+# Third-party assets pinned to the versions base.html used to load from CDNs: (static path, URL, SRI hash or None)
+VENDOR_ASSETS = [
+    (
+        "vendor/bootstrap-5.1.3/css/bootstrap.min.css",
+        "https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css",
+        "sha384-1BmE4kWBq78iYhFldvKuhfTAU6auU8tT94WrHftjDbrCEXSU1oBoqyl2QvZ6jIW3",
+    ),
+    (
+        "vendor/bootstrap-5.1.3/js/bootstrap.bundle.min.js",
+        "https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js",
+        "sha384-ka7Sk0Gln4gmtz2MlQnikT1wXgYsOg+OMhuP+IlRH9sENBO0LRn5q+8nbTov4+1p",
+    ),
+    (
+        "vendor/fontawesome-6.1.0/css/all.min.css",
+        "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.1.0/css/all.min.css",
+        "sha512-10/jx2EXwxxWqCLX/hHth/vu2KY3jCF70dCQB8TSgNjbCVAC/8vai53GfMDrO2Emgwccf2pJqxct9ehpzG+MTw==",
+    ),
+] + [
+    # all.min.css loads these from ../webfonts/, so they keep their names next to it
+    (f"vendor/fontawesome-6.1.0/webfonts/{name}", f"https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.1.0/webfonts/{name}", None)
+    for font in ("fa-brands-400", "fa-regular-400", "fa-solid-900", "fa-v4compatibility")
+    for name in (f"{font}.woff2", f"{font}.ttf")
+]
+
+VENDOR_SOURCES = {path: (url, integrity) for path, url, integrity in VENDOR_ASSETS}
+
+# A fingerprinted name: style.0123456789abcdef.css
+FINGERPRINTED = re.compile(r"^(?P<stem>.+)\.(?P<digest>[0-9a-f]{16})(?P<suffix>\.[^./]+)$")
+
+
+def check_integrity(data, integrity):
+    """Return True if data matches a subresource integrity value like "sha384-<base64 digest>"."""
+    algorithm, _, expected = integrity.partition("-")
+    return base64.b64encode(hashlib.new(algorithm, data).digest()).decode("ascii") == expected
+
+
+class StaticAssets:
+    """Serve static files at content-fingerprinted URLs that browsers may cache forever.
+
+    asset_url('css/site.css') in templates gives /static/css/site.<digest>.css, where digest
+    comes from the file's contents, so a changed file gets a new URL and a cached copy is never
+    stale.  Requests for the current fingerprint are answered with a year-long immutable
+    Cache-Control; unfingerprinted requests are served as usual.  Digests are computed once at
+    startup (and re-checked on every lookup in debug mode, so edits show up straight away).
+
+    Config:
+        STATIC_IMMUTABLE_MAX_AGE: max-age, in seconds, for fingerprinted responses.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("STATIC_IMMUTABLE_MAX_AGE", 31536000)
+        app.extensions["static_assets"] = self
+        app.extensions["static_digests"] = self.scan(app.static_folder)
+        app.view_functions["static"] = self.send_static
+        app.jinja_env.globals["asset_url"] = self.url
+        app.jinja_env.globals["vendor_asset"] = self.vendor
+        app.cli.add_command(vendor_command)
+
+    def scan(self, folder):
+        """Return {path: digest} for every file under folder."""
+        digests = {}
+        if folder and os.path.isdir(folder):
+            for root, _, files in os.walk(folder):
+                for name in files:
+                    path = os.path.join(root, name)
+                    digests[os.path.relpath(path, folder).replace(os.sep, "/")] = self.digest(path)
+        return digests
+
+    def digest(self, path):
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()[:16]
+
+    def lookup(self, filename):
+        """Return the current digest of a static file, or None if there's no such file."""
+        app = current_app
+        if app.debug:
+            path = os.path.join(app.static_folder, filename)
+            return self.digest(path) if os.path.isfile(path) else None
+        return app.extensions["static_digests"].get(filename)
+
+    def url(self, filename):
+        """Return the fingerprinted URL of a static file, or None if it doesn't exist (e.g. not vendored yet)."""
+        digest = self.lookup(filename)
+        if digest is None:
+            return None
+        stem, suffix = os.path.splitext(filename)
+        return url_for("static", filename=f"{stem}.{digest}{suffix}")
+
+    def vendor(self, path):
+        """Return (url, integrity) for one of VENDOR_ASSETS.
+
+        That's the vendored copy's fingerprinted URL when `flask vendor-assets` has fetched it, and
+        the CDN URL with its SRI hash otherwise, so a fresh checkout works without the extra step.
+        """
+        url = self.url(path)
+        if url is not None:
+            return url, None
+        return VENDOR_SOURCES[path]
+
+    def send_static(self, filename):
+        match = FINGERPRINTED.match(filename)
+        if match:
+            original = match["stem"] + match["suffix"]
+            if self.lookup(original) != match["digest"]:
+                # an old fingerprint; serving today's file under it would poison caches
+                raise NotFound()
+            response = send_from_directory(current_app.static_folder, original, max_age=current_app.config["STATIC_IMMUTABLE_MAX_AGE"])
+            response.cache_control.immutable = True
+            response.cache_control.public = True
+            return response
+        return current_app.send_static_file(filename)
+
+
+@click.command("vendor-assets")
+@with_appcontext
+def vendor_command():
+    """Download the pinned Bootstrap and Font Awesome files into static/vendor, checking their integrity hashes."""
+    static_folder = current_app.static_folder
+    for path, url, integrity in VENDOR_ASSETS:
+        with urllib.request.urlopen(url) as response:
+            data = response.read()
+        if integrity and not check_integrity(data, integrity):
+            raise click.ClickException(f"{url} doesn't match its integrity hash {integrity}.")
+        target = os.path.join(static_folder, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f:
+            f.write(data)
+        click.echo(f"{path} ({len(data)} bytes)")
+    click.echo("Restart the app to pick up the new fingerprints.")
+
+
+def use_bytecode_cache(app):
+    """Keep compiled templates on disk, so new workers load them instead of compiling every template again.
+
+    Config:
+        JINJA_BYTECODE_CACHE_DIR: where to keep them, defaults to <instance>/jinja-cache.  None turns it off.
+    """
+    app.config.setdefault("JINJA_BYTECODE_CACHE_DIR", os.path.join(app.instance_path, "jinja-cache"))
+    cache_dir = app.config["JINJA_BYTECODE_CACHE_DIR"]
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+
+# Stands in for the flashed messages in a pre-rendered page
+FLASHES_PLACEHOLDER = "<!-- flashes -->"
+
+
+class PrerenderedPages:
+    """Render fixed pages such as 401.html and 404.html once at startup instead of on every response.
+
+    The only parts of the layout that vary are the navbar, which depends on whether someone is
+    logged in, and the flashed messages.  Each page is rendered once per login state with a
+    placeholder for the messages, which are rendered on their own when there are any.
+    Pages listed here must not use anything else from the request or session.
+
+    Config:
+        PRERENDERED_PAGES: templates to pre-render.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("PRERENDERED_PAGES", ("401.html", "404.html"))
+        app.extensions["prerendered_pages"] = self
+        app.extensions["prerendered"] = {}
+
+    def render_all(self, app):
+        """Pre-render the pages; call once every blueprint and template global is in place."""
+        pages = app.extensions["prerendered"]
+        placeholder = Markup(FLASHES_PLACEHOLDER)
+        for logged_in in (False, True):
+            with app.test_request_context():
+                if logged_in:
+                    session["username"] = "prerender"
+                for name in app.config["PRERENDERED_PAGES"]:
+                    pages[name, logged_in] = render_template(name, flashes_placeholder=placeholder)
+
+    def render(self, name):
+        """Return the pre-rendered page with this request's navbar state and flashed messages."""
+        page = current_app.extensions["prerendered"].get((name, 'username' in session))
+        if page is None or current_app.debug:
+            # not pre-rendered, or in debug mode where templates are being edited
+            return render_template(name)
+        flashes = render_template("flashes.html") if session.get("_flashes") else ""
+        return page.replace(FLASHES_PLACEHOLDER, flashes, 1)
+
+
+prerendered_pages = PrerenderedPages()
+static_assets = StaticAssets()
+
+
+def prerendered(name):
+    """Return a pre-rendered page, e.g. `return prerendered('401.html'), 401`."""
+    return prerendered_pages.render(name)
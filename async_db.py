@@ -0,0 +1,203 @@
+import asyncio
+import functools
+import sys
+import threading
+import weakref
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask import current_app, request, request_started
+from werkzeug.exceptions import HTTPException
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from background import BackgroundThread
+
+# Async driver used for each sync URL scheme when ASYNC_DATABASE_URI isn't set
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_url(uri):
+    """Return uri rewritten to use the async driver for its database."""
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend} databases, set ASYNC_DATABASE_URI.")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+class AsyncDatabase:
+    """An async SQLAlchemy engine over the same database as db, for the async views.
+
+    Config:
+        ASYNC_DATABASE_URI: URL with an async driver.  Defaults to SQLALCHEMY_DATABASE_URI with
+            its driver swapped for asyncpg / aiosqlite.
+        ASYNC_ENGINE_OPTIONS: extra create_async_engine arguments.
+
+    Pooled connections belong to the event loop that opened them, so each loop gets its own
+    engine.  Under ASGI (see AsyncViewsAsgi) async views run on the server's loop; otherwise they
+    all run on one loop in a background thread (see async_to_sync) rather than on a new loop per
+    request.  Either way the engine keeps a normal pool.
+    """
+
+    def __init__(self, app=None):
+        # {loop: {app: engine}}, forgotten along with the loop
+        self.engines = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._loop_thread = BackgroundThread(self._run_loop, "async-views")
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("ASYNC_DATABASE_URI", None)
+        app.config.setdefault("ASYNC_ENGINE_OPTIONS", {})
+        app.extensions["async_db"] = self
+
+    def get_engine(self, app):
+        """Return the app's async engine for the running event loop, creating it on first use."""
+        engines = self.engines.setdefault(asyncio.get_running_loop(), {})
+        engine = engines.get(app)
+        if engine is None:
+            uri = app.config["ASYNC_DATABASE_URI"] or async_url(app.config["SQLALCHEMY_DATABASE_URI"])
+            options = {"pool_pre_ping": app.config.get("DB_POOL_PRE_PING", True), **app.config["ASYNC_ENGINE_OPTIONS"]}
+            engine = engines[app] = create_async_engine(uri, **options)
+        return engine
+
+    def loop(self):
+        """Return this process's event loop for async views, starting its thread on first use."""
+        with self._lock:
+            # a forked worker inherits the loop but not the thread running it
+            if not self._loop_thread.running():
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread.start()
+            return self._loop
+
+    def _run_loop(self):
+        self._loop.run_forever()
+
+    def async_to_sync(self, func):
+        """Wrap the coroutine function func to run on the shared loop, blocking until it's done.
+
+        Used as the app's Flask.async_to_sync, see feedback_async.use_async_views, for async views
+        called from a WSGI server or the test client.  The calling thread waits out the whole view,
+        so those don't serve more requests at once than there are threads.  The calling thread's
+        context variables, and with them the request context, go along with the coroutine.
+        """
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            return asyncio.run_coroutine_threadsafe(func(*args, **kwargs), self.loop()).result()
+        return run
+
+    def session(self):
+        """Return a new AsyncSession; use it as `async with async_db.session() as s:`."""
+        return AsyncSession(self.get_engine(current_app._get_current_object()), expire_on_commit=False)
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    """Serve a WSGI app to an ASGI server, running each request in the event loop's thread pool.
+
+    asgiref's WsgiToAsgi runs every request on one shared thread, so they're served one at a
+    time.  The pool's size follows asgiref's ASGI_THREADS environment variable.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiToAsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__["run_wsgi_app"].func, thread_sensitive=False)
+
+
+class AsyncViewsAsgi(ThreadedWsgiToAsgi):
+    """Serve a Flask app to an ASGI server, awaiting its async views on the server's event loop.
+
+    Flask 2.0 only calls views from inside its WSGI app, where an async view still holds a thread
+    until it's done.  Here each request's URL is matched first: requests for an async view are
+    dispatched on the event loop itself, so while one waits on the database the loop serves other
+    requests, and how many are in flight at once is bounded by I/O rather than by threads.
+    Everything else goes to the thread pool, as with ThreadedWsgiToAsgi.
+
+    On the loop, the app's sync parts (session loading, before/after request hooks, forms, error
+    handlers, templates) run inline and hold up the loop while they do, so they have to be quick.
+    With the default in-process session store, fragment cache and rate limiter they only touch
+    memory; a shared SESSION_STORE, FRAGMENT_CACHE_BACKEND or RATELIMIT_BACKEND adds a network
+    round trip on the loop for each call.  The async views hand anything slower, such as the
+    write-behind queue's fsync, to a thread.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await AsyncViewsAsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+class AsyncViewsAsgiInstance(ThreadedWsgiToAsgiInstance):
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await super().__call__(scope, receive, send)
+
+    async def run_wsgi_app(self, body):
+        app = self.wsgi_application
+        environ = self.build_environ(self.scope, body)
+        if not self.is_async_view(app, environ):
+            return await super().run_wsgi_app(body)
+
+        response = await dispatch_async(app, environ)
+        app_iter = response(environ, self.start_response)
+        try:
+            output = b"".join(app_iter)
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+        await self.send(self.response_start)
+        await self.send({"type": "http.response.body", "body": output})
+
+    def is_async_view(self, app, environ):
+        try:
+            endpoint, _ = app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return False
+        return asyncio.iscoroutinefunction(app.view_functions.get(endpoint))
+
+
+async def dispatch_async(app, environ):
+    """Handle a request for an async view like Flask.wsgi_app does, but awaiting the view.
+
+    Returns the response; the request context is pushed and popped around it as usual.
+    """
+    ctx = app.request_context(environ)
+    error = None
+    try:
+        try:
+            ctx.push()
+            return await _full_dispatch_async(app)
+        except Exception as e:
+            error = e
+            return app.handle_exception(e)
+        except:  # noqa: E722
+            error = sys.exc_info()[1]
+            raise
+    finally:
+        if app.should_ignore_error(error):
+            error = None
+        ctx.auto_pop(error)
+
+async def _full_dispatch_async(app):
+    # Flask.full_dispatch_request and dispatch_request, with the view awaited
+    app.try_trigger_before_first_request_functions()
+    try:
+        request_started.send(app)
+        rv = app.preprocess_request()
+        if rv is None:
+            if request.routing_exception is not None:
+                app.raise_routing_exception(request)
+            rv = await app.view_functions[request.url_rule.endpoint](**request.view_args)
+    except Exception as e:
+        rv = app.handle_user_exception(e)
+    return app.finalize_request(rv)
+
+
+async_db = AsyncDatabase()
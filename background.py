@@ -0,0 +1,40 @@
+import os
+import threading
+
+
+class BackgroundThread:
+    """A daemon thread an extension starts the first time a process needs it.
+
+    Threads don't survive a fork, so a worker forked from a process that had started it (e.g.
+    under gunicorn --preload) starts its own on first use.  The thread runs outside any request,
+    so its target works in the app the extension was set up with (self.app, kept by init_app)
+    rather than current_app.
+
+    It has no lock of its own: call start(), running() and stopped() under the owner's lock,
+    which also guards whatever state the thread shares with it.
+    """
+
+    def __init__(self, target, name):
+        self.target = target
+        self.name = name
+        self._pid = None
+        self._thread = None
+
+    def running(self):
+        """Whether the thread has been started in this process and not stopped since."""
+        return self._pid == os.getpid()
+
+    def start(self):
+        """Start the thread, unless it's already running in this process."""
+        if self.running():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self.target, name=self.name, daemon=True)
+        self._thread.start()
+
+    def join(self):
+        self._thread.join()
+
+    def stopped(self):
+        """Note that the thread has returned (or is about to), so the next start() starts another."""
+        self._pid = None
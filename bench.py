@@ -0,0 +1,273 @@
+"""Benchmark every route against a freshly seeded database.
+
+    python bench.py --users 100 --feedback 1000 --output bench.json
+    python bench.py --output new.json --compare bench.json
+
+Seeds N users x M feedback (SQLite in a temp directory unless --database-url is given), drives
+each route through the test client and writes latency percentiles and requests/sec per route
+as JSON.  With --compare, exits 1 if any route's p90 is more than --threshold slower than in
+the baseline report, or if any request failed.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from app import create_app
+
+
+def percentile(sorted_values, pct):
+    """Return the pct-th percentile of an already sorted list (nearest rank)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+def summarize(latencies, errors, elapsed):
+    """Summarize one route's latencies (seconds) as milliseconds plus throughput."""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p90_ms': round(percentile(latencies, 90) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        'rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+class Bench:
+    """Runs each route scenario against an app with a seeded database."""
+
+    def __init__(self, app, usernames, requests, concurrency):
+        self.app = app
+        self.usernames = usernames
+        self.requests = requests
+        self.concurrency = concurrency
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def next_number(self):
+        """Return a number unique across all threads, for generating new usernames."""
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    def logged_in_client(self, username):
+        client = self.app.test_client()
+        resp = client.post('/login', data={'username': username, 'password': 'password'})
+        assert resp.status_code == 302, f'could not log in {username}'
+        return client
+
+    def run(self, name, setup, request):
+        """Time request(client, state, i) self.requests times split over self.concurrency threads.
+
+        setup(thread number) returns (client, state) for each thread before the clock starts.
+        """
+        per_thread = [self.requests // self.concurrency + (1 if t < self.requests % self.concurrency else 0) for t in range(self.concurrency)]
+        prepared = [setup(t) for t in range(self.concurrency)]
+        latencies = []
+        errors = [0]
+        lock = threading.Lock()
+
+        def worker(t):
+            client, state = prepared[t]
+            mine = []
+            failed = 0
+            for i in range(per_thread[t]):
+                start = time.perf_counter()
+                resp = request(client, state, i)
+                mine.append(time.perf_counter() - start)
+                if resp.status_code >= 400:
+                    failed += 1
+            with lock:
+                latencies.extend(mine)
+                errors[0] += failed
+
+        threads = [threading.Thread(target=worker, args=(t,)) for t in range(self.concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        result = summarize(latencies, errors[0], elapsed)
+        print(f"{name:<20} p50 {result['p50_ms']:>9.2f}ms  p90 {result['p90_ms']:>9.2f}ms  p99 {result['p99_ms']:>9.2f}ms  {result['rps']:>9.1f} req/s  errors {result['errors']}")
+        return result
+
+    def owned_feedback_ids(self, username, count):
+        """Create count feedback rows for username and return their ids."""
+        from models import db, Feedback
+
+        with self.app.app_context():
+            rows = [Feedback(title=f'Bench {i}', content='Benchmark feedback.', username=username) for i in range(count)]
+            db.session.add_all(rows)
+            db.session.commit()
+            return [row.id for row in rows]
+
+    def scenarios(self):
+        from cache import fragment_cache
+
+        users = self.usernames
+
+        def anonymous(t):
+            return self.app.test_client(), None
+
+        def as_user(t):
+            username = users[t % len(users)]
+            return self.logged_in_client(username), username
+
+        def with_feedback(t):
+            client, username = as_user(t)
+            return client, (username, self.owned_feedback_ids(username, self.requests // self.concurrency + 1))
+
+        def register(client, state, i):
+            n = self.next_number()
+            return client.post('/register', data={
+                'username': f'bench{n}', 'password': 'password', 'email': f'bench{n}@example.com',
+                'first_name': 'Bench', 'last_name': 'Mark',
+            })
+
+        def login(client, state, i):
+            return client.post('/login', data={'username': users[i % len(users)], 'password': 'password'})
+
+        def user_page(client, username, i):
+            return client.get(f'/users/{username}')
+
+        def user_page_uncached(client, username, i):
+            fragment_cache.clear()
+            return client.get(f'/users/{username}')
+
+        def feedback_add(client, username, i):
+            return client.post(f'/users/{username}/feedback/add', data={'title': f'Added {i}', 'content': 'Benchmark feedback.'})
+
+        def feedback_update(client, state, i):
+            username, ids = state
+            return client.post(f'/feedback/{ids[0]}/update', data={'title': f'Updated {i}', 'content': 'Benchmark feedback.'})
+
+        def feedback_delete(client, state, i):
+            username, ids = state
+            return client.post(f'/feedback/{ids[i]}/delete')
+
+        def stats_page(client, username, i):
+            return client.get('/stats')
+
+        return [
+            ('register', anonymous, register),
+            ('login', anonymous, login),
+            ('user_page', as_user, user_page),
+            ('user_page_uncached', as_user, user_page_uncached),
+            ('feedback_add', as_user, feedback_add),
+            ('feedback_update', with_feedback, feedback_update),
+            ('feedback_delete', with_feedback, feedback_delete),
+            ('stats', as_user, stats_page),
+        ]
+
+
+def compare(report, baseline, threshold):
+    """Print how report compares to baseline and return the names of routes that regressed."""
+    regressions = []
+    for name, base in baseline['routes'].items():
+        current = report['routes'].get(name)
+        if current is None or not base['p90_ms']:
+            continue
+        change = (current['p90_ms'] - base['p90_ms']) / base['p90_ms']
+        flag = 'REGRESSION' if change > threshold else ''
+        print(f"{name:<20} p90 {base['p90_ms']:>9.2f}ms -> {current['p90_ms']:>9.2f}ms  {change:+7.1%}  {flag}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark every route against a seeded database.')
+    parser.add_argument('--database-url', help='database to seed and benchmark (it is dropped and recreated); defaults to a temporary SQLite file')
+    parser.add_argument('--users', type=int, default=20, help='users to seed')
+    parser.add_argument('--feedback', type=int, default=100, help='feedback to seed per user')
+    parser.add_argument('--requests', type=int, default=100, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=1, help='threads sending requests')
+    parser.add_argument('--bcrypt-rounds', type=int, default=10, help='bcrypt cost, login and register are dominated by it')
+    parser.add_argument('--output', default='bench.json', help='where to write the JSON report')
+    parser.add_argument('--compare', help='baseline JSON report to check for regressions against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed p90 slowdown before a route counts as regressed')
+    args = parser.parse_args(argv)
+
+    tmpdir = None
+    database_url = args.database_url
+    if not database_url:
+        tmpdir = tempfile.TemporaryDirectory()
+        database_url = f"sqlite:///{os.path.join(tmpdir.name, 'bench.db')}"
+
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database_url,
+        'SQLALCHEMY_ECHO': False,
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'SECRET_KEY': 'bench',
+        'BCRYPT_LOG_ROUNDS': args.bcrypt_rounds,
+        'DB_METRICS_ENDPOINT': False,
+        # every scenario comes from one address, so limits would just measure 429s
+        'RATELIMIT_ENABLED': False,
+    })
+
+    from models import db
+    from seed import seed_bulk
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        started = time.perf_counter()
+        usernames = seed_bulk(args.users, args.feedback)
+        print(f'seeded {args.users} users x {args.feedback} feedback in {time.perf_counter() - started:.1f}s')
+        dialect = db.engine.dialect.name
+
+    bench = Bench(app, usernames, args.requests, args.concurrency)
+    routes = {name: bench.run(name, setup, request) for name, setup, request in bench.scenarios()}
+
+    report = {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(),
+            'database': dialect,
+            'users': args.users,
+            'feedback_per_user': args.feedback,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'bcrypt_rounds': args.bcrypt_rounds,
+            'python': platform.python_version(),
+        },
+        'routes': routes,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'wrote {args.output}')
+
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+    failed = [name for name, result in routes.items() if result['errors']]
+    if failed:
+        print(f"requests failed for: {', '.join(failed)}")
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        differing = [key for key in ('database', 'users', 'feedback_per_user', 'concurrency', 'bcrypt_rounds') if baseline['meta'].get(key) != report['meta'][key]]
+        if differing:
+            print(f"warning: baseline was run with different {', '.join(differing)}")
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"regressed: {', '.join(regressions)}")
+
+    return 1 if failed or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+import csv
+import io
+import json
+
+from werkzeug.datastructures import MultiDict
+
+from forms import FeedbackForm
+from models import db, Feedback, UserStats
+from sharding import shard_router
+
+# Columns accepted on import and written on export
+FEEDBACK_FIELDS = ("title", "content")
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+CSV_MIMETYPE = "text/csv"
+
+# Most per-row errors reported back from one import, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+def read_ndjson(stream):
+    """Yield (line number, row dict) for each non-blank line of an NDJSON text stream."""
+    for line_no, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_no, row if isinstance(row, dict) else None
+
+def read_csv(stream):
+    """Yield (line number, row dict) for each record of a CSV text stream with a header row."""
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+def validate_feedback(row):
+    """Run a row through FeedbackForm's validators.
+
+    Returns (errors, None) for an invalid row, or (None, {field: value}) with the form's data.
+    """
+    if row is None:
+        return {"row": ["Not a JSON object."]}, None
+    # NDJSON values can be numbers, lists or objects, which the validators don't expect
+    wrong_type = {field: ["Must be a string."] for field in FEEDBACK_FIELDS if row.get(field) is not None and not isinstance(row[field], str)}
+    if wrong_type:
+        return wrong_type, None
+    formdata = MultiDict({field: row[field] for field in FEEDBACK_FIELDS if row.get(field) is not None})
+    form = FeedbackForm(formdata=formdata, meta={"csrf": False})
+    if not form.validate():
+        return form.errors, None
+    return None, {field: form[field].data for field in FEEDBACK_FIELDS}
+
+def import_feedback(username, rows, batch_size=1000):
+    """Insert valid rows as feedback for username using one multi-row INSERT per batch.
+
+    rows is an iterable of (line number, row dict), so uploads are consumed as they stream in
+    and memory use stays flat.  Nothing is committed; the caller owns the transaction.
+    Returns (number imported, number rejected, list of reported errors).
+    """
+    imported = rejected = 0
+    errors = []
+    batch = []
+
+    for line_no, row in rows:
+        row_errors, values = validate_feedback(row)
+        if row_errors:
+            rejected += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"line": line_no, "errors": row_errors})
+            continue
+
+        batch.append({**values, "username": username})
+        if len(batch) >= batch_size:
+            db.session.execute(Feedback.__table__.insert().values(shard_router.assign_feedback_ids(batch)))
+            imported += len(batch)
+            batch = []
+
+    if batch:
+        db.session.execute(Feedback.__table__.insert().values(shard_router.assign_feedback_ids(batch)))
+        imported += len(batch)
+
+    if imported:
+        UserStats.record_added(db.session, username, imported)
+
+    return imported, rejected, errors
+
+def export_feedback(username, fmt, chunk_size=1000):
+    """Yield a user's feedback as NDJSON lines or CSV text.
+
+    Rows come from a server-side cursor in chunks of chunk_size, so exports of any size stream
+    out without being loaded into memory first.
+    """
+    query = (
+        db.session.query(Feedback.id, Feedback.title, Feedback.content)
+        .filter(Feedback.username == username)
+        .order_by(Feedback.id)
+        .execution_options(stream_results=True)
+        .yield_per(chunk_size)
+    )
+
+    if fmt == "ndjson":
+        for id, title, content in query:
+            yield json.dumps({"id": id, "title": title, "content": content}) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(("id",) + FEEDBACK_FIELDS)
+    for count, row in enumerate(query, start=1):
+        writer.writerow(row)
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,146 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with optional expiry.
+
+    Holds at most maxsize entries, evicting the least recently used first.  Entries older
+    than ttl seconds (None for never) are treated as missing, and are dropped when they're
+    read or, once they reach the least recently used end, on the next set.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value for key, or default if it's missing or expired."""
+        with self._lock:
+            try:
+                value, expires_at = self._data[key]
+            except KeyError:
+                return default
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store value under key, expiring after ttl seconds (defaults to the cache's ttl)."""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            # keys that are never read again would otherwise stay until evicted by size
+            now = time.monotonic()
+            while self._data:
+                oldest_expiry = next(iter(self._data.values()))[1]
+                if oldest_expiry is None or oldest_expiry > now:
+                    break
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Remove key if it's cached."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove everything."""
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __len__(self):
+        return len(self._data)
+
+
+_missing = object()
+
+
+class FragmentCache:
+    """Cache rendered template fragments per user, invalidated by bumping that user's version.
+
+    Keys include the user's current version, so bump() makes all of their old fragments
+    unreachable at once and they simply age out of the backend.
+
+    The versions live in the backend too, so only a shared backend sees a bump made by another
+    process.  The in-process LRU is meant for a single process: with several workers, each one
+    can serve its own stale copy of a page until the entry expires, which is why it defaults
+    to a much shorter TTL.
+
+    Config:
+        FRAGMENT_CACHE_BACKEND: a shared cache to use instead of the in-process LRU.  Anything
+            with get(key), set(key, value, ttl=None) and delete(key) taking string keys will do.
+            Set it whenever the app runs in more than one process.
+        FRAGMENT_CACHE_SIZE: entries kept by the in-process LRU.
+        FRAGMENT_CACHE_TTL: seconds before an entry expires.  Defaults to 300 with a shared
+            backend and FRAGMENT_CACHE_LOCAL_TTL with the in-process one.
+        FRAGMENT_CACHE_LOCAL_TTL: the in-process default, i.e. how stale another worker's copy
+            of a page can get.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("FRAGMENT_CACHE_BACKEND", None)
+        app.config.setdefault("FRAGMENT_CACHE_SIZE", 2048)
+        app.config.setdefault("FRAGMENT_CACHE_LOCAL_TTL", 5)
+        shared = app.config["FRAGMENT_CACHE_BACKEND"] is not None
+        app.config.setdefault("FRAGMENT_CACHE_TTL", 300 if shared else app.config["FRAGMENT_CACHE_LOCAL_TTL"])
+        # checked against None, since an empty backend may well be falsy
+        self.backend = app.config["FRAGMENT_CACHE_BACKEND"] if shared else LRUCache(
+            maxsize=app.config["FRAGMENT_CACHE_SIZE"], ttl=app.config["FRAGMENT_CACHE_TTL"]
+        )
+        app.extensions["fragment_cache"] = self
+
+    def version(self, username):
+        """Return the current cache version for a user."""
+        version = self.backend.get(f"version:{username}")
+        if version is None:
+            # Random rather than a counter, so a version that fell out of the cache is never reused
+            version = self.bump(username)
+        return version
+
+    def bump(self, username):
+        """Give a user a new version, invalidating every fragment cached for them."""
+        version = uuid.uuid4().hex
+        self.backend.set(f"version:{username}", version)
+        return version
+
+    def key(self, username, *parts):
+        """Return the key for a fragment of a user's page at their current version."""
+        return ":".join(["fragment", username, self.version(username), *(str(part) for part in parts)])
+
+    def get(self, key):
+        """Return the cached fragment for key as Markup, or None."""
+        html = self.backend.get(key)
+        return Markup(html) if html is not None else None
+
+    def set(self, key, html, ttl=None):
+        """Cache a rendered fragment (for ttl seconds, default FRAGMENT_CACHE_TTL) and return it as Markup."""
+        self.backend.set(key, str(html), ttl=ttl)
+        return Markup(html)
+
+    def clear(self):
+        """Drop everything from the in-process backend."""
+        if isinstance(self.backend, LRUCache):
+            self.backend.clear()
+
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,114 @@
+import os
+
+
+def env_flag(name, default=False):
+    """Read a true/false setting from the environment."""
+    value = os.environ.get(name)
+    return default if value is None else value.lower() in ("1", "true", "yes", "on")
+
+
+class Config:
+    """Settings shared by every environment, overridable through environment variables."""
+
+    SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", "postgresql:///flask_feedback")
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Echo logs every statement synchronously, keep it for local debugging only
+    SQLALCHEMY_ECHO = env_flag("SQLALCHEMY_ECHO")
+
+    # Comma-separated read replica URLs, see replicas.py
+    SQLALCHEMY_REPLICA_URIS = [url for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url]
+
+    # Comma-separated shard URLs for users and their feedback, see sharding.py.  Only ever append.
+    SQLALCHEMY_SHARD_URIS = [url for url in os.environ.get("DATABASE_SHARD_URLS", "").split(",") if url]
+
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+    DB_POOL_PRE_PING = env_flag("DB_POOL_PRE_PING", True)
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 0))
+    # Query counts, timings and SQL, shown only to METRICS_ALLOWED_IPS, see instrumentation.py
+    DB_INSTRUMENTATION_HEADERS = env_flag("DB_INSTRUMENTATION_HEADERS")
+    DB_METRICS_ENDPOINT = env_flag("DB_METRICS_ENDPOINT")
+    METRICS_ALLOWED_IPS = os.environ.get("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+    # How listings load User/Feedback relationships: selectin, joined or select (lazy)
+    DB_RELATIONSHIP_LOADING = os.environ.get("DB_RELATIONSHIP_LOADING", "selectin")
+
+    # Fraction of requests to profile, see profiling.py; 0.01 is cheap enough for production
+    PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", 0))
+    # Serve the results from /metrics/profile, to METRICS_ALLOWED_IPS only
+    PROFILING_ENDPOINT = env_flag("PROFILING_ENDPOINT")
+
+    # Falls back to secret_keys.py when unset, see create_app
+    SECRET_KEY = os.environ.get("SECRET_KEY")
+
+    # The debug toolbar only loads in debug mode; let redirects through when it does
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+    BCRYPT_LOG_ROUNDS = int(os.environ.get("BCRYPT_LOG_ROUNDS", 12))
+
+    # POSTs allowed per client IP, and per logged-in user, on each endpoint
+    RATELIMIT_ENABLED = env_flag("RATELIMIT_ENABLED", True)
+    RATELIMITS = {
+        "users.login_user": "10/minute",
+        "users.register_user": "5/minute",
+        "feedback.show_new_feedback_form": "30/minute",
+    }
+
+    # Serve the feedback write routes with async views on an async engine, see asgi.py
+    ASYNC_MODE = env_flag("ASYNC_MODE")
+
+    FEEDBACK_PAGE_SIZE = 20
+    FEEDBACK_MAX_PAGE_SIZE = 100
+    FEEDBACK_SEARCH_MAX_PAGE = 50
+    FEEDBACK_IMPORT_BATCH_SIZE = 1000
+    FEEDBACK_EXPORT_CHUNK_SIZE = 1000
+    STATS_LEADERBOARD_SIZE = 10
+    # A feedback revision is stored whole this often, and as a delta against the one before otherwise
+    FEEDBACK_REVISION_SNAPSHOT_EVERY = 10
+    # Acknowledge new feedback at once and insert it in batches, see ingest.py
+    FEEDBACK_WRITE_BEHIND = env_flag("FEEDBACK_WRITE_BEHIND")
+
+    # Deleted users and feedback are tombstoned and hard-deleted later, see purge.py.  With the
+    # background purge off, run `flask purge-deleted` from cron instead.
+    PURGE_IN_BACKGROUND = env_flag("PURGE_IN_BACKGROUND", True)
+    PURGE_AFTER_SECONDS = int(os.environ.get("PURGE_AFTER_SECONDS", 0))
+
+
+class DevelopmentConfig(Config):
+    """Local development, with the debug toolbar."""
+
+    DEBUG = True
+    DB_INSTRUMENTATION_HEADERS = env_flag("DB_INSTRUMENTATION_HEADERS", True)
+    DB_METRICS_ENDPOINT = env_flag("DB_METRICS_ENDPOINT", True)
+    PROFILING_ENDPOINT = env_flag("PROFILING_ENDPOINT", True)
+
+
+class TestingConfig(Config):
+    """Test runs against the test database."""
+
+    SQLALCHEMY_DATABASE_URI = os.environ.get("TEST_DATABASE_URL", "postgresql:///flask_feedback_test_db")
+    SQLALCHEMY_ECHO = False
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    RATELIMIT_ENABLED = False
+    PURGE_IN_BACKGROUND = False
+    SECRET_KEY = "testing"
+    DB_INSTRUMENTATION_HEADERS = True
+    DB_METRICS_ENDPOINT = True
+    PROFILING_ENDPOINT = True
+
+
+# Chosen by FLASK_CONFIG, or FLASK_ENV=development, see config_from_env
+CONFIGS = {
+    "production": Config,
+    "development": DevelopmentConfig,
+    "testing": TestingConfig,
+}
+
+
+def config_from_env():
+    """Return the config class FLASK_CONFIG names, else DevelopmentConfig under FLASK_ENV=development, else Config."""
+    name = os.environ.get("FLASK_CONFIG") or ("development" if os.environ.get("FLASK_ENV") == "development" else "production")
+    if name not in CONFIGS:
+        raise ValueError(f"Unknown FLASK_CONFIG {name!r}, choose from {', '.join(CONFIGS)}.")
+    return CONFIGS[name]
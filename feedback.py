@@ -0,0 +1,206 @@
+import csv
+import io
+from datetime import datetime
+from flask import Blueprint, abort, current_app, render_template, redirect, session, flash, request, jsonify, Response, stream_with_context
+from sqlalchemy.orm import load_only
+from werkzeug.utils import secure_filename
+from models import Feedback, FeedbackRevision, db
+from cache import fragment_cache
+from purge import purger
+from ingest import write_behind
+from bulk import read_ndjson, read_csv, import_feedback, export_feedback, NDJSON_MIMETYPE, CSV_MIMETYPE
+from search import search_feedback
+from forms import FeedbackForm
+from assets import prerendered
+from replicas import read_only, note_write
+
+feedback_bp = Blueprint("feedback", __name__)
+
+# The add/update/delete views below have async twins in feedback_async.py for ASYNC_MODE.
+# Everything but their database calls lives in these helpers, so the two stay in step.
+# The feedback_* ones are for after the commit; the async views don't commit through
+# db.session, so these mark the write for read-your-writes themselves.
+
+def deny_unless_owner(username, action):
+    """Return the 401 page unless username is the one logged in, e.g. `deny_unless_owner(name, "editing feedback")`."""
+    if 'username' not in session or username != session['username']:
+        flash(f"Please log in before {action}.", "danger")
+        return prerendered('401.html'), 401
+    return None
+
+def queue_feedback(form, username):
+    """Hand new feedback to the write-behind queue, if it's on, and return the response for it."""
+    if not current_app.config["FEEDBACK_WRITE_BEHIND"]:
+        return None
+    write_behind.submit(form.title.data, form.content.data, username)
+    return feedback_queued(username)
+
+def feedback_queued(username):
+    # Saved in the next batch, which bumps the fragment cache once it's in
+    flash('Thanks for your feedback!  It will show up in a moment.', 'success')
+    return redirect(f'/users/{username}')
+
+def feedback_added(username):
+    note_write()
+    fragment_cache.bump(username)
+    flash('Successfully created new feedback!', 'success')
+    return redirect(f'/users/{username}')
+
+def feedback_updated(feedback):
+    note_write()
+    fragment_cache.bump(feedback.username)
+    flash(f'Successfully updated {feedback.title}!', 'success')
+    return redirect(f'/users/{feedback.username}')
+
+def feedback_deleted(username):
+    note_write()
+    purger.wake()
+    fragment_cache.bump(username)
+    flash('Successfully deleted feedback!', 'success')
+    return redirect(f'/users/{username}')
+
+@feedback_bp.route('/users/<username>/feedback/add', methods=["GET", "POST"])
+def show_new_feedback_form(username):
+    """Show feedback form and add to feedback to database."""
+    denied = deny_unless_owner(username, "adding new feedback")
+    if denied:
+        return denied
+    
+    form = FeedbackForm()
+    if form.validate_on_submit():
+        queued = queue_feedback(form, username)
+        if queued:
+            return queued
+        
+        new_feedback = Feedback(title=form.title.data, content=form.content.data, username=username)
+        db.session.add(new_feedback)
+        db.session.commit()
+        return feedback_added(username)
+    
+    return render_template('add_feedback_form.html', form=form)
+
+@feedback_bp.route('/feedback/<int:feedback_id>/update', methods=["GET", "POST"])
+@read_only
+def show_update_feedback_form(feedback_id):
+    """Show feedback update form and update feedback in database."""
+    feedback = Feedback.query.get_or_404(feedback_id)
+    
+    denied = deny_unless_owner(feedback.username, "editing feedback")
+    if denied:
+        return denied
+    
+    form = FeedbackForm(obj=feedback)
+    if form.validate_on_submit():
+        feedback.title = form.title.data
+        feedback.content = form.content.data
+        
+        db.session.add(feedback)
+        db.session.commit()
+        return feedback_updated(feedback)
+    
+    return render_template('update_feedback_form.html', form=form)
+
+@feedback_bp.route('/feedback/<int:feedback_id>/delete', methods=["POST"])
+def delete_feedback(feedback_id):
+    """Delete Feedback from database."""
+    feedback = Feedback.get_owned_or_404(feedback_id)
+    
+    denied = deny_unless_owner(feedback.username, "deleting feedback")
+    if denied:
+        return denied
+    
+    username = feedback.username
+    # Tombstoned for now, purged in the background
+    feedback.deleted_at = datetime.utcnow()
+    db.session.commit()
+    return feedback_deleted(username)
+
+@feedback_bp.route('/feedback/<int:feedback_id>/history')
+@read_only
+def show_feedback_history(feedback_id):
+    """Show a feedback's revisions, newest first."""
+    if 'username' not in session:
+        flash("Please log in before viewing feedback history.", "danger")
+        return prerendered('401.html'), 401
+    
+    feedback = Feedback.query.options(load_only(Feedback.id, Feedback.title, Feedback.username)).get_or_404(feedback_id)
+    return render_template('feedback_history.html', feedback=feedback, revisions=FeedbackRevision.history(feedback_id))
+
+@feedback_bp.route('/feedback/<int:feedback_id>/revisions/<int:number>')
+@read_only
+def show_feedback_revision(feedback_id, number):
+    """Show one revision of a feedback's title and content."""
+    if 'username' not in session:
+        flash("Please log in before viewing feedback history.", "danger")
+        return prerendered('401.html'), 401
+    
+    # the revisions of deleted feedback go with it
+    Feedback.get_owned_or_404(feedback_id)
+    found = FeedbackRevision.get_with_content(feedback_id, number)
+    if found is None:
+        abort(404)
+    revision, content = found
+    has_newer = FeedbackRevision.query.options(load_only(FeedbackRevision.number)).get((feedback_id, number + 1)) is not None
+    return render_template('feedback_revision.html', revision=revision, content=content, has_newer=has_newer)
+
+@feedback_bp.route('/users/<username>/feedback/import', methods=["POST"])
+def import_user_feedback(username):
+    """Bulk import feedback streamed as an NDJSON or CSV request body."""
+    if 'username' not in session or username != session['username']:
+        return jsonify(error="Please log in before importing feedback."), 401
+    
+    # Only raw NDJSON/CSV bodies are accepted, browsers can't send those cross-site without a CORS preflight
+    if request.mimetype == NDJSON_MIMETYPE:
+        reader = read_ndjson
+    elif request.mimetype == CSV_MIMETYPE:
+        reader = read_csv
+    else:
+        return jsonify(error=f"Send feedback as {NDJSON_MIMETYPE} or {CSV_MIMETYPE}."), 415
+    
+    stream = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+    try:
+        imported, rejected, errors = import_feedback(username, reader(stream), current_app.config["FEEDBACK_IMPORT_BATCH_SIZE"])
+        db.session.commit()
+    except (UnicodeDecodeError, csv.Error):
+        db.session.rollback()
+        return jsonify(error="The upload couldn't be read as UTF-8 NDJSON/CSV."), 400
+    
+    fragment_cache.bump(username)
+    return jsonify(imported=imported, rejected=rejected, errors=errors)
+
+@feedback_bp.route('/users/<username>/feedback/export')
+@read_only
+def export_user_feedback(username):
+    """Stream all of a user's feedback as NDJSON (default) or CSV."""
+    if 'username' not in session or username != session['username']:
+        return jsonify(error="Please log in before exporting feedback."), 401
+    
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify(error="format must be ndjson or csv."), 400
+    
+    rows = export_feedback(username, fmt, current_app.config["FEEDBACK_EXPORT_CHUNK_SIZE"])
+    return Response(
+        stream_with_context(rows),
+        mimetype=NDJSON_MIMETYPE if fmt == 'ndjson' else CSV_MIMETYPE,
+        headers={"Content-Disposition": f'attachment; filename="{secure_filename(username)}-feedback.{fmt}"'},
+    )
+
+@feedback_bp.route('/feedback/search')
+@read_only
+def search_feedback_page():
+    """Search feedback titles and content, optionally limited to one user."""
+    if 'username' not in session:
+        flash("Please log in before searching feedback.", "danger")
+        return prerendered('401.html'), 401
+    
+    q = request.args.get('q', '').strip()
+    username = request.args.get('username', '').strip()
+    per_page = current_app.config["FEEDBACK_PAGE_SIZE"]
+    # Results are paged by offset, so cap how deep a search can go
+    page = max(1, min(request.args.get('page', 1, type=int), current_app.config["FEEDBACK_SEARCH_MAX_PAGE"]))
+    
+    results, has_next = search_feedback(q, username=username or None, page=page, per_page=per_page) if q else ([], False)
+    has_next = has_next and page < current_app.config["FEEDBACK_SEARCH_MAX_PAGE"]
+    
+    return render_template('search.html', q=q, username=username, results=results, page=page, has_next=has_next)
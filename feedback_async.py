@@ -0,0 +1,82 @@
+import asyncio
+from datetime import datetime
+
+from flask import abort, current_app, render_template
+from sqlalchemy.orm import load_only
+
+from models import Feedback
+from async_db import async_db
+from ingest import write_behind
+from forms import FeedbackForm
+from feedback import deny_unless_owner, feedback_queued, feedback_added, feedback_updated, feedback_deleted
+
+# Async versions of the feedback write routes, swapped in for the sync ones when ASYNC_MODE is on.
+# They keep the same endpoints, URLs and templates, and share everything but their database
+# calls with the sync views in feedback.py; those calls go to the async engine instead.
+
+async def show_new_feedback_form(username):
+    """Show feedback form and add to feedback to database."""
+    denied = deny_unless_owner(username, "adding new feedback")
+    if denied:
+        return denied
+
+    form = FeedbackForm()
+    if form.validate_on_submit():
+        if current_app.config["FEEDBACK_WRITE_BEHIND"]:
+            # submit may fsync its spill file, so it waits in a thread rather than on the event loop
+            await asyncio.get_running_loop().run_in_executor(None, write_behind.submit, form.title.data, form.content.data, username)
+            return feedback_queued(username)
+
+        async with async_db.session() as s:
+            s.add(Feedback(title=form.title.data, content=form.content.data, username=username))
+            await s.commit()
+        return feedback_added(username)
+
+    return render_template('add_feedback_form.html', form=form)
+
+async def show_update_feedback_form(feedback_id):
+    """Show feedback update form and update feedback in database."""
+    async with async_db.session() as s:
+        feedback = await s.get(Feedback, feedback_id)
+        if feedback is None:
+            abort(404)
+
+        denied = deny_unless_owner(feedback.username, "editing feedback")
+        if denied:
+            return denied
+
+        form = FeedbackForm(obj=feedback)
+        if form.validate_on_submit():
+            feedback.title = form.title.data
+            feedback.content = form.content.data
+
+            await s.commit()
+            return feedback_updated(feedback)
+
+    return render_template('update_feedback_form.html', form=form)
+
+async def delete_feedback(feedback_id):
+    """Delete Feedback from database."""
+    async with async_db.session() as s:
+        feedback = await s.get(Feedback, feedback_id, options=[load_only(Feedback.id, Feedback.username)])
+        if feedback is None:
+            abort(404)
+
+        denied = deny_unless_owner(feedback.username, "deleting feedback")
+        if denied:
+            return denied
+
+        username = feedback.username
+        feedback.deleted_at = datetime.utcnow()
+        await s.commit()
+    return feedback_deleted(username)
+
+def use_async_views(app):
+    """Serve the feedback write routes with the async views above.
+
+    Under ASGI (asgi.py) they're awaited on the server's event loop; under a WSGI server or the
+    test client, Flask runs them on async_db's shared loop while the request's thread waits.
+    """
+    app.async_to_sync = async_db.async_to_sync
+    for view in (show_new_feedback_form, show_update_feedback_form, delete_feedback):
+        app.view_functions[f"feedback.{view.__name__}"] = view
@@ -1,19 +1,36 @@
+import re
 from turtle import title
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, EmailField, TextAreaField
-from wtforms.validators import InputRequired, Email
+from wtforms.validators import InputRequired, Email, Length, ValidationError
+from profiling import profile_phase
 
-class UserRegistrationForm(FlaskForm):
+# Control characters other than tab and line breaks.  Search uses some of them to mark matches
+# in snippets, so stored feedback mustn't contain them.
+CONTROL_CHARACTERS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+
+def no_control_characters(form, field):
+    if field.data and CONTROL_CHARACTERS.search(field.data):
+        raise ValidationError("Can't contain control characters.")
+
+class Form(FlaskForm):
+    """FlaskForm whose validation shows up as its own phase in request profiles."""
+    
+    def validate(self, extra_validators=None):
+        with profile_phase("forms"):
+            return super().validate(extra_validators)
+
+class UserRegistrationForm(Form):
     username = StringField("Username", validators=[InputRequired()])
     password = PasswordField("Password", validators=[InputRequired()])
     email = EmailField("Email", validators=[InputRequired(), Email()])
     first_name = StringField("First Name", validators=[InputRequired()])
     last_name = StringField("Last Name", validators=[InputRequired()])
 
-class UserLoginForm(FlaskForm):
+class UserLoginForm(Form):
     username = StringField("Username", validators=[InputRequired()])
     password = PasswordField("Password", validators=[InputRequired()])
     
-class FeedbackForm(FlaskForm):
-    title = StringField("Title", validators=[InputRequired()])
-    content = TextAreaField("Feedback Content", validators=[InputRequired()])
\ No newline at end of file
+class FeedbackForm(Form):
+    title = StringField("Title", validators=[InputRequired(), Length(max=100), no_control_characters])
+    content = TextAreaField("Feedback Content", validators=[InputRequired(), no_control_characters])
\ No newline at end of file
@@ -0,0 +1,132 @@
+import os
+import secrets
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+from flask import current_app, has_app_context
+from werkzeug.exceptions import ServiceUnavailable
+
+from profiling import profile_phase
+
+
+def _hash_password(password, rounds):
+    """Hash a password with bcrypt.  Runs inside a pool worker."""
+    return bcrypt.hashpw(password.encode("utf8"), bcrypt.gensalt(rounds)).decode("utf8")
+
+def _check_password(hashed, password):
+    """Check a password against a bcrypt hash.  Runs inside a pool worker."""
+    return bcrypt.checkpw(password.encode("utf8"), hashed.encode("utf8"))
+
+def hash_rounds(hashed):
+    """Return the bcrypt cost factor a hash was generated with."""
+    # bcrypt hashes look like $2b$12$<salt+checksum>
+    return int(hashed.split("$")[2])
+
+
+class PasswordHasher:
+    """Run bcrypt in a bounded process pool so hashing never pins the request threads.
+
+    Config:
+        BCRYPT_LOG_ROUNDS: bcrypt cost for new hashes.  Hashes made with another cost are
+            upgraded the next time their owner logs in.
+        PASSWORD_HASHER_WORKERS: pool size, defaults to the number of cores.  0 hashes inline.
+        PASSWORD_HASHER_QUEUE_SIZE: how many jobs may wait for a worker before we answer 503.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self._dummy_hashes = {}
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("BCRYPT_LOG_ROUNDS", 12)
+        app.config.setdefault("PASSWORD_HASHER_WORKERS", os.cpu_count() or 1)
+        app.config.setdefault("PASSWORD_HASHER_QUEUE_SIZE", 64)
+        app.extensions["password_hasher"] = self
+        # like db.app, lets scripts and tests hash outside of an app context
+        self.app = app
+        # made now rather than on the first unknown username, whose login would otherwise take
+        # an extra bcrypt and give away that the username doesn't exist
+        rounds = app.config["BCRYPT_LOG_ROUNDS"]
+        if rounds not in self._dummy_hashes:
+            self._dummy_hashes[rounds] = _hash_password(secrets.token_urlsafe(32), rounds)
+
+    @property
+    def config(self):
+        """Config of the current app, falling back to the app we were set up with."""
+        return current_app.config if has_app_context() else self.app.config
+
+    def _get_executor(self):
+        """Return the pool for this process, creating it on first use (and again after a fork)."""
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                workers = self.config["PASSWORD_HASHER_WORKERS"]
+                queue_size = self.config["PASSWORD_HASHER_QUEUE_SIZE"]
+                # spawn rather than fork so workers don't inherit the app's DB connections and threads
+                self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+                self._slots = threading.BoundedSemaphore(workers + queue_size)
+                self._pid = os.getpid()
+            return self._executor, self._slots
+
+    def submit(self, fn, *args):
+        """Queue fn(*args) on the pool and return its future.
+
+        Raises ServiceUnavailable straight away when the queue is full instead of making the request wait.
+        """
+        executor, slots = self._get_executor()
+        if not slots.acquire(blocking=False):
+            raise ServiceUnavailable("Too many logins in progress.  Please try again in a moment.", retry_after=1)
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(lambda f: slots.release())
+        return future
+
+    def _run(self, fn, *args):
+        with profile_phase("hashing"):
+            if not self.config["PASSWORD_HASHER_WORKERS"]:
+                return fn(*args)
+            return self.submit(fn, *args).result()
+
+    def generate_password_hash(self, password):
+        """Return a bcrypt hash of password at the configured cost."""
+        return self._run(_hash_password, password, self.config["BCRYPT_LOG_ROUNDS"])
+
+    def check_password_hash(self, hashed, password):
+        """Return True if password matches hashed."""
+        return self._run(_check_password, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Return True if hashed wasn't generated at the configured cost."""
+        return hash_rounds(hashed) != self.config["BCRYPT_LOG_ROUNDS"]
+
+    def dummy_hash(self):
+        """Return a hash at the configured cost that no password will match.
+
+        Checking against it costs the same as checking a real user's hash, so failed logins
+        for unknown usernames take as long as ones for real users.  The one for the configured
+        cost is made in init_app; only a cost changed after startup makes one here.
+        """
+        rounds = self.config["BCRYPT_LOG_ROUNDS"]
+        if rounds not in self._dummy_hashes:
+            self._dummy_hashes[rounds] = self.generate_password_hash(secrets.token_urlsafe(32))
+        return self._dummy_hashes[rounds]
+
+    def shutdown(self):
+        """Stop the pool's worker processes."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,293 @@
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select
+from werkzeug.exceptions import ServiceUnavailable
+
+from background import BackgroundThread
+from models import Feedback, User, UserStats
+from cache import fragment_cache
+from sharding import shard_router
+
+
+class SpillFile:
+    """An append-only NDJSON file holding rows that haven't reached the database yet.
+
+    It stays locked for as long as it's open, so a process replaying leftover spill files never
+    picks up one that a live process is still working through.
+    """
+
+    def __init__(self, path, mode="a"):
+        self.path = path
+        self.file = open(path, mode, encoding="utf8")
+        fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # rows appended so far, and how many of them the last fsync covered
+        self.written = 0
+        self.synced = 0
+        self._sync_lock = threading.Lock()
+
+    def append(self, row):
+        """Write a row out to the OS and return its number, for sync().  Callers serialize appends."""
+        self.file.write(json.dumps(row) + "\n")
+        self.file.flush()
+        self.written += 1
+        return self.written
+
+    def sync(self, upto):
+        """Make sure rows up to number upto are on disk.
+
+        Group commit: one fsync covers every row appended before it started, so concurrent
+        callers queue up behind a single fsync instead of paying for one each.
+        """
+        with self._sync_lock:
+            if self.synced >= upto or self.file.closed:
+                # covered by someone else's fsync, or already inserted and discarded
+                return
+            written = self.written
+            os.fsync(self.file.fileno())
+            self.synced = written
+
+    def rows(self):
+        """Read back the rows, skipping a line cut short by a crash."""
+        self.file.seek(0)
+        rows = []
+        for line in self.file:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                continue
+        return rows
+
+    def discard(self):
+        """Delete the file once its rows are safely in the database."""
+        with self._sync_lock:
+            os.remove(self.path)
+            self.file.close()
+
+
+class WriteBehindQueue:
+    """Acknowledge new feedback straight away and insert it in batches from a background thread.
+
+    Every accepted row is appended to a spill file before submit() returns.  Spill files left
+    behind by a crash are replayed when a process next starts the queue, which is on its first
+    submit(); run `flask replay-feedback` on boot so they don't wait for that.  Delivery is
+    at-least-once: a crash after a batch commits but before its spill file is deleted inserts
+    that batch again, as does a retry after some but not all of a batch's shards took it.
+
+    Config:
+        FEEDBACK_WRITE_BEHIND: accept new feedback through the queue (off by default).
+        FEEDBACK_WRITE_BEHIND_BATCH_SIZE: flush once this many rows are waiting...
+        FEEDBACK_WRITE_BEHIND_INTERVAL_MS: ...or once the oldest waiting row is this old.
+        FEEDBACK_WRITE_BEHIND_MAX_PENDING: rows allowed to wait before submissions get a 503.
+        FEEDBACK_WRITE_BEHIND_SPILL_DIR: where spill files live, defaults to <instance>/write-behind.
+        FEEDBACK_WRITE_BEHIND_FSYNC: fsync each row before acknowledging it, so it survives the
+            machine going down and not just the process.  The fsync happens outside the queue's
+            lock and is shared by every row appended while the previous one was running.
+    """
+
+    def __init__(self, app=None):
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = BackgroundThread(self._run, "feedback-write-behind")
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("FEEDBACK_WRITE_BEHIND", False)
+        app.config.setdefault("FEEDBACK_WRITE_BEHIND_BATCH_SIZE", 500)
+        app.config.setdefault("FEEDBACK_WRITE_BEHIND_INTERVAL_MS", 50)
+        app.config.setdefault("FEEDBACK_WRITE_BEHIND_MAX_PENDING", 10000)
+        app.config.setdefault("FEEDBACK_WRITE_BEHIND_SPILL_DIR", os.path.join(app.instance_path, "write-behind"))
+        app.config.setdefault("FEEDBACK_WRITE_BEHIND_FSYNC", True)
+        app.extensions["write_behind"] = self
+        app.cli.add_command(replay_command)
+        self.app = app
+
+    @property
+    def config(self):
+        return self.app.config
+
+    def _start(self):
+        """Start the flusher for this process (again after a fork), replaying leftover spill files."""
+        with self._cond:
+            if self._thread.running():
+                return
+            self._seq = 0
+            self._pending = []
+            self._oldest = None
+            # (rows, spill file) batches taken from pending that haven't been committed yet,
+            # including ones replayed from earlier processes and ones waiting for a retry
+            self._unflushed = []
+            self._waiting = 0
+            self._stopping = False
+            os.makedirs(self.config["FEEDBACK_WRITE_BEHIND_SPILL_DIR"], exist_ok=True)
+            self._replay()
+            self._spill = self._new_spill()
+            self._thread.start()
+        atexit.register(self.shutdown)
+
+    def _new_spill(self):
+        self._seq += 1
+        name = f"{os.getpid()}-{time.time_ns()}-{self._seq}.ndjson"
+        return SpillFile(os.path.join(self.config["FEEDBACK_WRITE_BEHIND_SPILL_DIR"], name))
+
+    def _replay(self):
+        spill_dir = self.config["FEEDBACK_WRITE_BEHIND_SPILL_DIR"]
+        for name in sorted(os.listdir(spill_dir)):
+            if not name.endswith(".ndjson"):
+                continue
+            try:
+                spill = SpillFile(os.path.join(spill_dir, name), mode="r+")
+            except (BlockingIOError, FileNotFoundError):
+                # still in use by a live process, or it finished with the file while we looked
+                continue
+            rows = spill.rows()
+            self._unflushed.append((rows, spill))
+            self._waiting += len(rows)
+
+    def submit(self, title, content, username):
+        """Accept one validated feedback row for the next batch.
+
+        Raises ServiceUnavailable when too many rows are already waiting for the database.
+        """
+        self._start()
+        row = {"title": title, "content": content, "username": username}
+        with self._cond:
+            if self._waiting >= self.config["FEEDBACK_WRITE_BEHIND_MAX_PENDING"]:
+                raise ServiceUnavailable("Too much feedback is arriving right now.  Please try again in a moment.", retry_after=1)
+            spill = self._spill
+            number = spill.append(row)
+            self._pending.append(row)
+            self._waiting += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+                self._cond.notify()
+            if len(self._pending) >= self.config["FEEDBACK_WRITE_BEHIND_BATCH_SIZE"]:
+                self._cond.notify()
+        if self.config["FEEDBACK_WRITE_BEHIND_FSYNC"]:
+            spill.sync(number)
+
+    def _take(self):
+        """Move the pending rows, and the spill file holding them, into the unflushed batches."""
+        if self._pending:
+            self._unflushed.append((self._pending, self._spill))
+            self._pending = []
+            self._oldest = None
+            self._spill = self._new_spill()
+
+    def _run(self):
+        interval = self.config["FEEDBACK_WRITE_BEHIND_INTERVAL_MS"] / 1000
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    if len(self._pending) >= self.config["FEEDBACK_WRITE_BEHIND_BATCH_SIZE"] or self._unflushed:
+                        break
+                    if self._oldest is None:
+                        self._cond.wait()
+                        continue
+                    remaining = interval - (time.monotonic() - self._oldest)
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopping:
+                    return
+            if not self.flush():
+                # the database is unhappy, back off before trying the same batches again
+                time.sleep(interval)
+
+    def flush(self):
+        """Insert everything waiting right now.  Returns False if the database refused it (it's kept for a retry)."""
+        if not self._thread.running():
+            return True
+        with self._flush_lock:
+            with self._cond:
+                self._take()
+                batches = list(self._unflushed)
+            for rows, spill in batches:
+                if not self._insert(rows):
+                    return False
+                spill.discard()
+                with self._cond:
+                    self._unflushed = [batch for batch in self._unflushed if batch[1] is not spill]
+                    self._waiting -= len(rows)
+            return True
+
+    def _insert(self, rows):
+        batch_size = self.config["FEEDBACK_WRITE_BEHIND_BATCH_SIZE"]
+        # Core on its own connections, so the flusher never touches a request's db.session
+        existing = set()
+        try:
+            with self.app.app_context():
+                for engine, shard_rows in shard_router.group_by_shard(rows):
+                    with engine.begin() as connection:
+                        existing |= self._insert_into(connection, shard_rows, batch_size)
+        except Exception:
+            self.app.logger.exception("Couldn't write %d buffered feedback rows, will retry", len(rows))
+            return False
+        for username in existing:
+            fragment_cache.bump(username)
+        return True
+
+    def _insert_into(self, connection, rows, batch_size):
+        # Feedback for users deleted since it was accepted would never be seen, drop it
+        usernames = {row["username"] for row in rows}
+        existing = set(connection.execute(
+            select(User.username).where(User.username.in_(usernames), User.deleted_at.is_(None))
+        ).scalars())
+        rows = shard_router.assign_feedback_ids([dict(row) for row in rows if row["username"] in existing])
+        for start in range(0, len(rows), batch_size):
+            connection.execute(Feedback.__table__.insert().values(rows[start:start + batch_size]))
+        for username, count in Counter(row["username"] for row in rows).items():
+            UserStats.record_added(connection, username, count)
+        return existing
+
+    def pending(self):
+        """Number of accepted rows not in the database yet."""
+        with self._cond:
+            return self._waiting if self._thread.running() else 0
+
+    def replay(self):
+        """Insert the rows in spill files left by processes that died, then stop the queue.
+
+        Returns how many rows there were, or None if the database refused them (their files are
+        kept for the next try).
+        """
+        self._start()
+        replayed = self.pending()
+        inserted = self.flush()
+        self.shutdown()
+        return replayed if inserted else None
+
+    def shutdown(self):
+        """Stop the flusher and write out whatever is still waiting."""
+        with self._cond:
+            if not self._thread.running() or self._stopping:
+                return
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+        with self._cond:
+            self._spill.discard()
+            self._thread.stopped()
+
+
+@click.command("replay-feedback")
+@with_appcontext
+def replay_command():
+    """Insert feedback spilled by processes that died, e.g. on boot before the app server starts."""
+    replayed = write_behind.replay()
+    if replayed is None:
+        raise click.ClickException("Couldn't write the spilled feedback, its files are kept for the next try.")
+    click.echo(f"Replayed {replayed} feedback rows.")
+
+
+write_behind = WriteBehindQueue()
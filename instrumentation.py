@@ -0,0 +1,138 @@
+import threading
+import time
+
+from flask import abort, current_app, g, has_app_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryStats:
+    """Query count, total DB time and slowest statement for one request."""
+
+    __slots__ = ("count", "total", "slowest", "slowest_statement")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.slowest:
+            self.slowest = elapsed
+            self.slowest_statement = statement
+
+
+class DBInstrumentation:
+    """Record how many queries each request makes and how long they take.
+
+    Config:
+        DB_INSTRUMENTATION: turn recording on (default True).
+        DB_INSTRUMENTATION_HEADERS: add X-DB-Query-Count, X-DB-Time-Ms and X-DB-Slowest-Ms to responses
+            (default False).
+        DB_METRICS_ENDPOINT: serve per-endpoint totals, SQL included, as JSON from /metrics/db (default False).
+        METRICS_ALLOWED_IPS: client addresses the headers and metrics endpoints are shown to, loopback only
+            by default.  Behind a proxy this is the proxy's address unless ProxyFix is in front.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("DB_INSTRUMENTATION", True)
+        app.config.setdefault("DB_INSTRUMENTATION_HEADERS", False)
+        app.config.setdefault("DB_METRICS_ENDPOINT", False)
+        app.config.setdefault("METRICS_ALLOWED_IPS", ["127.0.0.1", "::1"])
+        app.extensions["db_instrumentation"] = self
+
+        if not app.config["DB_INSTRUMENTATION"]:
+            return
+
+        _listen_for_queries()
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        if app.config["DB_METRICS_ENDPOINT"]:
+            app.add_url_rule("/metrics/db", "db_metrics", self.metrics)
+
+    def _start_request(self):
+        g.db_stats = QueryStats()
+
+    def _finish_request(self, response):
+        stats = g.pop("db_stats", None)
+        if stats is None:
+            return response
+
+        if request.endpoint:
+            self._aggregate(request.endpoint, stats)
+
+        if current_app.config["DB_INSTRUMENTATION_HEADERS"] and metrics_allowed():
+            response.headers["X-DB-Query-Count"] = str(stats.count)
+            response.headers["X-DB-Time-Ms"] = f"{stats.total * 1000:.2f}"
+            response.headers["X-DB-Slowest-Ms"] = f"{stats.slowest * 1000:.2f}"
+        return response
+
+    def _aggregate(self, endpoint, stats):
+        with self._lock:
+            totals = self.endpoints.setdefault(endpoint, {
+                "requests": 0, "queries": 0, "db_time_ms": 0.0, "max_queries": 0,
+                "slowest_ms": 0.0, "slowest_statement": None,
+            })
+            totals["requests"] += 1
+            totals["queries"] += stats.count
+            totals["db_time_ms"] += stats.total * 1000
+            totals["max_queries"] = max(totals["max_queries"], stats.count)
+            if stats.slowest * 1000 > totals["slowest_ms"]:
+                totals["slowest_ms"] = stats.slowest * 1000
+                totals["slowest_statement"] = stats.slowest_statement
+
+    def metrics(self):
+        """Per-endpoint query totals since the process started."""
+        if not metrics_allowed():
+            abort(404)
+        with self._lock:
+            return jsonify({endpoint: dict(totals) for endpoint, totals in self.endpoints.items()})
+
+    def reset(self):
+        """Forget the per-endpoint totals."""
+        with self._lock:
+            self.endpoints.clear()
+
+
+def metrics_allowed():
+    """Whether the current client may see query counts, timings and SQL."""
+    return request.remote_addr in current_app.config["METRICS_ALLOWED_IPS"]
+
+
+_listening = False
+
+def _listen_for_queries():
+    """Time every statement on every engine, crediting it to the current request if there is one."""
+    global _listening
+    if _listening:
+        return
+    _listening = True
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+        stats = g.get("db_stats") if has_app_context() else None
+        if stats is not None:
+            stats.record(statement, elapsed)
+
+    @event.listens_for(Engine, "handle_error")
+    def handle_error(context):
+        # a failed statement never reaches after_cursor_execute, drop its start time
+        if context.connection is not None and context.connection.info.get("query_start_time"):
+            context.connection.info["query_start_time"].pop()
+
+
+db_instrumentation = DBInstrumentation()
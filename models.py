@@ -1,23 +1,110 @@
+from collections import namedtuple
+from datetime import datetime
 from enum import unique
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
+from sqlalchemy import event, and_, case, func, or_, select, DDL
+from sqlalchemy.orm import Session, attributes, joinedload, lazyload, load_only, selectinload, sessionmaker, with_loader_criteria
+from hashing import password_hasher
+from cache import LRUCache
+from replicas import RoutingSession
+from sharding import shard_router
+from revisions import make_snapshot, read_snapshot, make_delta, apply_delta
 
-db = SQLAlchemy()
+class ConfiguredSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy whose engine takes its pool settings from the app config.
 
-bcrypt = Bcrypt()
+    Config:
+        DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE: pool sizing (ignored for SQLite).
+        DB_POOL_PRE_PING: test connections before handing them out.
+        DB_STATEMENT_TIMEOUT_MS: Postgres statement_timeout for every connection, 0 for none.
+    Anything in SQLALCHEMY_ENGINE_OPTIONS still wins.  Replica and shard engines get the same settings.  SQLite connections get foreign keys turned
+    on, since deleting users relies on the database cascading to their feedback.
+    """
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+        
+        if sa_url.get_backend_name() != "sqlite":
+            options.setdefault("pool_size", app.config.get("DB_POOL_SIZE", 5))
+            options.setdefault("max_overflow", app.config.get("DB_MAX_OVERFLOW", 10))
+            options.setdefault("pool_recycle", app.config.get("DB_POOL_RECYCLE", 1800))
+        options.setdefault("pool_pre_ping", app.config.get("DB_POOL_PRE_PING", True))
+        
+        timeout = app.config.get("DB_STATEMENT_TIMEOUT_MS")
+        if timeout and sa_url.get_backend_name() == "postgresql":
+            connect_args = options.setdefault("connect_args", {})
+            connect_args["options"] = f"{connect_args.get('options', '')} -c statement_timeout={int(timeout)}".strip()
+        
+        return sa_url, options
+
+    def create_session(self, options):
+        # RoutingSession can send read_only views' queries to a replica, see replicas.py
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        if engine.dialect.name == "sqlite":
+            event.listen(engine, "connect", _sqlite_foreign_keys)
+        return engine
+
+def _sqlite_foreign_keys(dbapi_connection, connection_record):
+    dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+db = ConfiguredSQLAlchemy()
+
+# Loader option for each DB_RELATIONSHIP_LOADING strategy
+RELATIONSHIP_LOADERS = {"selectin": selectinload, "joined": joinedload, "select": lazyload}
+
+# Usernames that recently failed to log in because they don't exist.  Kept short-lived since
+# other processes won't see register_user invalidate it.
+unknown_usernames = LRUCache(maxsize=10000, ttl=60)
+
+# Feedback ids are 64-bit, since with shards they end in the user's bucket (see sharding.py).
+# SQLite only autoincrements an INTEGER PRIMARY KEY, and its integers are 64-bit anyway.
+FeedbackId = db.BigInteger().with_variant(db.Integer(), "sqlite")
+
+# One keyset page of feedback; cursors are feedback ids (or None when there is no such page)
+FeedbackPage = namedtuple("FeedbackPage", ["items", "prev_cursor", "next_cursor"])
 
 
 def connect_db(app):
     """Connect to database."""
 
+    app.config.setdefault("DB_RELATIONSHIP_LOADING", "selectin")
+    app.config.setdefault("FEEDBACK_REVISION_SNAPSHOT_EVERY", 10)
     db.app = app
     db.init_app(app)
 
-class User(db.Model):
+def eager(relationship):
+    """Return a loader option for relationship (e.g. Feedback.user) using DB_RELATIONSHIP_LOADING.
+
+    "selectin" loads the related rows for a whole result in one extra IN query, "joined" pulls them
+    into the same query with a LEFT JOIN, and "select" leaves them lazy (one query per row).
+    """
+    return RELATIONSHIP_LOADERS[current_app.config["DB_RELATIONSHIP_LOADING"]](relationship)
+
+class SoftDelete:
+    """Rows that are tombstoned by setting deleted_at, and hard-deleted later by purge.py.
+
+    ORM queries leave tombstoned rows out on their own (see _hide_deleted below); pass
+    execution_options(include_deleted=True) to see them.  Core statements have to filter on
+    deleted_at themselves.
+    """
+    
+    deleted_at = db.Column(db.DateTime)
+
+class User(SoftDelete, db.Model):
     
     __tablename__ = "users"
     
+    # Users, and everything hanging off them, live on the shard their username hashes to
+    __shard_key__ = "username"
+    
     username = db.Column(db.String(20), primary_key=True)
+    
+    # The username's bucket, kept on the row so moving a bucket can find its users by index
+    shard_bucket = db.Column(db.Integer, index=True)
 
     password = db.Column(db.Text, nullable=False)
     
@@ -27,7 +114,12 @@ class User(db.Model):
     
     last_name = db.Column(db.String(30), nullable=False)
     
-    feedback = db.relationship("Feedback", backref="user")
+    # Drives API ETags/Last-Modified, so it changes whenever the row does
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # The feedback.username foreign key cascades deletes, so deleting a user leaves the rows to the
+    # database instead of loading every one of them first
+    feedback = db.relationship("Feedback", backref="user", cascade="all, delete-orphan", passive_deletes=True)
     
     def __repr__(self):
         """Representation of User."""
@@ -41,30 +133,49 @@ class User(db.Model):
     @classmethod
     def registerUser(cls, username, password, email, first_name, last_name):
         """Hash password and create user."""
-        # hash password
-        hashed = bcrypt.generate_password_hash(password)
-        # turn bytestring into normal (unicode utf8) string
-        hashed_utf8 = hashed.decode("utf8")
-        return cls(username=username, password=hashed_utf8, email=email, first_name=first_name, last_name=last_name)
+        # hash password on the hashing pool, comes back as a normal (unicode utf8) string
+        hashed = password_hasher.generate_password_hash(password)
+        return cls(username=username, password=hashed, email=email, first_name=first_name, last_name=last_name)
     
     @classmethod
     def authenticate(cls, username, password):
         """Validate that user exists & password is correct.
 
         Return user if valid; else return False.
+        Unknown usernames still pay for a bcrypt check (against a dummy hash) so they can't be told
+        apart by timing, and are remembered so repeat attempts don't touch the database.
         """
+        if username in unknown_usernames:
+            password_hasher.check_password_hash(password_hasher.dummy_hash(), password)
+            return False
+        
         user = User.query.filter_by(username=username).first()
         
-        if user and bcrypt.check_password_hash(user.password, password):
+        if user is None:
+            unknown_usernames.set(username, True)
+            password_hasher.check_password_hash(password_hasher.dummy_hash(), password)
+            return False
+        
+        if password_hasher.check_password_hash(user.password, password):
+            if password_hasher.needs_rehash(user.password):
+                # BCRYPT_LOG_ROUNDS changed since this hash was made, upgrade it while we have the password
+                user.password = password_hasher.generate_password_hash(password)
+                db.session.commit()
             return user
         else:
             return False
         
-class Feedback(db.Model):
+class Feedback(SoftDelete, db.Model):
     
     __tablename__ = "feedback"
     
-    id = db.Column(db.Integer, primary_key=True, autoincrement = True)
+    # Serves the per-user listing: WHERE username = ? AND id > ? ORDER BY id LIMIT ?
+    __table_args__ = (db.Index("ix_feedback_username_id", "username", "id"),)
+    
+    __shard_key__ = "username"
+    
+    # Assigned by shard_router when sharding is on, see _assign_feedback_id
+    id = db.Column(FeedbackId, primary_key=True, autoincrement = True)
     
     title = db.Column(db.String(100), nullable=False)
     
@@ -72,6 +183,386 @@ class Feedback(db.Model):
     
     username = db.Column(db.String(20), db.ForeignKey("users.username", ondelete="cascade"))
     
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
     def __repr__(self):
         """Representation of Feedback."""
-        return f"<Feedback id={self.id} title={self.title} content={self.content} username={self.username}>"
\ No newline at end of file
+        return f"<Feedback id={self.id} title={self.title} content={self.content} username={self.username}>"
+    
+    @classmethod
+    def page_for_user(cls, username, after=None, before=None, per_page=20):
+        """Return a FeedbackPage of a user's feedback ordered by id.
+
+        Uses keyset pagination so the cost of a page doesn't depend on how much feedback the user has.
+        Pass after=<id> for the page following that id or before=<id> for the page preceding it.
+        """
+        query = cls.query.filter(cls.username == username)
+        
+        if before is not None:
+            # Walk backwards from the cursor, then flip the rows back into ascending order
+            rows = query.filter(cls.id < before).order_by(cls.id.desc()).limit(per_page + 1).all()
+            items = list(reversed(rows[:per_page]))
+            prev_cursor = items[0].id if len(rows) > per_page else None
+            next_cursor = items[-1].id if items else None
+            return FeedbackPage(items, prev_cursor, next_cursor)
+        
+        rows = (query if after is None else query.filter(cls.id > after)).order_by(cls.id).limit(per_page + 1).all()
+        items = rows[:per_page]
+        prev_cursor = None
+        if after is not None and items:
+            # A cursor doesn't promise anything is left before it (after=0, or older feedback deleted), so probe for a row
+            earlier = query.filter(cls.id < items[0].id).with_entities(cls.id).limit(1).first()
+            prev_cursor = items[0].id if earlier is not None else None
+        next_cursor = items[-1].id if len(rows) > per_page else None
+        return FeedbackPage(items, prev_cursor, next_cursor)
+    
+    @classmethod
+    def get_owned_or_404(cls, feedback_id):
+        """Fetch just enough of a feedback row to check who owns it, leaving the content unloaded."""
+        return cls.query.options(load_only(cls.id, cls.username)).get_or_404(feedback_id)
+
+class UserStats(db.Model):
+    """Per-user feedback counters, kept in step with the feedback table as it changes.
+
+    Lives apart from users so counter updates don't touch users.updated_at (and the API ETags
+    built from it).  ORM writes are counted by the mapper events below; bulk Core inserts skip
+    those, so they call record_new_users and record_added themselves, and reconcile_user_stats()
+    in stats.py repairs any drift.
+    """
+    
+    __tablename__ = "user_stats"
+    
+    __shard_key__ = "username"
+    
+    username = db.Column(db.String(20), db.ForeignKey("users.username", ondelete="cascade"), primary_key=True)
+    
+    feedback_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    # updated_at of the user's most recently added or edited feedback
+    last_feedback_at = db.Column(db.DateTime, index=True)
+    
+    def __repr__(self):
+        """Representation of UserStats."""
+        return f"<UserStats username={self.username} feedback_count={self.feedback_count} last_feedback_at={self.last_feedback_at}>"
+    
+    @classmethod
+    def record_new_users(cls, executor, usernames):
+        """Start the counters of users just added, who have no feedback yet."""
+        executor.execute(cls.__table__.insert(), [{"username": username, "feedback_count": 0} for username in usernames])
+    
+    @classmethod
+    def record_added(cls, executor, username, count=1, at=None):
+        """Count `count` new (or, with count=0, edited) feedback for username, last written at `at`.
+
+        executor is a Session or Connection, so the change commits with the feedback itself.
+        """
+        table = cls.__table__
+        at = at or datetime.utcnow()
+        executor.execute(
+            table.update()
+            .where(table.c.username == username)
+            .values(
+                feedback_count=table.c.feedback_count + count,
+                last_feedback_at=case(
+                    (or_(table.c.last_feedback_at.is_(None), table.c.last_feedback_at < at), at),
+                    else_=table.c.last_feedback_at,
+                ),
+            )
+        )
+    
+    @classmethod
+    def record_removed(cls, executor, username, count=1, at=None):
+        """Uncount `count` deleted feedback for username, the newest of which was written at `at`.
+
+        last_feedback_at is only looked up again if the newest feedback may have gone (at is
+        None when that isn't known).
+        """
+        table = cls.__table__
+        latest = (
+            select(func.max(Feedback.updated_at))
+            .where(Feedback.username == username, Feedback.deleted_at.is_(None))
+            .scalar_subquery()
+        )
+        executor.execute(
+            table.update()
+            .where(table.c.username == username)
+            .values(
+                feedback_count=table.c.feedback_count - count,
+                last_feedback_at=latest if at is None else case((table.c.last_feedback_at <= at, latest), else_=table.c.last_feedback_at),
+            )
+        )
+
+class FeedbackRevision(db.Model):
+    """One version of a feedback row's title and content, kept when the feedback is edited.
+
+    Revision 1 is the version from before the first edit (feedback that's never edited has no
+    revisions) and the newest revision matches the feedback row.  Content is stored as a
+    compressed delta against the previous revision, with a full snapshot every
+    FEEDBACK_REVISION_SNAPSHOT_EVERY revisions, so any revision is rebuilt from one snapshot and
+    a few deltas fetched in a single query.  Titles are short and kept whole.
+    """
+    
+    __tablename__ = "feedback_revisions"
+    
+    __shard_key__ = "feedback_id"
+    
+    feedback_id = db.Column(FeedbackId, db.ForeignKey("feedback.id", ondelete="cascade"), primary_key=True)
+    
+    number = db.Column(db.Integer, primary_key=True)
+    
+    title = db.Column(db.String(100), nullable=False)
+    
+    is_snapshot = db.Column(db.Boolean, nullable=False)
+    
+    # zlib-compressed content if is_snapshot, else a delta from revisions.make_delta
+    data = db.Column(db.LargeBinary, nullable=False)
+    
+    # when this version was written
+    created_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        """Representation of FeedbackRevision."""
+        return f"<FeedbackRevision feedback_id={self.feedback_id} number={self.number} title={self.title}>"
+    
+    @classmethod
+    def history(cls, feedback_id):
+        """Return a feedback's revisions newest first, without their content."""
+        return (
+            cls.query.filter(cls.feedback_id == feedback_id)
+            .options(load_only(cls.number, cls.title, cls.created_at))
+            .order_by(cls.number.desc())
+            .all()
+        )
+    
+    @classmethod
+    def get_with_content(cls, feedback_id, number):
+        """Return (revision, content) for one revision of a feedback, or None if there's no such revision."""
+        snapshot = (
+            select(func.max(cls.number))
+            .where(cls.feedback_id == feedback_id, cls.is_snapshot, cls.number <= number)
+            .scalar_subquery()
+        )
+        rows = cls.query.filter(cls.feedback_id == feedback_id, cls.number.between(snapshot, number)).order_by(cls.number).all()
+        if not rows or rows[-1].number != number:
+            return None
+        content = read_snapshot(rows[0].data)
+        for row in rows[1:]:
+            content = apply_delta(content, row.data)
+        return rows[-1], content
+    
+    @classmethod
+    def record(cls, executor, feedback_id, title, content, at, previous=None):
+        """Add the next revision of a feedback.
+
+        previous is the (title, content, written at) of the version being replaced, or None if
+        it isn't known.  It's only needed for the delta, and to record it as revision 1 when
+        the feedback has no revisions yet.
+        """
+        table = cls.__table__
+        feedback = Feedback.__table__
+        # concurrent edits of one feedback wait their turn here, rather than both taking the next number
+        executor.execute(select(feedback.c.id).where(feedback.c.id == feedback_id).with_for_update())
+        last_number, last_snapshot = executor.execute(
+            select(func.max(table.c.number), func.max(case((table.c.is_snapshot, table.c.number))))
+            .where(table.c.feedback_id == feedback_id)
+        ).one()
+        rows = []
+        if last_number is None and previous is not None:
+            previous_title, previous_content, previous_at = previous
+            last_number = last_snapshot = 1
+            rows.append(dict(
+                feedback_id=feedback_id, number=1, title=previous_title, is_snapshot=True,
+                data=make_snapshot(previous_content), created_at=previous_at or at,
+            ))
+        
+        number = (last_number or 0) + 1
+        snapshot = make_snapshot(content)
+        is_snapshot = previous is None or number - last_snapshot >= current_app.config["FEEDBACK_REVISION_SNAPSHOT_EVERY"]
+        data = snapshot
+        if not is_snapshot:
+            data = make_delta(previous[1], content)
+            if len(data) >= len(snapshot):
+                # rewritten rather than edited, the delta saves nothing
+                is_snapshot, data = True, snapshot
+        rows.append(dict(feedback_id=feedback_id, number=number, title=title, is_snapshot=is_snapshot, data=data, created_at=at))
+        executor.execute(table.insert(), rows)
+
+class ShardBucket(db.Model):
+    """Which shard a bucket of users lives on, and where it's moving to mid-move (see sharding.py).
+
+    Kept in the main database, like IdBlock.
+    """
+    
+    __tablename__ = "shard_buckets"
+    
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    
+    shard = db.Column(db.Integer, nullable=False)
+    
+    moving_to = db.Column(db.Integer)
+    
+    def __repr__(self):
+        """Representation of ShardBucket."""
+        return f"<ShardBucket bucket={self.bucket} shard={self.shard} moving_to={self.moving_to}>"
+
+class IdBlock(db.Model):
+    """The next unreserved value of a sequence shared by the shards, handed out in blocks."""
+    
+    __tablename__ = "id_blocks"
+    
+    name = db.Column(db.String(30), primary_key=True)
+    
+    next_value = db.Column(db.BigInteger, nullable=False)
+    
+    def __repr__(self):
+        """Representation of IdBlock."""
+        return f"<IdBlock name={self.name} next_value={self.next_value}>"
+
+class UserEmail(db.Model):
+    """Which user an email belongs to, across every shard (see ShardRouter.claim_emails).
+
+    Each shard's unique index only covers its own users.  Kept in the main database, like
+    ShardBucket, and only used while sharding is on.
+    """
+    
+    __tablename__ = "user_emails"
+    
+    email = db.Column(db.String(50), primary_key=True)
+    
+    username = db.Column(db.String(20), nullable=False, index=True)
+    
+    claimed_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        """Representation of UserEmail."""
+        return f"<UserEmail email={self.email} username={self.username}>"
+
+class MovedFeedback(db.Model):
+    """The new id of feedback migrated off the main database, so links to the old one still work.
+
+    See migrate_main_database in sharding.py.  Kept in the main database.
+    """
+    
+    __tablename__ = "moved_feedback"
+    
+    old_id = db.Column(FeedbackId, primary_key=True, autoincrement=False)
+    
+    new_id = db.Column(FeedbackId, nullable=False)
+    
+    def __repr__(self):
+        """Representation of MovedFeedback."""
+        return f"<MovedFeedback old_id={self.old_id} new_id={self.new_id}>"
+
+# Serves the leaderboard: ORDER BY feedback_count DESC, username LIMIT n
+db.Index("ix_user_stats_leaderboard", UserStats.feedback_count.desc(), UserStats.username)
+
+# Tombstones are few (the purge job keeps clearing them), so partial indexes on just those rows
+# keep the purge job's lookups and the deleted-users subquery below tiny
+for model in (User, Feedback):
+    db.Index(
+        f"ix_{model.__tablename__}_deleted_at",
+        model.deleted_at,
+        postgresql_where=model.deleted_at.isnot(None),
+        sqlite_where=model.deleted_at.isnot(None),
+    )
+
+# Usernames of tombstoned users, whose feedback is hidden along with them until it's purged.
+# Built on the table rather than the model so the User criteria below doesn't apply inside it.
+_deleted_usernames = select(User.__table__.c.username).where(User.__table__.c.deleted_at.isnot(None)).scalar_subquery()
+
+@event.listens_for(Session, "do_orm_execute")
+def _hide_deleted(state):
+    # Relationship and column loads get the criteria from the query that started them
+    if (
+        state.is_select
+        and not state.is_column_load
+        and not state.is_relationship_load
+        and not state.execution_options.get("include_deleted", False)
+    ):
+        state.statement = state.statement.options(
+            with_loader_criteria(User, User.deleted_at.is_(None), include_aliases=True),
+            with_loader_criteria(
+                Feedback,
+                and_(Feedback.deleted_at.is_(None), Feedback.username.notin_(_deleted_usernames)),
+                include_aliases=True,
+            ),
+        )
+
+@event.listens_for(User, "before_insert")
+def _claim_email(mapper, connection, user):
+    # a shard's unique index can't see the other shards' users
+    if shard_router.enabled():
+        shard_router.claim_emails([(user.username, user.email)])
+        user.shard_bucket = shard_router.bucket_for_username(user.username)
+
+@event.listens_for(User, "after_insert")
+def _create_user_stats(mapper, connection, user):
+    UserStats.record_new_users(connection, [user.username])
+
+@event.listens_for(Feedback, "before_insert")
+def _assign_feedback_id(mapper, connection, feedback):
+    # no shard can autoincrement ids unique across all of them
+    if feedback.id is None and shard_router.enabled():
+        feedback.id = shard_router.new_feedback_ids(feedback.username)[0]
+
+@event.listens_for(Feedback, "after_insert")
+def _count_new_feedback(mapper, connection, feedback):
+    UserStats.record_added(connection, feedback.username, at=feedback.updated_at)
+
+@event.listens_for(Feedback, "before_update")
+def _record_revision(mapper, connection, feedback):
+    # without loading either, e.g. when a delete fetched only the owner
+    title = attributes.get_history(feedback, "title", attributes.PASSIVE_NO_INITIALIZE)
+    content = attributes.get_history(feedback, "content", attributes.PASSIVE_NO_INITIALIZE)
+    if not (title.added or content.added):
+        return
+    if (content.added and not content.deleted) or (title.added and not title.deleted):
+        # the replaced value wasn't loaded, but the row still has it until this update runs
+        table = Feedback.__table__
+        previous = tuple(connection.execute(
+            select(table.c.title, table.c.content, table.c.updated_at).where(table.c.id == feedback.id)
+        ).one())
+    else:
+        state = attributes.instance_dict(feedback)
+        previous = (
+            title.deleted[0] if title.deleted else feedback.title,
+            content.deleted[0] if content.deleted else feedback.content,
+            state.get("updated_at"),
+        )
+    # stamped here rather than by onupdate, so the row and its revision have the same time
+    feedback.updated_at = datetime.utcnow()
+    FeedbackRevision.record(connection, feedback.id, feedback.title, feedback.content, feedback.updated_at, previous)
+
+@event.listens_for(Feedback, "after_update")
+def _count_edited_feedback(mapper, connection, feedback):
+    if feedback.deleted_at is not None and attributes.get_history(feedback, "deleted_at").added:
+        # just tombstoned; it may have been the newest, and its updated_at is now the time of deletion
+        UserStats.record_removed(connection, feedback.username)
+    else:
+        UserStats.record_added(connection, feedback.username, count=0, at=feedback.updated_at)
+
+@event.listens_for(Feedback, "after_delete")
+def _count_deleted_feedback(mapper, connection, feedback):
+    state = attributes.instance_dict(feedback)
+    if state.get("deleted_at") is not None:
+        # uncounted when it was tombstoned
+        return
+    # updated_at isn't loaded when the row was fetched for an ownership check only; don't load it now
+    UserStats.record_removed(connection, feedback.username, at=state.get("updated_at"))
+
+# On Postgres, feedback gets a generated tsvector of title + content with a GIN index for /feedback/search.
+# It isn't mapped on the model since it's maintained by the database and only used in search queries.
+event.listen(
+    Feedback.__table__,
+    "after_create",
+    DDL(
+        "ALTER TABLE feedback ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(content, '')), 'B')) STORED"
+    ).execute_if(dialect="postgresql"),
+)
+event.listen(
+    Feedback.__table__,
+    "after_create",
+    DDL("CREATE INDEX ix_feedback_search_vector ON feedback USING GIN (search_vector)").execute_if(dialect="postgresql"),
+)
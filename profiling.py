@@ -0,0 +1,340 @@
+import atexit
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import Response, abort, current_app, g, has_request_context, jsonify, request
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from background import BackgroundThread
+from instrumentation import metrics_allowed
+
+# Phases a sampled request's time is split into; time outside all of them counts as "other"
+PHASES = ("db", "template", "forms", "hashing", "other")
+
+
+class Profile:
+    """Where one sampled request spent its time.
+
+    Phases nest (a template can trigger a lazy load), and time is charged only to the innermost
+    one, so the phase timings add up to the request's total.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.thread_id = threading.get_ident()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.stacks = Counter()
+        self._active = []
+        self.started = self._mark = time.perf_counter()
+
+    @property
+    def phase(self):
+        # slicing rather than indexing, as the sampler thread reads this while the request runs
+        return (self._active[-1:] or ["other"])[0]
+
+    def _charge(self):
+        now = time.perf_counter()
+        self.phases[self.phase] += now - self._mark
+        self._mark = now
+
+    def enter(self, phase):
+        self._charge()
+        self._active.append(phase)
+
+    def exit(self, phase):
+        # tolerate an exit without its enter, e.g. a statement that started before the profile
+        if self._active and self._active[-1] == phase:
+            self._charge()
+            self._active.pop()
+
+    def finish(self):
+        self._charge()
+        self._active.clear()
+        return self._mark - self.started
+
+
+def _current_profile():
+    return g.get("profile") if has_request_context() else None
+
+@contextmanager
+def profile_phase(phase):
+    """Charge the time spent in the block to phase if this request is being profiled."""
+    profile = _current_profile()
+    if profile is None:
+        yield
+        return
+    profile.enter(phase)
+    try:
+        yield
+    finally:
+        profile.exit(phase)
+
+
+def collapse(frame, phase):
+    """Turn a frame's stack into a collapsed-stack line, outermost first, with the phase as the leaf."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+        frame = frame.f_back
+    names.reverse()
+    names.append(f"[{phase}]")
+    return ";".join(names)
+
+
+class StackSampler:
+    """Sample the stacks of the threads serving profiled requests every interval seconds.
+
+    Its thread sleeps on a condition while no profiled request is running, so requests that
+    aren't sampled cost it nothing.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._profiles = {}
+        self._thread = BackgroundThread(self._run, "profile-sampler")
+
+    def add(self, profile):
+        with self._cond:
+            self._thread.start()
+            self._profiles[profile.thread_id] = profile
+            self._cond.notify()
+
+    def remove(self, profile):
+        with self._cond:
+            if self._profiles.get(profile.thread_id) is profile:
+                del self._profiles[profile.thread_id]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._profiles:
+                    self._cond.wait()
+                # under the lock, so a finished request's stacks are never counted while being totted up
+                frames = sys._current_frames()
+                for profile in self._profiles.values():
+                    frame = frames.get(profile.thread_id)
+                    if frame is not None:
+                        profile.stacks[f"{profile.endpoint};{collapse(frame, profile.phase)}"] += 1
+                frames = frame = None
+            time.sleep(self.interval)
+
+
+class RouteProfile:
+    """Totals of the sampled requests to one endpoint."""
+
+    def __init__(self):
+        self.requests = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.stacks = Counter()
+
+    def add(self, profile, elapsed, max_stacks):
+        self.requests += 1
+        self.total += elapsed
+        self.slowest = max(self.slowest, elapsed)
+        for phase, spent in profile.phases.items():
+            self.phases[phase] += spent
+        for stack, count in profile.stacks.items():
+            if stack in self.stacks or len(self.stacks) < max_stacks:
+                self.stacks[stack] += count
+            else:
+                self.stacks[f"{profile.endpoint};[truncated]"] += count
+
+    def summary(self):
+        return {
+            "sampled_requests": self.requests,
+            "avg_ms": self.total * 1000 / self.requests,
+            "max_ms": self.slowest * 1000,
+            "phases_avg_ms": {phase: spent * 1000 / self.requests for phase, spent in self.phases.items()},
+            "samples": sum(self.stacks.values()),
+        }
+
+
+def fold(stacks):
+    """Collapsed stacks as text, one "frame;frame;... count" line each, as flamegraph.pl reads them."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+class RequestProfiler:
+    """Profile a random sample of requests: time spent per phase, plus sampled stacks for flame graphs.
+
+    A sampled request has its time split between db, template, forms, hashing and other, while
+    a background thread samples its stack.  Per-endpoint totals are kept in memory; finishing a
+    sampled request only adds to them.  Another background thread writes the collapsed stacks of
+    endpoints sampled since its last pass to <PROFILING_DIR>/<endpoint>.<pid>.folded, ready for
+    flamegraph.pl or speedscope, and they're written once more when the process exits.  A
+    request that isn't sampled costs one random() call.
+
+    Config:
+        PROFILING_SAMPLE_RATE: fraction of requests to profile, 0 (the default) turns it off.
+        PROFILING_INTERVAL_MS: how often a profiled request's stack is sampled.
+        PROFILING_DIR: where the .folded files go, defaults to <instance>/profiles.  None keeps
+            them in memory only.
+        PROFILING_FLUSH_INTERVAL: seconds between writes of the .folded files.  0 only writes
+            them at exit or when flush() is called.
+        PROFILING_MAX_STACKS: distinct stacks kept per endpoint; the rest are counted as truncated.
+        PROFILING_ENDPOINT: serve the per-endpoint summary from /metrics/profile, and the collapsed
+            stacks from /metrics/profile/<endpoint>.folded (default False).  Only METRICS_ALLOWED_IPS
+            can read them, see instrumentation.py.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        # one flush at a time, as the flusher thread and exit both write the same files
+        self._flush_lock = threading.Lock()
+        self.routes = {}
+        # endpoints sampled since their .folded file was last written
+        self._dirty = set()
+        self._flusher = BackgroundThread(self._run, "profile-flusher")
+        self.sampler = None
+        self.app = None
+        atexit.register(self.flush)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("PROFILING_SAMPLE_RATE", 0.0)
+        app.config.setdefault("PROFILING_INTERVAL_MS", 5)
+        app.config.setdefault("PROFILING_DIR", os.path.join(app.instance_path, "profiles"))
+        app.config.setdefault("PROFILING_MAX_STACKS", 5000)
+        app.config.setdefault("PROFILING_FLUSH_INTERVAL", 10)
+        app.config.setdefault("PROFILING_ENDPOINT", False)
+        app.config.setdefault("METRICS_ALLOWED_IPS", ["127.0.0.1", "::1"])
+        app.extensions["request_profiler"] = self
+        self.app = app
+        self.sampler = StackSampler(app.config["PROFILING_INTERVAL_MS"] / 1000)
+
+        _listen_for_phases()
+        before_render_template.connect(_template_started, app)
+        template_rendered.connect(_template_finished, app)
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+        if app.config["PROFILING_ENDPOINT"]:
+            app.add_url_rule("/metrics/profile", "profile_metrics", self.metrics)
+            app.add_url_rule("/metrics/profile/<endpoint>.folded", "profile_folded", self.folded)
+
+    def _start_request(self):
+        rate = current_app.config["PROFILING_SAMPLE_RATE"]
+        if rate and request.endpoint and random.random() < rate:
+            g.profile = Profile(request.endpoint)
+            self.sampler.add(g.profile)
+
+    def _finish_request(self, exc):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return
+        self.sampler.remove(profile)
+        elapsed = profile.finish()
+        with self._lock:
+            route = self.routes.setdefault(profile.endpoint, RouteProfile())
+            route.add(profile, elapsed, current_app.config["PROFILING_MAX_STACKS"])
+            self._dirty.add(profile.endpoint)
+            if current_app.config["PROFILING_FLUSH_INTERVAL"]:
+                self._flusher.start()
+
+    def _run(self):
+        while True:
+            interval = self.app.config["PROFILING_FLUSH_INTERVAL"]
+            if not interval:
+                with self._lock:
+                    self._flusher.stopped()
+                return
+            time.sleep(interval)
+            self.flush()
+
+    def flush(self):
+        """Write the .folded files of the endpoints sampled since the last flush."""
+        directory = self.app.config["PROFILING_DIR"] if self.app is not None else None
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                if not directory:
+                    return
+                # copied under the lock, turned into text and written outside it
+                stacks = {endpoint: Counter(self.routes[endpoint].stacks) for endpoint in dirty if endpoint in self.routes}
+            for endpoint, counts in stacks.items():
+                self._write(directory, endpoint, fold(counts))
+
+    def _write(self, directory, endpoint, folded):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{endpoint}.{os.getpid()}.folded")
+        # replaced whole so a reader never sees half a file
+        with open(f"{path}.tmp", "w", encoding="utf8") as f:
+            f.write(folded)
+        os.replace(f"{path}.tmp", path)
+
+    def metrics(self):
+        """Per-endpoint timings of the sampled requests since the process started."""
+        if not metrics_allowed():
+            abort(404)
+        with self._lock:
+            return jsonify({endpoint: route.summary() for endpoint, route in self.routes.items()})
+
+    def folded(self, endpoint):
+        """One endpoint's collapsed stacks, e.g. `curl .../users.show_secrets_page.folded | flamegraph.pl`."""
+        if not metrics_allowed():
+            abort(404)
+        with self._lock:
+            route = self.routes.get(endpoint)
+            if route is None:
+                abort(404)
+            stacks = Counter(route.stacks)
+        return Response(fold(stacks), mimetype="text/plain")
+
+    def reset(self):
+        """Forget the per-endpoint totals."""
+        with self._lock:
+            self.routes.clear()
+            self._dirty.clear()
+
+
+def _template_started(app, template, context):
+    profile = _current_profile()
+    if profile is not None:
+        profile.enter("template")
+
+def _template_finished(app, template, context):
+    profile = _current_profile()
+    if profile is not None:
+        profile.exit("template")
+
+
+_listening = False
+
+def _listen_for_phases():
+    """Charge statements on every engine to the db phase of the profiled request running them."""
+    global _listening
+    if _listening:
+        return
+    _listening = True
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        profile = _current_profile()
+        if profile is not None:
+            profile.enter("db")
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        profile = _current_profile()
+        if profile is not None:
+            profile.exit("db")
+
+    @event.listens_for(Engine, "handle_error")
+    def handle_error(context):
+        profile = _current_profile()
+        if profile is not None:
+            profile.exit("db")
+
+
+request_profiler = RequestProfiler()
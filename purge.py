@@ -0,0 +1,152 @@
+import atexit
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from background import BackgroundThread
+from models import db, Feedback, User
+from sharding import shard_router
+
+
+def purge_deleted(batch_size=1000, older_than=0):
+    """Hard-delete feedback and users tombstoned more than older_than seconds ago.
+
+    Rows go batch_size at a time, each batch in its own short transaction, so purging a user with
+    a long history never holds locks the way deleting them in one go would.  A user's feedback is
+    cleared before the user row itself, leaving the database cascade nothing left to do.
+    Returns (feedback rows purged, users purged).
+    """
+    purged_feedback = purged_users = 0
+    # with shards, each one is purged in turn
+    for engine in shard_router.engines() or [db.engine]:
+        feedback_count, user_count = _purge_database(engine, batch_size, older_than)
+        purged_feedback += feedback_count
+        purged_users += user_count
+    return purged_feedback, purged_users
+
+def _purge_database(engine, batch_size, older_than):
+    cutoff = datetime.utcnow() - timedelta(seconds=older_than)
+    feedback, users = Feedback.__table__, User.__table__
+
+    purged_feedback = _delete_in_batches(
+        feedback, select(feedback.c.id).where(feedback.c.deleted_at <= cutoff), batch_size, engine
+    )
+    purged_users = 0
+    while True:
+        with engine.begin() as connection:
+            usernames = connection.execute(
+                select(users.c.username).where(users.c.deleted_at <= cutoff).limit(batch_size)
+            ).scalars().all()
+        if not usernames:
+            return purged_feedback, purged_users
+        for username in usernames:
+            purged_feedback += _delete_in_batches(
+                feedback, select(feedback.c.id).where(feedback.c.username == username), batch_size, engine
+            )
+            with engine.begin() as connection:
+                # anything a write-behind batch slipped in since then goes with the cascade
+                connection.execute(users.delete().where(users.c.username == username))
+            if shard_router.enabled():
+                shard_router.release_emails([username])
+            purged_users += 1
+
+def _delete_in_batches(feedback, ids, batch_size, engine):
+    purged = 0
+    while True:
+        with engine.begin() as connection:
+            batch = connection.execute(ids.order_by(feedback.c.id).limit(batch_size)).scalars().all()
+            if not batch:
+                return purged
+            connection.execute(feedback.delete().where(feedback.c.id.in_(batch)))
+        purged += len(batch)
+
+
+class Purger:
+    """Run purge_deleted() in a background thread of each process that tombstones rows.
+
+    The thread starts with the first wake() in a process (again after a fork), purges straight
+    away, and then every PURGE_INTERVAL seconds or whenever it's woken.  Running several
+    workers' purgers at once is safe: they delete whatever is still there.
+
+    Config:
+        PURGE_IN_BACKGROUND: run the thread; off means purging is left to `flask purge-deleted`.
+        PURGE_INTERVAL: seconds between purges.
+        PURGE_BATCH_SIZE: rows deleted per transaction.
+        PURGE_AFTER_SECONDS: how long tombstoned rows are kept before they are purged.
+    """
+
+    def __init__(self, app=None):
+        self._cond = threading.Condition()
+        self._thread = BackgroundThread(self._run, "purge-deleted")
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("PURGE_IN_BACKGROUND", True)
+        app.config.setdefault("PURGE_INTERVAL", 60)
+        app.config.setdefault("PURGE_BATCH_SIZE", 1000)
+        app.config.setdefault("PURGE_AFTER_SECONDS", 0)
+        app.extensions["purger"] = self
+        app.cli.add_command(purge_command)
+        self.app = app
+
+    def wake(self):
+        """Note that rows were just tombstoned, starting the purge thread if need be."""
+        if not self.app.config["PURGE_IN_BACKGROUND"]:
+            return
+        with self._cond:
+            if not self._thread.running():
+                self._woken = False
+                self._stopping = False
+                self._thread.start()
+                atexit.register(self.shutdown)
+            self._woken = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._woken and not self._stopping:
+                    self._cond.wait(self.app.config["PURGE_INTERVAL"])
+                # a wake that came before shutdown still gets its purge
+                if self._stopping and not self._woken:
+                    return
+                self._woken = False
+            try:
+                with self.app.app_context():
+                    purge_deleted(self.app.config["PURGE_BATCH_SIZE"], self.app.config["PURGE_AFTER_SECONDS"])
+            except Exception:
+                self.app.logger.exception("Couldn't purge deleted rows, will retry")
+
+    def shutdown(self):
+        """Stop the purge thread once it has finished the purge in progress (or already asked for)."""
+        with self._cond:
+            if not self._thread.running() or self._stopping:
+                return
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join()
+        with self._cond:
+            self._thread.stopped()
+
+
+@click.command("purge-deleted")
+@with_appcontext
+@click.option("--batch-size", type=int, help="rows deleted per transaction")
+@click.option("--older-than", type=int, help="only purge rows tombstoned at least this many seconds ago")
+def purge_command(batch_size, older_than):
+    """Hard-delete tombstoned feedback and users, e.g. from cron when PURGE_IN_BACKGROUND is off."""
+    config = current_app.config
+    purged_feedback, purged_users = purge_deleted(
+        batch_size or config["PURGE_BATCH_SIZE"],
+        config["PURGE_AFTER_SECONDS"] if older_than is None else older_than,
+    )
+    click.echo(f"Purged {purged_feedback} feedback rows and {purged_users} users.")
+
+
+purger = Purger()
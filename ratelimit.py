@@ -0,0 +1,115 @@
+import math
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+
+from flask import current_app, request, session
+from werkzeug.exceptions import TooManyRequests
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+@lru_cache(maxsize=None)
+def parse_limit(limit):
+    """Turn "10/minute" into (10, 60): that many requests per that many seconds."""
+    count, _, period = limit.partition("/")
+    try:
+        return int(count), PERIODS[period.strip()]
+    except (ValueError, KeyError):
+        raise ValueError(f"Bad rate limit {limit!r}, expected e.g. '10/minute'.") from None
+
+
+class ShardedBuckets:
+    """Token buckets for many clients, spread over shards that each have their own lock.
+
+    A bucket holds up to `count` tokens and refills at count/period tokens a second, so a client
+    may burst up to `count` requests and then continue at the steady rate.  Each shard keeps at
+    most maxsize buckets, dropping the least recently used (a dropped bucket just starts full again).
+    """
+
+    def __init__(self, shards=16, maxsize=10000):
+        self.maxsize = maxsize
+        self._shards = [(threading.Lock(), OrderedDict()) for _ in range(shards)]
+
+    def take(self, key, count, period):
+        """Spend a token from key's bucket.  Returns 0 if there was one, else seconds until there will be."""
+        lock, buckets = self._shards[zlib.crc32(key.encode("utf8")) % len(self._shards)]
+        rate = count / period
+        now = time.monotonic()
+        with lock:
+            tokens, updated = buckets.pop(key, (count, now))
+            tokens = min(count, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                buckets[key] = (tokens - 1, now)
+                wait = 0
+            else:
+                buckets[key] = (tokens, now)
+                wait = (1 - tokens) / rate
+            if len(buckets) > self.maxsize:
+                buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        for lock, buckets in self._shards:
+            with lock:
+                buckets.clear()
+
+
+class RateLimiter:
+    """Throttle chosen endpoints per client IP and per logged-in user.
+
+    Runs as the app's first before_request (create_app sets it up first): after routing and
+    loading the session, but before the view touches the form or the database.  Throttled
+    requests get a 429 with Retry-After.
+
+    Config:
+        RATELIMIT_ENABLED: turn limiting on or off.
+        RATELIMITS: {endpoint: "count/period"} with period one of second, minute, hour, day.
+        RATELIMIT_METHODS: methods that are counted, by default only form submissions.
+        RATELIMIT_BACKEND: shared bucket store with take(key, count, period) returning the
+            seconds to wait (0 to proceed), e.g. backed by Redis.  Defaults to ShardedBuckets in
+            this process, which limits each worker separately.
+    Behind a proxy, wrap the app in werkzeug's ProxyFix so the client IP is the real one.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("RATELIMIT_ENABLED", True)
+        app.config.setdefault("RATELIMITS", {})
+        app.config.setdefault("RATELIMIT_METHODS", ("POST",))
+        app.config.setdefault("RATELIMIT_BACKEND", None)
+        self.backend = app.config["RATELIMIT_BACKEND"] or ShardedBuckets()
+        # a bad limit should fail at startup, not on the first request it applies to
+        for limit in app.config["RATELIMITS"].values():
+            parse_limit(limit)
+        app.extensions["ratelimiter"] = self
+        app.before_request(self._check)
+
+    def _check(self):
+        if not current_app.config["RATELIMIT_ENABLED"] or request.method not in current_app.config["RATELIMIT_METHODS"]:
+            return
+        limit = current_app.config["RATELIMITS"].get(request.endpoint)
+        if limit is None:
+            return
+        count, period = parse_limit(limit)
+
+        keys = [f"{request.endpoint}:ip:{request.remote_addr}"]
+        if 'username' in session:
+            keys.append(f"{request.endpoint}:user:{session['username']}")
+        wait = max(self.backend.take(key, count, period) for key in keys)
+        if wait:
+            raise TooManyRequests("Too many requests.  Please slow down and try again shortly.", retry_after=math.ceil(wait))
+
+    def reset(self):
+        """Refill every bucket (in-process backend only)."""
+        if isinstance(self.backend, ShardedBuckets):
+            self.backend.clear()
+
+
+rate_limiter = RateLimiter()
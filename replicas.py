@@ -0,0 +1,219 @@
+import itertools
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.dml import UpdateBase
+
+from sharding import shard_router
+
+
+def read_only(view):
+    """Mark a view whose GET requests may be answered from a read replica.
+
+    Put it under the route decorator:
+
+        @bp.route('/things')
+        @read_only
+        def list_things(): ...
+    """
+    view.read_only = True
+    return view
+
+
+def engine_like_primary(app, uri):
+    """Create an engine for uri with the same pool settings and driver hacks as the primary."""
+    db = app.extensions["sqlalchemy"].db
+    options = db.apply_pool_defaults(app, dict(app.config["SQLALCHEMY_ENGINE_OPTIONS"]))
+    sa_url, options = db.apply_driver_hacks(app, make_url(uri), options)
+    return db.create_engine(sa_url, options)
+
+
+class Replica:
+    """One replica engine and what its last health check found."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.healthy = True
+        self.checked_at = 0.0
+
+
+class ReplicaSet:
+    """Round-robin over replica engines, skipping any that failed their last health check.
+
+    A replica is checked with SELECT 1 at most once every check_interval seconds, by whichever
+    request happens to pick it once its last result is that old.
+    """
+
+    def __init__(self, engines, check_interval=5):
+        self.replicas = [Replica(engine) for engine in engines]
+        self.check_interval = check_interval
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    def choose(self):
+        """Return the next healthy replica's engine, or None if none are healthy."""
+        if not self.replicas:
+            return None
+        start = next(self._turn)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if self.is_healthy(replica):
+                return replica.engine
+        return None
+
+    def is_healthy(self, replica):
+        with self._lock:
+            if time.monotonic() - replica.checked_at < self.check_interval:
+                return replica.healthy
+            # claim the check, so concurrent requests keep using the last result meanwhile
+            replica.checked_at = time.monotonic()
+        try:
+            with replica.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            replica.healthy = True
+        except Exception:
+            replica.healthy = False
+        return replica.healthy
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+
+class ReadReplicas:
+    """Send the reads of read_only views to replicas, keeping everything else on the primary.
+
+    A read goes to a replica only while handling a GET for a view marked @read_only, outside of
+    a flush and before the session has written anything.  After a request commits, that user's
+    reads stay on the primary for REPLICA_STICKY_SECONDS so they see their own writes.
+
+    Config:
+        SQLALCHEMY_REPLICA_URIS: replica database URIs; none means everything uses the primary.
+        REPLICA_HEALTH_CHECK_INTERVAL: seconds between health checks of each replica.
+        REPLICA_STICKY_SECONDS: how long after a write a user reads from the primary (their
+            write should have replicated by then).
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SQLALCHEMY_REPLICA_URIS", [])
+        app.config.setdefault("REPLICA_HEALTH_CHECK_INTERVAL", 5)
+        app.config.setdefault("REPLICA_STICKY_SECONDS", 5)
+        app.extensions["db_replicas"] = self
+        app.after_request(self._remember_write)
+
+    def get(self, app):
+        """Return the app's ReplicaSet, creating the replica engines on first use."""
+        replicas = app.extensions.get("db_replica_set")
+        if replicas is None:
+            with self._lock:
+                replicas = app.extensions.get("db_replica_set")
+                if replicas is None:
+                    replicas = app.extensions["db_replica_set"] = ReplicaSet(
+                        [engine_like_primary(app, uri) for uri in app.config["SQLALCHEMY_REPLICA_URIS"]],
+                        check_interval=app.config["REPLICA_HEALTH_CHECK_INTERVAL"],
+                    )
+        return replicas
+
+    def reset(self, app):
+        """Drop the app's replica engines, so they are built again from the current config."""
+        replicas = app.extensions.pop("db_replica_set", None)
+        if replicas is not None:
+            replicas.dispose()
+
+    def _remember_write(self, response):
+        if g.pop("db_committed", False) and 'username' in session:
+            session["db_wrote_at"] = time.time()
+        return response
+
+    def reads_from_replica(self, session_):
+        """Whether reads in session_ may go to a replica right now."""
+        if not has_request_context() or request.method not in ("GET", "HEAD"):
+            return False
+        if session_._flushing or session_.info.get("wrote"):
+            return False
+        view = current_app.view_functions.get(request.endpoint)
+        if not getattr(view, "read_only", False):
+            return False
+        wrote_at = session.get("db_wrote_at")
+        return wrote_at is None or time.time() - wrote_at >= current_app.config["REPLICA_STICKY_SECONDS"]
+
+
+class RoutingSession(SignallingSession):
+    """db.session that sends sharded tables to their shard (see sharding.py) and can send a
+    read_only view's queries to a replica (see ReadReplicas)."""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        shard = shard_router.engine_for(
+            self.app, mapper, clause, writing=self._flushing or isinstance(clause, UpdateBase), loading_for=kw.get("loading_for")
+        )
+        if shard is not None:
+            return shard
+        if db_replicas.reads_from_replica(self):
+            # one replica per request, so its queries all see the same point in time
+            if "db_replica" not in g:
+                g.db_replica = db_replicas.get(self.app).choose()
+            if g.db_replica is not None:
+                return g.db_replica
+        return super().get_bind(mapper, clause)
+
+    @property
+    def connection_callable(self):
+        # a flush may hold rows for several users, so each row's statements go to its own shard
+        return self._shard_connection if shard_router.enabled(self.app) else None
+
+    def _shard_connection(self, mapper, instance):
+        if not getattr(mapper.class_, "__shard_key__", None):
+            # a main database row, such as a ShardBucket
+            return self.connection(bind_arguments={"mapper": mapper})
+        shard = shard_router.check_bucket(shard_router.bucket_for_instance(instance), writing=True)
+        return self.connection(bind_arguments={"bind": shard_router.engines(self.app)[shard]})
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _load_from_objects_shard(state):
+    # loads on behalf of an object in the session (expired attributes, lazy relationships) go to
+    # that object's shard, whichever shard the code around them was using
+    if state.is_select and shard_router.enabled(state.session.app):
+        loading_for = state.load_options._refresh_state or state.lazy_loaded_from
+        if loading_for is not None and loading_for.key is not None:
+            state.bind_arguments["loading_for"] = loading_for
+
+@event.listens_for(RoutingSession, "after_flush")
+def _flushed(session_, flush_context):
+    # the rest of this transaction has to read from the primary to see what it just wrote
+    session_.info["wrote"] = True
+
+@event.listens_for(RoutingSession, "after_commit")
+def _committed(session_):
+    session_.info.pop("wrote", None)
+    if has_request_context():
+        note_write()
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _rolled_back(session_):
+    session_.info.pop("wrote", None)
+
+
+def note_write():
+    """Keep this request's user reading from the primary for REPLICA_STICKY_SECONDS.
+
+    db.session commits do this themselves; call it after committing any other way, e.g. through
+    async_db's sessions.
+    """
+    g.db_committed = True
+
+def used_replica():
+    """Whether this request read anything from a replica, i.e. may have seen slightly stale data."""
+    return g.get("db_replica") is not None
+
+
+db_replicas = ReadReplicas()
@@ -0,0 +1,64 @@
+import json
+import re
+import zlib
+from difflib import SequenceMatcher
+
+# Splits text into words with their trailing whitespace (and any leading whitespace on its own),
+# so joining the tokens gives back the text exactly
+TOKENS = re.compile(r"\S+\s*|\s+")
+
+# Longest stretch of changed tokens, on either side, that's diffed word by word.  Diffing is
+# quadratic, so a bigger changed stretch is stored as one insert instead.
+MAX_DIFF_TOKENS = 2000
+
+
+def tokenize(text):
+    return TOKENS.findall(text)
+
+def make_snapshot(text):
+    """Compress a full copy of text."""
+    return zlib.compress(text.encode("utf8"))
+
+def read_snapshot(data):
+    return zlib.decompress(data).decode("utf8")
+
+def make_delta(old, new, max_tokens=MAX_DIFF_TOKENS):
+    """Compress the edits turning old into new.
+
+    The delta is a JSON list of [start, end] token ranges copied from old and strings inserted
+    in between, so an edit to a long text costs about as much as the words it touched.  The
+    unchanged start and end are matched in one pass, and only what's between them is diffed,
+    if it's no more than max_tokens long.
+    """
+    old_tokens, new_tokens = tokenize(old), tokenize(new)
+    prefix = 0
+    limit = min(len(old_tokens), len(new_tokens))
+    while prefix < limit and old_tokens[prefix] == new_tokens[prefix]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and old_tokens[-1 - suffix] == new_tokens[-1 - suffix]:
+        suffix += 1
+    old_end, new_end = len(old_tokens) - suffix, len(new_tokens) - suffix
+
+    ops = [[0, prefix]] if prefix else []
+    if max(old_end, new_end) - prefix <= max_tokens:
+        matcher = SequenceMatcher(None, old_tokens[prefix:old_end], new_tokens[prefix:new_end], autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                ops.append([prefix + i1, prefix + i2])
+            elif j2 > j1:
+                ops.append("".join(new_tokens[prefix + j1:prefix + j2]))
+    elif new_end > prefix:
+        ops.append("".join(new_tokens[prefix:new_end]))
+    if suffix:
+        ops.append([old_end, len(old_tokens)])
+    return zlib.compress(json.dumps(ops, separators=(",", ":")).encode("utf8"))
+
+def apply_delta(old, data):
+    """Rebuild the new text from old and a delta made by make_delta(old, new)."""
+    old_tokens = tokenize(old)
+    return "".join(
+        "".join(old_tokens[op[0]:op[1]]) if isinstance(op, list) else op
+        for op in json.loads(zlib.decompress(data))
+    )
@@ -0,0 +1,97 @@
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import func, literal_column, or_
+from sqlalchemy.orm import defer
+
+from models import db, eager, Feedback
+from sharding import shard_router
+
+# Markers ts_headline wraps matches in.  FeedbackForm (and so bulk import) rejects control
+# characters, and they're stripped from content before highlighting in case older rows have any,
+# so the snippet can be escaped as plain text first and the markers swapped for <mark> tags afterwards.
+START_SEL = "\x02"
+STOP_SEL = "\x03"
+
+HEADLINE_OPTIONS = f"StartSel={START_SEL}, StopSel={STOP_SEL}, MaxFragments=2, MaxWords=30, MinWords=10"
+
+# Characters of context either side of the first match when highlighting without Postgres
+SNIPPET_CONTEXT = 80
+
+
+def search_feedback(terms, username=None, page=1, per_page=20):
+    """Return (results, has_next) for one page of feedback matching terms, best match first.
+
+    results is a list of (feedback, snippet) where snippet is Markup with the matches wrapped in
+    <mark>, and each feedback has its user loaded.  Postgres ranks and highlights with the indexed search_vector; other databases (e.g.
+    SQLite in development) fall back to a LIKE scan ordered by newest first.
+
+    With shards, a search for one user's feedback goes to their shard alone.  Otherwise every
+    shard returns its best rows up to the end of the page, and the page is cut from those merged.
+    """
+    offset, limit = (page - 1) * per_page, per_page + 1
+    if shard_router.spread(username):
+        rows = []
+        for _ in shard_router.each():
+            rows += _search_backend()(terms, username, 0, offset + limit)
+        rows = sorted(rows, key=lambda row: row[0], reverse=True)[offset:offset + limit]
+    else:
+        for _ in shard_router.each(username):
+            rows = _search_backend()(terms, username, offset, limit)
+
+    results = [(feedback, snippet_html(snippet)) for _, feedback, snippet in rows[:per_page]]
+    return results, len(rows) > per_page
+
+def _search_backend():
+    """The search for the database feedback is read from right now, which may be a shard."""
+    dialect = db.session.get_bind(Feedback.__mapper__).dialect.name
+    return _search_postgres if dialect == "postgresql" else _search_like
+
+# Each backend returns (sort key, feedback, snippet) rows, best first.  Sort keys are (rank, id)
+# from every backend, so rows from shards on different databases can be merged.
+
+def _search_postgres(terms, username, offset, limit):
+    query = func.websearch_to_tsquery("english", terms)
+    vector = literal_column("feedback.search_vector")
+    rank = func.ts_rank_cd(vector, query).label("rank")
+
+    # Rank and page using only the index, then build headlines for just the rows on this page
+    ranked = db.session.query(Feedback.id, rank).filter(vector.op("@@")(query))
+    if username:
+        ranked = ranked.filter(Feedback.username == username)
+    ranked = ranked.order_by(rank.desc(), Feedback.id.desc()).offset(offset).limit(limit).subquery()
+
+    content = func.translate(Feedback.content, START_SEL + STOP_SEL, "")
+    headline = func.ts_headline("english", content, query, HEADLINE_OPTIONS)
+    rows = (
+        db.session.query(Feedback, headline, ranked.c.rank)
+        .join(ranked, Feedback.id == ranked.c.id)
+        # the snippet comes from ts_headline, so the full content never needs to leave the database
+        .options(defer(Feedback.content), eager(Feedback.user))
+        .order_by(ranked.c.rank.desc(), Feedback.id.desc())
+        .all()
+    )
+    return [((rank, feedback.id), feedback, snippet) for feedback, snippet, rank in rows]
+
+def _search_like(terms, username, offset, limit):
+    pattern = "%" + re.sub(r"([\\%_])", r"\\\1", terms) + "%"
+    query = Feedback.query.options(eager(Feedback.user)).filter(or_(Feedback.title.ilike(pattern, escape="\\"), Feedback.content.ilike(pattern, escape="\\")))
+    if username:
+        query = query.filter(Feedback.username == username)
+    rows = query.order_by(Feedback.id.desc()).offset(offset).limit(limit).all()
+    # unranked, so below any ranked match and newest first among themselves
+    return [((0.0, feedback.id), feedback, _highlight(feedback.content, terms)) for feedback in rows]
+
+def _highlight(text, terms):
+    """Cut a snippet of text around the first match of terms and mark every match, like ts_headline."""
+    text = text.replace(START_SEL, "").replace(STOP_SEL, "")
+    match = re.search(re.escape(terms), text, re.IGNORECASE)
+    if match is None:
+        return text[:2 * SNIPPET_CONTEXT]
+    snippet = text[max(0, match.start() - SNIPPET_CONTEXT):match.end() + SNIPPET_CONTEXT]
+    return re.sub(f"({re.escape(terms)})", f"{START_SEL}\\1{STOP_SEL}", snippet, flags=re.IGNORECASE)
+
+def snippet_html(snippet):
+    """Escape a highlighted snippet and turn its match markers into <mark> tags."""
+    html = str(escape(snippet))
+    return Markup(html.replace(START_SEL, "<mark>").replace(STOP_SEL, "</mark>"))
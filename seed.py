@@ -1,20 +1,87 @@
-from app import db
-from models import User, Feedback
+import argparse
 
-db.drop_all()
-db.create_all()
-
-han = User.registerUser('HanSolo', 'Chewie', 'shotfirst@gmail.com', 'Han', 'Solo')
-alison = User.registerUser('tooManyGhosts', 'Mike', 'buttonhouse@email.com', 'Alison', 'Cooper')
-
-db.session.add_all([han, alison])
-db.session.commit()
+from models import db, User, Feedback, UserStats
+from hashing import password_hasher
+from sharding import shard_router
 
 lorem1 = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat. Duis aute irure dolor in reprehenderit in voluptate velit esse cillum dolore eu fugiat nulla pariatur. Excepteur sint occaecat cupidatat non proident, sunt in culpa qui officia deserunt mollit anim id est laborum.'
 lorem2 = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua. Egestas dui id ornare arcu odio. Suspendisse ultrices gravida dictum fusce ut. Erat nam at lectus urna duis. Habitant morbi tristique senectus et netus et malesuada. Libero enim sed faucibus turpis. Posuere urna nec tincidunt praesent semper feugiat nibh sed. Sed faucibus turpis in eu mi bibendum neque egestas. Enim facilisis gravida neque convallis a cras. Ultrices eros in cursus turpis massa tincidunt dui ut ornare. Scelerisque viverra mauris in aliquam sem fringilla. Lectus arcu bibendum at varius vel pharetra. Tellus molestie nunc non blandit. Bibendum at varius vel pharetra vel.'
 
-hanFeedback = Feedback(title='Kessel Run', content=lorem1, username=han.username)
-alisonFeedback = Feedback(title='Too Many Roomates', content=lorem2, username=alison.username)
 
-db.session.add_all([hanFeedback, alisonFeedback])
-db.session.commit()
\ No newline at end of file
+def seed_demo():
+    """Add the two demo users and their feedback."""
+    han = User.registerUser('HanSolo', 'Chewie', 'shotfirst@gmail.com', 'Han', 'Solo')
+    alison = User.registerUser('tooManyGhosts', 'Mike', 'buttonhouse@email.com', 'Alison', 'Cooper')
+
+    db.session.add_all([han, alison])
+    db.session.commit()
+
+    hanFeedback = Feedback(title='Kessel Run', content=lorem1, username=han.username)
+    alisonFeedback = Feedback(title='Too Many Roomates', content=lorem2, username=alison.username)
+
+    db.session.add_all([hanFeedback, alisonFeedback])
+    db.session.commit()
+
+def seed_bulk(num_users, feedback_per_user, password='password', batch_size=1000, prefix='user'):
+    """Add num_users users named <prefix>0, <prefix>1, ... with feedback_per_user feedback each.
+
+    Every user shares one password hash (computed once) and rows go in as multi-row INSERTs
+    of batch_size, so large data sets seed in seconds rather than hours.
+    Returns the list of usernames.
+    """
+    hashed = password_hasher.generate_password_hash(password)
+    usernames = [f'{prefix}{i}' for i in range(num_users)]
+    for shard in shard_router.each():
+        _seed_users([username for username in usernames if shard is None or shard_router.shard_for_username(username) == shard], hashed, feedback_per_user, batch_size)
+    db.session.commit()
+    return usernames
+
+def _seed_users(usernames, hashed, feedback_per_user, batch_size):
+    users = [
+        {'username': username, 'password': hashed, 'email': f'{username}@example.com', 'first_name': 'Seed', 'last_name': username}
+        for username in usernames
+    ]
+    if shard_router.enabled():
+        for user in users:
+            user['shard_bucket'] = shard_router.bucket_for_username(user['username'])
+    for start in range(0, len(users), batch_size):
+        if shard_router.enabled():
+            shard_router.claim_emails([(user['username'], user['email']) for user in users[start:start + batch_size]])
+        db.session.execute(User.__table__.insert().values(users[start:start + batch_size]))
+        UserStats.record_new_users(db.session, usernames[start:start + batch_size])
+
+    batch = []
+    for username in usernames:
+        for i in range(feedback_per_user):
+            batch.append({'title': f'Feedback {i}', 'content': lorem1, 'username': username})
+            if len(batch) >= batch_size:
+                db.session.execute(Feedback.__table__.insert().values(shard_router.assign_feedback_ids(batch)))
+                batch = []
+    if batch:
+        db.session.execute(Feedback.__table__.insert().values(shard_router.assign_feedback_ids(batch)))
+    if feedback_per_user:
+        for username in usernames:
+            UserStats.record_added(db.session, username, feedback_per_user)
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description='Reset the database and fill it with seed data.')
+    parser.add_argument('--users', type=int, help='add this many generated users instead of the demo users')
+    parser.add_argument('--feedback', type=int, default=10, help='feedback per generated user')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        if shard_router.enabled():
+            for engine in shard_router.engines():
+                db.metadata.drop_all(engine, tables=list(shard_router.sharded_tables()))
+            shard_router.create_all()
+
+        if args.users:
+            seed_bulk(args.users, args.feedback)
+        else:
+            seed_demo()
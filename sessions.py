@@ -0,0 +1,183 @@
+import secrets
+import sys
+import threading
+import time
+
+from flask import current_app
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from cache import LRUCache
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session data kept on the server, referenced by an opaque id in the cookie."""
+
+    def __init__(self, initial=None, sid=None, created=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.created = created if created is not None else time.time()
+        self.new = new
+        self.modified = False
+        self.rotate = False
+
+    def regenerate(self):
+        """Move the session to a fresh id when it's saved, e.g. on login, so an old id can't be reused."""
+        self.rotate = True
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keep sessions in a server-side store so the cookie only carries a random id.
+
+    store is anything with get(key), set(key, value, ttl=None) and delete(key); values must be
+    serializable by it.  Sessions idle for longer than idle_timeout seconds expire.  Refreshing a
+    session's expiry on plain reads is batched, at most once every last_seen_interval seconds.
+
+    revoke_user() rejects every session a user had open before that moment.  The check only
+    consults the revocation list (and the shared store, if there is one), never the database.
+    """
+
+    def __init__(self, store=None, idle_timeout=86400, last_seen_interval=60, max_sessions=10000):
+        self.shared = store is not None
+        self.store = store if store is not None else LRUCache(maxsize=max_sessions, ttl=idle_timeout)
+        self.idle_timeout = idle_timeout
+        self.last_seen_interval = last_seen_interval
+        # Never evicted by size, so a revocation can't be forgotten while the user's sessions might
+        # still be alive.  Every entry has the same ttl, so LRUCache.set prunes expired ones within about a ttl.
+        # A revoked session's expiry is never extended, so it's gone within idle_timeout; the extra
+        # interval covers a last-seen flush that read the record just before the revocation.
+        self.revocation_ttl = idle_timeout + last_seen_interval
+        self.revocations = LRUCache(maxsize=sys.maxsize, ttl=self.revocation_ttl)
+        self._pending = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid:
+            record = self.store.get(f"session:{sid}")
+            if record is not None and not self._is_revoked(record):
+                return ServerSideSession(record["data"], sid=sid, created=record["created"])
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = app.session_cookie_name
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if not session.new:
+                self.store.delete(f"session:{session.sid}")
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.rotate:
+            if not session.new:
+                self.store.delete(f"session:{session.sid}")
+            session.sid = secrets.token_urlsafe(32)
+            session.created = time.time()
+            session.new = True
+
+        if not session.modified and not session.new:
+            self._touch(session.sid)
+            return
+
+        now = time.time()
+        record = {"data": dict(session), "created": session.created, "last_seen": now}
+        self.store.set(f"session:{session.sid}", record, ttl=self.idle_timeout)
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+    def revoke_user(self, username):
+        """Reject every session username has open right now, on every device."""
+        now = time.time()
+        self.revocations.set(username, now)
+        if self.shared:
+            self.store.set(f"revoked:{username}", now, ttl=self.revocation_ttl)
+
+    def _is_revoked(self, record):
+        username = record["data"].get("username")
+        if username is None:
+            return False
+        revoked_at = self.revocations.get(username)
+        if revoked_at is None and self.shared:
+            revoked_at = self.store.get(f"revoked:{username}")
+        return revoked_at is not None and record["created"] <= revoked_at
+
+    def _touch(self, sid):
+        """Note that sid was used, writing the pending last-seen times out in one batch when due."""
+        with self._lock:
+            self._pending[sid] = time.time()
+            if time.monotonic() - self._last_flush < self.last_seen_interval:
+                return
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        self.flush_last_seen(pending)
+
+    def flush_last_seen(self, pending=None):
+        """Write last-seen times and extend the expiry of the sessions in pending (default: all waiting).
+
+        Sessions revoked since they were used are deleted instead, so they can't outlive their revocation.
+        """
+        if pending is None:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+        for sid, seen in pending.items():
+            record = self.store.get(f"session:{sid}")
+            if record is None:
+                continue
+            if self._is_revoked(record):
+                self.store.delete(f"session:{sid}")
+                continue
+            record["last_seen"] = seen
+            self.store.set(f"session:{sid}", record, ttl=self.idle_timeout)
+
+
+class ServerSessions:
+    """Install a ServerSideSessionInterface on the app.
+
+    Config:
+        SESSION_STORE: shared store for sessions (see ServerSideSessionInterface).  Defaults to an
+            in-process LRU, which only works while the app runs in a single process.
+        SESSION_STORE_SIZE: sessions kept by the in-process LRU.
+        SESSION_IDLE_TIMEOUT: seconds of inactivity before a session expires.
+        SESSION_LAST_SEEN_INTERVAL: seconds between batched last-seen writes.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SESSION_STORE", None)
+        app.config.setdefault("SESSION_STORE_SIZE", 10000)
+        app.config.setdefault("SESSION_IDLE_TIMEOUT", 86400)
+        app.config.setdefault("SESSION_LAST_SEEN_INTERVAL", 60)
+        app.session_interface = ServerSideSessionInterface(
+            store=app.config["SESSION_STORE"],
+            idle_timeout=app.config["SESSION_IDLE_TIMEOUT"],
+            last_seen_interval=app.config["SESSION_LAST_SEEN_INTERVAL"],
+            max_sessions=app.config["SESSION_STORE_SIZE"],
+        )
+        app.extensions["server_sessions"] = self
+
+
+def revoke_user_sessions(username):
+    """Log username out everywhere."""
+    current_app.session_interface.revoke_user(username)
+
+
+server_sessions = ServerSessions()
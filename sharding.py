@@ -0,0 +1,711 @@
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, g, has_app_context, has_request_context, redirect, request, url_for
+from flask.cli import AppGroup
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.util import find_tables
+from werkzeug.exceptions import ServiceUnavailable
+
+
+class ShardNotChosen(RuntimeError):
+    """A sharded table was queried without saying which user's shard it's for."""
+
+
+class ShardRouter:
+    """Hash-partition users and everything keyed by them across several databases.
+
+    A username hashes into one of SHARD_BUCKETS virtual buckets, and the shard_buckets table
+    in the main database maps each bucket to a shard, so rebalancing moves whole buckets
+    without rehashing anyone.  Models with a __shard_key__ (users, their feedback, stats and
+    revisions) live on the shards; everything else stays in the main database.  Feedback ids
+    end in their bucket (id % SHARD_BUCKETS), so /feedback/<id> routes without a lookup.
+    Emails stay unique across the shards through user_emails in the main database.
+
+    A database that was in use before sharding is moved onto the shards with `flask shards
+    migrate` (see migrate_main_database); links to its feedback are redirected to the new ids.
+
+    db.session picks the shard from, in order: an enclosing `shard_router.using(...)` block,
+    or the <username> or <feedback_id> in the request's URL.  So per-user routes touch just
+    their user's shard and need no changes; anything else (login, search, the leaderboard)
+    says which shard it wants or visits each in turn.  Flushes route each row by its own key.
+
+    While a bucket is being moved (see move_buckets), writes to it get a 503; reads carry on
+    from the old shard until the move is done.
+
+    Config:
+        SQLALCHEMY_SHARD_URIS: shard database URIs; none keeps everything in the main database.
+            Only ever append to it, shards are known by their position.
+        SHARD_BUCKETS: virtual buckets.  Fixed once there's data; choose well above the
+            number of shards you'll ever have.
+        SHARD_MAP_TTL: seconds a process trusts its copy of the bucket map.  Moves wait this
+            long between steps, so every process has seen each step before the next.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._sharded_tables = None
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SQLALCHEMY_SHARD_URIS", [])
+        app.config.setdefault("SHARD_BUCKETS", 1024)
+        app.config.setdefault("SHARD_MAP_TTL", 5)
+        app.config.setdefault("SHARD_ID_BLOCK_SIZE", 1000)
+        app.extensions["shard_router"] = self
+        app.cli.add_command(shards_cli)
+        app.before_request(self._redirect_moved_feedback)
+        # db.session works outside an app context (Flask-SQLAlchemy falls back to db.app), so routing does too
+        self.app = app
+        if app.config["SQLALCHEMY_SHARD_URIS"] and app.config.get("ASYNC_MODE"):
+            raise RuntimeError("ASYNC_MODE's async engine only knows the main database, it can't be used with shards.")
+
+    def app_now(self):
+        return current_app._get_current_object() if has_app_context() else self.app
+
+    def enabled(self, app=None):
+        app = app or self.app_now()
+        return bool(app.config["SQLALCHEMY_SHARD_URIS"])
+
+    # Shards
+
+    def engines(self, app=None):
+        """Return the shard engines, creating them on first use."""
+        app = app or self.app_now()
+        engines = app.extensions.get("shard_engines")
+        if engines is None:
+            from replicas import engine_like_primary
+            with self._lock:
+                engines = app.extensions.get("shard_engines")
+                if engines is None:
+                    engines = app.extensions["shard_engines"] = [
+                        engine_like_primary(app, uri) for uri in app.config["SQLALCHEMY_SHARD_URIS"]
+                    ]
+        return engines
+
+    def reset(self, app):
+        """Drop the shard engines and cached bucket map, so they're built again from the current config."""
+        for engine in app.extensions.pop("shard_engines", None) or []:
+            engine.dispose()
+        app.extensions.pop("shard_map", None)
+
+    def sharded_tables(self):
+        """The tables of models with a __shard_key__."""
+        if self._sharded_tables is None:
+            db = self.app_now().extensions["sqlalchemy"].db
+            self._sharded_tables = frozenset(
+                mapper.local_table for mapper in db.Model.registry.mappers
+                if getattr(mapper.class_, "__shard_key__", None)
+            )
+        return self._sharded_tables
+
+    def create_all(self, app=None):
+        """Create the sharded tables on every shard, pin the bucket map (see init_map) and start
+        new feedback ids above any left in the main database."""
+        app = app or self.app_now()
+        db = app.extensions["sqlalchemy"].db
+        tables = list(self.sharded_tables())
+        for engine in self.engines(app):
+            db.metadata.create_all(engine, tables=tables)
+        self.init_map(app)
+        feedback = _tables()["feedback"]
+        with _directory(app).connect() as connection:
+            highest = connection.execute(select(func.max(feedback.c.id))).scalar()
+        if highest is not None:
+            # so an old id, until it's migrated, never names new feedback as well
+            self._reserve_past(app, highest // app.config["SHARD_BUCKETS"] + 1)
+
+    # Buckets
+
+    def bucket_for_username(self, username):
+        return zlib.crc32(username.encode("utf8")) % self.app_now().config["SHARD_BUCKETS"]
+
+    def bucket_for_feedback_id(self, feedback_id):
+        return feedback_id % self.app_now().config["SHARD_BUCKETS"]
+
+    def bucket_for_instance(self, instance):
+        key = type(instance).__shard_key__
+        value = getattr(instance, key)
+        return self.bucket_for_feedback_id(value) if key == "feedback_id" else self.bucket_for_username(value)
+
+    def bucket_for_state(self, state):
+        """The bucket of an object loaded from the database, found from its primary key so nothing gets loaded."""
+        key = state.class_.__shard_key__
+        names = [column.key for column in state.mapper.primary_key]
+        if key not in names:
+            # feedback itself, whose id ends in its bucket
+            return self.bucket_for_feedback_id(state.identity[0])
+        value = state.identity[names.index(key)]
+        return self.bucket_for_feedback_id(value) if key == "feedback_id" else self.bucket_for_username(value)
+
+    def init_map(self, app=None):
+        """Write out a row per bucket, spreading them over the shards, unless the map already exists.
+
+        Buckets without a row fall back to bucket % number of shards, which changes as shards
+        are added; pinning them first makes adding a shard safe.
+        """
+        app = app or self.app_now()
+        table = _tables()["shard_buckets"]
+        with _directory(app).begin() as connection:
+            if connection.execute(select(func.count()).select_from(table)).scalar():
+                return
+            shards = len(app.config["SQLALCHEMY_SHARD_URIS"])
+            connection.execute(table.insert(), [
+                {"bucket": bucket, "shard": bucket % shards, "moving_to": None}
+                for bucket in range(app.config["SHARD_BUCKETS"])
+            ])
+        app.extensions.pop("shard_map", None)
+
+    def bucket_map(self, fresh=False):
+        """Return {bucket: (shard, shard it's moving to or None)}, cached for SHARD_MAP_TTL seconds."""
+        app = self.app_now()
+        cached = app.extensions.get("shard_map")
+        if fresh or cached is None or time.monotonic() - cached[0] >= app.config["SHARD_MAP_TTL"]:
+            table = _tables()["shard_buckets"]
+            with _directory(app).connect() as connection:
+                rows = connection.execute(select(table.c.bucket, table.c.shard, table.c.moving_to)).all()
+            cached = app.extensions["shard_map"] = (time.monotonic(), {bucket: (shard, moving_to) for bucket, shard, moving_to in rows})
+        return cached[1]
+
+    def locate(self, bucket):
+        """Return (shard, shard it's moving to or None) for a bucket."""
+        return self.bucket_map().get(bucket) or (bucket % len(self.app_now().config["SQLALCHEMY_SHARD_URIS"]), None)
+
+    def shard_for_username(self, username):
+        return self.locate(self.bucket_for_username(username))[0]
+
+    # Routing
+
+    @contextmanager
+    def using(self, username=None, shard=None):
+        """Send db.session's queries on sharded tables to username's shard (or a shard by number) in this block."""
+        if username is not None:
+            choice = ("bucket", self.bucket_for_username(username))
+        else:
+            choice = ("shard", shard)
+        stack = g.setdefault("db_shards", [])
+        stack.append(choice)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    def each(self, username=None):
+        """Yield once for every shard that can hold username's rows (all of them for None),
+        with db.session using that shard in between.
+
+        Yields the shard number, or None just once when sharding is off, so scatter-gather
+        code runs unchanged against the main database.
+        """
+        if not self.enabled():
+            yield None
+        elif username is not None:
+            with self.using(username=username):
+                yield self.shard_for_username(username)
+        else:
+            for shard in range(len(self.app_now().config["SQLALCHEMY_SHARD_URIS"])):
+                with self.using(shard=shard):
+                    yield shard
+
+    def spread(self, username=None):
+        """Whether each(username) visits more than one shard."""
+        return self.enabled() and username is None and len(self.app_now().config["SQLALCHEMY_SHARD_URIS"]) > 1
+
+    def current(self):
+        """Return ("bucket", n) or ("shard", n) for the shard queries should use now, or None if there's no telling."""
+        stack = g.get("db_shards") if has_app_context() else None
+        if stack:
+            return stack[-1]
+        if has_request_context() and request.view_args:
+            if "username" in request.view_args:
+                return ("bucket", self.bucket_for_username(request.view_args["username"]))
+            if "feedback_id" in request.view_args:
+                return ("bucket", self.bucket_for_feedback_id(request.view_args["feedback_id"]))
+        return None
+
+    def engine_for(self, app, mapper=None, clause=None, writing=False, loading_for=None):
+        """The shard engine a statement should run on, or None if it doesn't touch a sharded table.
+
+        loading_for is the state of the object a load is on behalf of, if any.
+        """
+        if not self.enabled(app) or not self._touches_sharded_table(mapper, clause):
+            return None
+        if loading_for is not None and getattr(loading_for.class_, "__shard_key__", None):
+            return self.engines(app)[self.check_bucket(self.bucket_for_state(loading_for), writing)]
+        choice = self.current()
+        if choice is None:
+            raise ShardNotChosen(
+                "Which shard? Query sharded tables from a route with <username> or <feedback_id>, "
+                "or inside shard_router.using(...)."
+            )
+        kind, value = choice
+        if kind == "shard":
+            return self.engines(app)[value]
+        return self.engines(app)[self.check_bucket(value, writing)]
+
+    def check_bucket(self, bucket, writing):
+        """Return a bucket's shard, refusing writes while it's being moved."""
+        shard, moving_to = self.locate(bucket)
+        if writing and moving_to is not None:
+            raise ServiceUnavailable("This account is being moved.  Please try again in a minute.", retry_after=self.app_now().config["SHARD_MAP_TTL"] or 1)
+        return shard
+
+    def _touches_sharded_table(self, mapper, clause):
+        sharded = self.sharded_tables()
+        if mapper is not None:
+            return mapper.local_table in sharded
+        if clause is None:
+            return False
+        return any(table in sharded for table in find_tables(clause, include_crud=True))
+
+    # Feedback ids
+
+    def new_feedback_ids(self, username, count=1):
+        """Return count new feedback ids for username, each ending in the user's bucket.
+
+        The sequence numbers before the bucket come in blocks of SHARD_ID_BLOCK_SIZE reserved
+        from the main database, so most ids cost no round trip at all.
+        """
+        buckets = self.app_now().config["SHARD_BUCKETS"]
+        bucket = self.bucket_for_username(username)
+        return [sequence * buckets + bucket for sequence in self._sequence_numbers(count)]
+
+    def group_by_shard(self, rows):
+        """Split rows (dicts with a username) into [(engine, rows)], one per shard they belong on.
+
+        With sharding off that's a single group on the main database.  Raises ServiceUnavailable
+        before anything is written if any of the rows' buckets is being moved.
+        """
+        if not self.enabled():
+            return [(_directory(self.app_now()), rows)]
+        groups = {}
+        for row in rows:
+            shard = self.check_bucket(self.bucket_for_username(row["username"]), writing=True)
+            groups.setdefault(shard, []).append(row)
+        engines = self.engines()
+        return [(engines[shard], shard_rows) for shard, shard_rows in sorted(groups.items())]
+
+    def assign_feedback_ids(self, rows):
+        """Fill in the id of Core feedback rows (dicts with a username) when sharding is on."""
+        if self.enabled():
+            for row in rows:
+                row["id"] = self.new_feedback_ids(row["username"])[0]
+        return rows
+
+    def _sequence_numbers(self, count):
+        app = self.app_now()
+        # per process, as a forked worker mustn't carry on with its parent's block
+        key = (app, os.getpid())
+        numbers = []
+        with self._lock:
+            while len(numbers) < count:
+                start, end = self._ids.get(key, (0, 0))
+                if start == end:
+                    start, end = self._reserve_block(app)
+                take = min(count - len(numbers), end - start)
+                numbers.extend(range(start, start + take))
+                self._ids[key] = (start + take, end)
+        return numbers
+
+    def _reserve_past(self, app, sequence):
+        """Make sure no sequence number below `sequence` is handed out from now on."""
+        table = _tables()["id_blocks"]
+        with _directory(app).begin() as connection:
+            updated = connection.execute(
+                table.update().where(table.c.name == "feedback", table.c.next_value < sequence).values(next_value=sequence)
+            ).rowcount
+            if not updated and connection.execute(select(table.c.name).where(table.c.name == "feedback")).first() is None:
+                connection.execute(table.insert().values(name="feedback", next_value=sequence))
+        with self._lock:
+            start, end = self._ids.get((app, os.getpid()), (0, 0))
+            if start < sequence:
+                self._ids[(app, os.getpid())] = (max(start, min(sequence, end)), end)
+
+    # Feedback migrated from the main database
+
+    def moved_feedback_id(self, feedback_id):
+        """The new id of feedback migrated from the main database as feedback_id, or None."""
+        app = self.app_now()
+        table = _tables()["moved_feedback"]
+        # new ids all start above the old ones, so most requests are settled by the cached highest old id
+        cached = app.extensions.get("moved_feedback_highest")
+        if cached is None or time.monotonic() - cached[0] >= app.config["SHARD_MAP_TTL"]:
+            with _directory(app).connect() as connection:
+                highest = connection.execute(select(func.max(table.c.old_id))).scalar()
+            cached = app.extensions["moved_feedback_highest"] = (time.monotonic(), highest)
+        if cached[1] is None or feedback_id > cached[1]:
+            return None
+        with _directory(app).connect() as connection:
+            return connection.execute(select(table.c.new_id).where(table.c.old_id == feedback_id)).scalar()
+
+    def _redirect_moved_feedback(self):
+        if not (self.enabled() and request.view_args and "feedback_id" in request.view_args):
+            return None
+        new_id = self.moved_feedback_id(request.view_args["feedback_id"])
+        if new_id is None:
+            return None
+        url = url_for(request.endpoint, **{**request.view_args, "feedback_id": new_id})
+        if request.query_string:
+            url += "?" + request.query_string.decode("latin1")
+        # 308 keeps the method and body, so an old form's POST still lands
+        return redirect(url, 308)
+
+    def _reserve_block(self, app):
+        table = _tables()["id_blocks"]
+        size = app.config["SHARD_ID_BLOCK_SIZE"]
+        while True:
+            try:
+                with _directory(app).begin() as connection:
+                    # the UPDATE holds the row's lock until commit, so no two processes get the same block
+                    updated = connection.execute(
+                        table.update().where(table.c.name == "feedback").values(next_value=table.c.next_value + size)
+                    ).rowcount
+                    if not updated:
+                        connection.execute(table.insert().values(name="feedback", next_value=1 + size))
+                    end = connection.execute(select(table.c.next_value).where(table.c.name == "feedback")).scalar()
+                return end - size, end
+            except IntegrityError:
+                # another process inserted the first block at the same time, take the next one
+                continue
+
+    # Emails
+
+    def claim_emails(self, users):
+        """Record [(username, email)] in the main database's user_emails, before the users are written.
+
+        Raises IntegrityError if an email already belongs to another user.  A claim is taken
+        over if its user never made it onto their shard (say the insert there failed) and it's
+        more than STALE_CLAIM_SECONDS old, so it can't be a registration still in progress.
+        """
+        app = self.app_now()
+        table = _tables()["user_emails"]
+        rows = [{"email": email, "username": username, "claimed_at": datetime.utcnow()} for username, email in users]
+        try:
+            with _directory(app).begin() as connection:
+                connection.execute(table.insert(), rows)
+            return
+        except IntegrityError as error:
+            if len(rows) > 1:
+                # find out which one, claiming the rest
+                for row in rows:
+                    self.claim_emails([(row["username"], row["email"])])
+                return
+            conflict = error
+        row = rows[0]
+        with _directory(app).begin() as connection:
+            owner = connection.execute(select(table.c.username, table.c.claimed_at).where(table.c.email == row["email"])).one_or_none()
+            if owner is None:
+                # released in the meantime
+                connection.execute(table.insert(), row)
+                return
+            if owner.username == row["username"]:
+                return
+            stale = owner.claimed_at < row["claimed_at"] - timedelta(seconds=STALE_CLAIM_SECONDS)
+            if not stale or self._has_user(app, owner.username, row["email"]):
+                raise conflict
+            connection.execute(
+                table.update().where(table.c.email == row["email"], table.c.username == owner.username).values(row)
+            )
+
+    def release_emails(self, usernames):
+        """Forget the emails of users that are gone for good."""
+        table = _tables()["user_emails"]
+        with _directory(self.app_now()).begin() as connection:
+            connection.execute(table.delete().where(table.c.username.in_(usernames)))
+
+    def _has_user(self, app, username, email):
+        users = _tables()["users"]
+        with self.engines(app)[self.shard_for_username(username)].connect() as connection:
+            return connection.execute(
+                select(users.c.username).where(users.c.username == username, users.c.email == email)
+            ).first() is not None
+
+
+# How old an email claim with no user behind it has to be before someone else can take it
+STALE_CLAIM_SECONDS = 60
+
+def _tables():
+    return shard_router.app_now().extensions["sqlalchemy"].db.metadata.tables
+
+def _directory(app):
+    """The main database's engine, which holds the bucket map and id blocks."""
+    return app.extensions["sqlalchemy"].db.get_engine(app)
+
+
+# Rebalancing
+
+def plan_rebalance(bucket_map, shards):
+    """Return [(bucket, from shard, to shard)] giving each of `shards` shards an even share of the buckets.
+
+    Buckets only move off shards holding more than their share, onto ones holding less.
+    """
+    share, extra = divmod(len(bucket_map), shards)
+    quota = [share + (1 if shard < extra else 0) for shard in range(shards)]
+    owned = {shard: [] for shard in range(shards)}
+    for bucket, shard in sorted(bucket_map.items()):
+        owned.setdefault(shard, []).append(bucket)
+
+    surplus = []
+    for shard, buckets in sorted(owned.items()):
+        keep = quota[shard] if shard < shards else 0
+        surplus.extend((bucket, shard) for bucket in buckets[keep:])
+    moves = []
+    for shard in range(shards):
+        while len(owned[shard]) < quota[shard]:
+            bucket, source = surplus.pop()
+            owned[shard].append(bucket)
+            moves.append((bucket, source, shard))
+    return moves
+
+def move_buckets(buckets, target, batch_size=1000, echo=lambda message: None):
+    """Move every user in buckets, with their feedback, stats and revisions, to the target shard.
+
+    All of the buckets must currently be on the same shard.  Steps:
+      1. mark the buckets as moving, and wait for every process to stop writing to them;
+      2. copy their rows to the target in batches (after clearing any left there by an
+         interrupted move);
+      3. point the buckets at the target, and wait for every process to stop reading the source;
+      4. delete their rows from the source in batches.
+    An interrupted move can simply be run again.
+    """
+    from models import User, Feedback, UserStats, FeedbackRevision
+
+    app = shard_router.app_now()
+    router = shard_router
+    buckets = set(buckets)
+    engines = router.engines(app)
+    sources = {router.locate(bucket)[0] for bucket in buckets}
+    if len(sources) != 1:
+        raise click.ClickException("Buckets being moved together must all be on the same shard.")
+    source = sources.pop()
+    if source == target:
+        return 0
+    bucket_table = _tables()["shard_buckets"]
+    users, feedback, stats, revisions = User.__table__, Feedback.__table__, UserStats.__table__, FeedbackRevision.__table__
+
+    def set_map(values):
+        with _directory(app).begin() as connection:
+            for bucket in buckets:
+                updated = connection.execute(bucket_table.update().where(bucket_table.c.bucket == bucket).values(**values)).rowcount
+                if not updated:
+                    # an unpinned bucket, still where bucket % shards put it
+                    connection.execute(bucket_table.insert().values({"bucket": bucket, "shard": source, "moving_to": None, **values}))
+        router.bucket_map(fresh=True)
+        time.sleep(app.config["SHARD_MAP_TTL"])
+
+    def usernames_in(engine):
+        """The buckets' usernames on a shard in batches, found through the shard_bucket index."""
+        after = ""
+        while True:
+            with engine.connect() as connection:
+                batch = connection.execute(
+                    select(users.c.username)
+                    .where(users.c.shard_bucket.in_(buckets), users.c.username > after)
+                    .order_by(users.c.username)
+                    .limit(batch_size)
+                ).scalars().all()
+            if not batch:
+                return
+            after = batch[-1]
+            yield batch
+
+    def delete_users(engine, usernames):
+        # feedback in batches first, so no single statement cascades over a long history
+        from purge import _delete_in_batches
+        for username in usernames:
+            _delete_in_batches(feedback, select(feedback.c.id).where(feedback.c.username == username), batch_size, engine)
+        with engine.begin() as connection:
+            connection.execute(users.delete().where(users.c.username.in_(usernames)))
+
+    echo(f"Moving {len(buckets)} buckets from shard {source} to shard {target}.")
+    set_map({"moving_to": target})
+
+    moved = 0
+    for usernames in usernames_in(engines[source]):
+        delete_users(engines[target], usernames)
+        with engines[source].connect() as reader, engines[target].begin() as writer:
+            writer.execute(users.insert(), [dict(row) for row in reader.execute(select(users).where(users.c.username.in_(usernames))).mappings()])
+            rows = [dict(row) for row in reader.execute(select(stats).where(stats.c.username.in_(usernames))).mappings()]
+            if rows:
+                writer.execute(stats.insert(), rows)
+        for username in usernames:
+            after = -1
+            while True:
+                with engines[source].connect() as reader, engines[target].begin() as writer:
+                    rows = [dict(row) for row in reader.execute(
+                        select(feedback).where(feedback.c.username == username, feedback.c.id > after).order_by(feedback.c.id).limit(batch_size)
+                    ).mappings()]
+                    if not rows:
+                        break
+                    writer.execute(feedback.insert(), rows)
+                    after = rows[-1]["id"]
+                    history = [dict(row) for row in reader.execute(
+                        select(revisions).where(revisions.c.feedback_id.in_([row["id"] for row in rows]))
+                    ).mappings()]
+                    if history:
+                        writer.execute(revisions.insert(), history)
+        moved += len(usernames)
+        echo(f"  copied {moved} users")
+
+    set_map({"shard": target, "moving_to": None})
+
+    for usernames in usernames_in(engines[source]):
+        delete_users(engines[source], usernames)
+    echo(f"Moved {moved} users.")
+    return moved
+
+def migrate_main_database(batch_size=1000, echo=lambda message: None):
+    """Move the users left in the main database, with their feedback, stats and revisions, onto their shards.
+
+    Those are the rows from before sharding was turned on, which the app no longer sees.  Each
+    user's feedback gets new ids ending in their bucket, and moved_feedback maps the old ids to
+    them, so old /feedback/<id> links are redirected.  A user is copied in batches, then
+    deleted from the main database; one interrupted half way is copied again on the next run.
+    A user whose username or email has since been taken by someone on the shards is left where
+    they are.  Returns (users moved, usernames left behind).
+    """
+    from models import User, Feedback, UserStats, FeedbackRevision, MovedFeedback
+    from purge import _delete_in_batches
+
+    app = shard_router.app_now()
+    router = shard_router
+    main = _directory(app)
+    users, feedback, stats, revisions = User.__table__, Feedback.__table__, UserStats.__table__, FeedbackRevision.__table__
+    moved_feedback = MovedFeedback.__table__
+    router.create_all(app)
+
+    def delete_user(engine, username):
+        _delete_in_batches(feedback, select(feedback.c.id).where(feedback.c.username == username), batch_size, engine)
+        with engine.begin() as connection:
+            connection.execute(users.delete().where(users.c.username == username))
+
+    def move_user(user):
+        username = user["username"]
+        user["shard_bucket"] = router.bucket_for_username(username)
+        engine = router.engines(app)[router.check_bucket(user["shard_bucket"], writing=True)]
+        with engine.connect() as connection:
+            existing = connection.execute(select(users).where(users.c.username == username)).mappings().one_or_none()
+        if existing is not None:
+            if dict(existing) != user:
+                return False
+            # copied by an earlier run that didn't finish
+            delete_user(engine, username)
+        try:
+            router.claim_emails([(username, user["email"])])
+        except IntegrityError:
+            return False
+
+        with main.connect() as reader, engine.begin() as writer:
+            writer.execute(users.insert(), user)
+            rows = [dict(row) for row in reader.execute(select(stats).where(stats.c.username == username)).mappings()]
+            if rows:
+                writer.execute(stats.insert(), rows)
+        new_ids = {}
+        after = -1
+        while True:
+            with main.connect() as reader, engine.begin() as writer:
+                rows = [dict(row) for row in reader.execute(
+                    select(feedback).where(feedback.c.username == username, feedback.c.id > after).order_by(feedback.c.id).limit(batch_size)
+                ).mappings()]
+                if not rows:
+                    break
+                after = rows[-1]["id"]
+                ids = dict(zip((row["id"] for row in rows), router.new_feedback_ids(username, len(rows))))
+                writer.execute(feedback.insert(), [{**row, "id": ids[row["id"]]} for row in rows])
+                history = [{**row, "feedback_id": ids[row["feedback_id"]]} for row in reader.execute(
+                    select(revisions).where(revisions.c.feedback_id.in_(list(ids)))
+                ).mappings()]
+                if history:
+                    writer.execute(revisions.insert(), history)
+                new_ids.update(ids)
+
+        old_ids = list(new_ids)
+        for start in range(0, len(old_ids), batch_size):
+            batch = old_ids[start:start + batch_size]
+            with main.begin() as connection:
+                connection.execute(moved_feedback.delete().where(moved_feedback.c.old_id.in_(batch)))
+                connection.execute(moved_feedback.insert(), [{"old_id": old_id, "new_id": new_ids[old_id]} for old_id in batch])
+        delete_user(main, username)
+        return True
+
+    moved, left = 0, []
+    after = ""
+    while True:
+        with main.connect() as connection:
+            batch = connection.execute(
+                select(users).where(users.c.username > after).order_by(users.c.username).limit(batch_size)
+            ).mappings().all()
+        if not batch:
+            break
+        after = batch[-1]["username"]
+        for user in batch:
+            if move_user(dict(user)):
+                moved += 1
+            else:
+                left.append(user["username"])
+        echo(f"  moved {moved} users")
+    echo(f"Moved {moved} users onto the shards.")
+    return moved, left
+
+
+shards_cli = AppGroup("shards", help="Manage the user shards.")
+
+@shards_cli.command("init")
+def init_command():
+    """Create the sharded tables on every shard and pin the bucket map."""
+    shard_router.create_all()
+    click.echo(f"Set up {len(current_app.config['SQLALCHEMY_SHARD_URIS'])} shards.")
+
+@shards_cli.command("status")
+def status_command():
+    """Show how many buckets each shard holds, and any moves in progress."""
+    bucket_map = shard_router.bucket_map(fresh=True)
+    for shard in range(len(current_app.config["SQLALCHEMY_SHARD_URIS"])):
+        count = sum(1 for owner, _ in bucket_map.values() if owner == shard)
+        click.echo(f"shard {shard}: {count} buckets")
+    for bucket, (shard, moving_to) in sorted(bucket_map.items()):
+        if moving_to is not None:
+            click.echo(f"bucket {bucket} is moving from shard {shard} to shard {moving_to}")
+
+@shards_cli.command("move")
+@click.argument("bucket", type=int)
+@click.argument("target", type=int)
+@click.option("--batch-size", default=1000, help="rows copied or deleted per transaction")
+def move_command(bucket, target, batch_size):
+    """Move one bucket's users to the TARGET shard."""
+    move_buckets([bucket], target, batch_size, echo=click.echo)
+
+@shards_cli.command("migrate")
+@click.option("--batch-size", default=1000, help="rows copied or deleted per transaction")
+def migrate_command(batch_size):
+    """Move the users and feedback from before sharding out of the main database onto the shards."""
+    _, left = migrate_main_database(batch_size, echo=click.echo)
+    if left:
+        raise click.ClickException(f"Left {len(left)} users in the main database, their username or email is taken on the shards: {', '.join(left)}")
+
+@shards_cli.command("rebalance")
+@click.option("--batch-size", default=1000, help="rows copied or deleted per transaction")
+@click.option("--dry-run", is_flag=True, help="only print the moves")
+def rebalance_command(batch_size, dry_run):
+    """Even out buckets across the shards, e.g. after adding one to SQLALCHEMY_SHARD_URIS."""
+    bucket_map = {bucket: shard for bucket, (shard, _) in shard_router.bucket_map(fresh=True).items()}
+    moves = plan_rebalance(bucket_map, len(current_app.config["SQLALCHEMY_SHARD_URIS"]))
+    grouped = {}
+    for bucket, source, target in moves:
+        grouped.setdefault((source, target), []).append(bucket)
+    for (source, target), buckets in sorted(grouped.items()):
+        click.echo(f"{len(buckets)} buckets from shard {source} to shard {target}")
+        if not dry_run:
+            move_buckets(buckets, target, batch_size, echo=click.echo)
+
+
+shard_router = ShardRouter()
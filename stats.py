@@ -0,0 +1,85 @@
+import click
+from flask import Blueprint, current_app, render_template, session, flash
+from sqlalchemy import func
+
+from models import db, User, Feedback, UserStats
+from assets import prerendered
+from replicas import read_only
+from sharding import shard_router
+
+stats_bp = Blueprint("stats", __name__)
+
+
+def reconcile_user_stats(batch_size=1000):
+    """Recount every user's feedback and fix any user_stats rows that drifted (or are missing).
+
+    Walks users in username order, batch_size at a time, so each batch only reads its own users'
+    rows from ix_feedback_username_id and commits on its own.  Returns the number of rows fixed.
+    """
+    # a user's stats and feedback are always on the same shard, so each shard is recounted alone
+    return sum(_reconcile_shard(batch_size) for _ in shard_router.each())
+
+def _reconcile_shard(batch_size):
+    fixed = 0
+    after = ""
+    while True:
+        usernames = [
+            username for (username,) in
+            db.session.query(User.username).filter(User.username > after).order_by(User.username).limit(batch_size)
+        ]
+        if not usernames:
+            return fixed
+        after = usernames[-1]
+
+        actual = {
+            username: (count, latest) for username, count, latest in
+            db.session.query(Feedback.username, func.count(Feedback.id), func.max(Feedback.updated_at))
+            .filter(Feedback.username.in_(usernames))
+            .group_by(Feedback.username)
+        }
+        stored = {stats.username: stats for stats in UserStats.query.filter(UserStats.username.in_(usernames))}
+
+        for username in usernames:
+            count, latest = actual.get(username, (0, None))
+            stats = stored.get(username)
+            if stats is None:
+                db.session.add(UserStats(username=username, feedback_count=count, last_feedback_at=latest))
+                fixed += 1
+            elif (stats.feedback_count, stats.last_feedback_at) != (count, latest):
+                stats.feedback_count = count
+                stats.last_feedback_at = latest
+                fixed += 1
+        db.session.commit()
+
+@stats_bp.cli.command("reconcile")
+@click.option("--batch-size", default=1000, help="users recounted per transaction")
+def reconcile_command(batch_size):
+    """Recount user_stats from the feedback table, e.g. nightly from cron."""
+    click.echo(f"Fixed {reconcile_user_stats(batch_size)} user_stats rows.")
+
+
+@stats_bp.route('/stats')
+@read_only
+def show_stats():
+    """Show the logged in user's numbers, the top contributors and the most recently active users."""
+    if 'username' not in session:
+        flash("Please log in to see feedback stats.", "danger")
+        return prerendered('401.html'), 401
+
+    size = current_app.config["STATS_LEADERBOARD_SIZE"]
+    # Each of these is a primary key lookup or a short walk down an index on user_stats
+    with shard_router.using(username=session['username']):
+        mine = UserStats.query.get(session['username'])
+    # With shards, each one's top `size` are merged and cut down to the overall top `size`
+    leaders, recent = [], []
+    for _ in shard_router.each():
+        leaders += UserStats.query.order_by(UserStats.feedback_count.desc(), UserStats.username).limit(size).all()
+        recent += (
+            UserStats.query.filter(UserStats.last_feedback_at.isnot(None))
+            .order_by(UserStats.last_feedback_at.desc())
+            .limit(size)
+            .all()
+        )
+    leaders = sorted(leaders, key=lambda stats: (-stats.feedback_count, stats.username))[:size]
+    recent = sorted(recent, key=lambda stats: stats.last_feedback_at, reverse=True)[:size]
+    return render_template('stats.html', mine=mine, leaders=leaders, recent=recent)
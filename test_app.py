@@ -1,15 +1,43 @@
+import asyncio
+import inspect
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
 from unittest import TestCase
+from unittest.mock import patch
 
-from app import app
-from flask import session
-from models import db, User, Feedback
+from app import create_app
+from config import TestingConfig
+from flask import Flask, session
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import load_only
+from models import db, User, Feedback, FeedbackRevision, UserStats, ShardBucket, UserEmail, MovedFeedback, unknown_usernames
+from sessions import ServerSideSessionInterface
+from hashing import PasswordHasher, password_hasher, hash_rounds
+from cache import fragment_cache
+from instrumentation import DBInstrumentation, db_instrumentation
+from ingest import SpillFile, write_behind
+from ratelimit import rate_limiter
+from assets import static_assets, check_integrity
+from replicas import db_replicas
+from purge import purger, purge_deleted
+from profiling import RequestProfiler, request_profiler
+from async_db import AsyncViewsAsgi
+from test_async_db import asgi_request
+import search
+from sharding import shard_router, move_buckets, ShardNotChosen
+
+class AsyncTestingConfig(TestingConfig):
+    ASYNC_MODE = True
+
+# Built first so the shared extensions end up bound to the main test app
+async_app = create_app(AsyncTestingConfig)
 
 # Use test database and don't clutter tests with SQL
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///flask_feedback_test_db'
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['TESTING'] = True
-app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
-app.config['WTF_CSRF_ENABLED'] = False
+app = create_app(TestingConfig)
 
 db.drop_all()
 db.create_all()
@@ -21,6 +49,7 @@ class UserViewsTestCase(TestCase):
         """Add a test user and feedback."""
         
         User.query.delete()
+        fragment_cache.clear()
         
         test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
         db.session.add(test_user_1)
@@ -115,6 +144,23 @@ class UserViewsTestCase(TestCase):
             self.assertIn('Invalid username/password.', html)
             self.assertIsNone(session.get("username"))
             
+    def test_log_in_unknown_username_is_cached(self):
+        """Testing unknown usernames are remembered until that username registers."""
+        with app.test_client() as client:
+            data = {"username": "BobaFett", "password": "password"}
+            client.post("/login", data=data)
+            
+            self.assertIn("BobaFett", unknown_usernames)
+            
+            registration = {"username": "BobaFett", "password": "password", "email": "bounty@email.com", "first_name": "Boba", "last_name": "Fett"}
+            client.post("/register", data=registration)
+            client.post("/logout")
+            resp = client.post("/login", data=data)
+            
+            self.assertNotIn("BobaFett", unknown_usernames)
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(f'{session.get("username")}', 'BobaFett')
+            
     def test_log_in_invalid_password(self):
         """Testing logging in a user with an invalid password."""
         with app.test_client() as client:
@@ -160,6 +206,83 @@ class UserViewsTestCase(TestCase):
             self.assertEqual(resp.status_code, 401)
             self.assertIn("<h1>You aren't authorized to do that.</h1>", html)
             
+class ServerSideSessionTestCase(TestCase):
+    """Test server-side sessions"""
+    
+    def setUp(self):
+        """Add a test user."""
+        
+        User.query.delete()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        db.session.add(test_user_1)
+        db.session.commit()
+        
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        
+    def session_id(self, client):
+        cookie = next(cookie for cookie in client.cookie_jar if cookie.name == app.session_cookie_name)
+        return cookie.value
+        
+    def test_cookie_is_opaque_and_rotates_on_login(self):
+        """Testing the cookie only holds a session id, which changes on login."""
+        with app.test_client() as client:
+            client.post("/login", data={"username": "BobaFett", "password": "password"})
+            client.get("/users/testUser1")
+            anonymous_id = self.session_id(client)
+            client.post("/login", data={"username": "testUser1", "password": "password"})
+            logged_in_id = self.session_id(client)
+            
+            self.assertNotEqual(anonymous_id, logged_in_id)
+            self.assertNotIn("testUser1", logged_in_id)
+            self.assertIsNone(app.session_interface.store.get(f"session:{anonymous_id}"))
+            self.assertEqual(app.session_interface.store.get(f"session:{logged_in_id}")["data"]["username"], "testUser1")
+            
+    def test_deleting_user_revokes_other_sessions(self):
+        """Testing deleting a user logs them out on every device."""
+        phone = app.test_client()
+        laptop = app.test_client()
+        phone.post("/login", data={"username": "testUser1", "password": "password"})
+        laptop.post("/login", data={"username": "testUser1", "password": "password"})
+        
+        phone.post("/users/testUser1/delete")
+        resp = laptop.get("/users/testUser1", follow_redirects=True)
+        
+        self.assertIn("Please register or login first!", resp.get_data(as_text=True))
+        
+    def test_last_seen_writes_are_batched(self):
+        """Testing reads only record last-seen times in a batch."""
+        with app.test_client() as client:
+            client.post("/login", data={"username": "testUser1", "password": "password"})
+            client.get("/users/testUser1")
+            sid = self.session_id(client)
+            
+            record = app.session_interface.store.get(f"session:{sid}")
+            seen = record["last_seen"]
+            app.session_interface._last_flush = time.monotonic()
+            client.get("/users/testUser1")
+            
+            self.assertIn(sid, app.session_interface._pending)
+            app.session_interface.flush_last_seen()
+            self.assertGreater(app.session_interface.store.get(f"session:{sid}")["last_seen"], seen)
+            
+    def test_flush_after_revocation(self):
+        """Testing a last-seen time flushed after a revocation doesn't bring the session back once the idle timeout passes."""
+        sessions = ServerSideSessionInterface(idle_timeout=100, last_seen_interval=10)
+        sessions.store.set("session:abc", {"data": {"username": "testUser1"}, "created": time.time(), "last_seen": time.time()})
+        sessions._pending["abc"] = time.time()
+        sessions.revoke_user("testUser1")
+        
+        now = time.monotonic()
+        with patch("time.monotonic", return_value=now + 50):
+            sessions.flush_last_seen()
+        with patch("time.monotonic", return_value=now + 105):
+            self.assertIsNone(sessions.store.get("session:abc"))
+            self.assertIsNotNone(sessions.revocations.get("testUser1"))
+            
 class FeedbackViewsTestCase(TestCase):
     """Test views for Feedback"""
     
@@ -167,6 +290,7 @@ class FeedbackViewsTestCase(TestCase):
         """Add a test user and feedback."""
         
         User.query.delete()
+        fragment_cache.clear()
         
         test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
         db.session.add(test_user_1)
@@ -273,4 +397,1843 @@ class FeedbackViewsTestCase(TestCase):
             html = resp.get_data(as_text=True)
             
             self.assertEqual(resp.status_code, 401)
-            self.assertIn('Please log in before deleting feedback.', html)
\ No newline at end of file
+            self.assertIn('Please log in before deleting feedback.', html)
+class BulkFeedbackTestCase(TestCase):
+    """Test bulk import and export of feedback"""
+    
+    def setUp(self):
+        """Add a test user and feedback, and log them in."""
+        
+        User.query.delete()
+        fragment_cache.clear()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        db.session.add(test_user_1)
+        db.session.commit()
+        
+        feedback = Feedback(title='Test Feedback', content='This is only a test.', username=test_user_1.username)
+        db.session.add(feedback)
+        db.session.commit()
+        
+        self.client = app.test_client()
+        self.client.post("/login", data={"username": "testUser1", "password": "password"})
+        
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        
+    def test_import_ndjson(self):
+        """Testing importing NDJSON feedback, skipping and reporting invalid rows."""
+        body = '{"title": "First", "content": "One"}\n\n{"title": "", "content": "Two"}\nnot json\n{"title": "Third", "content": "Three"}\n'
+        resp = self.client.post("/users/testUser1/feedback/import", data=body, content_type="application/x-ndjson")
+        
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json["imported"], 2)
+        self.assertEqual(resp.json["rejected"], 2)
+        self.assertEqual([error["line"] for error in resp.json["errors"]], [3, 4])
+        self.assertEqual(Feedback.query.filter_by(username="testUser1").count(), 3)
+        
+    def test_import_rejects_non_string_values(self):
+        """Testing NDJSON values that aren't strings are rejected row by row rather than failing the upload."""
+        body = "\n".join([
+            '{"title": 5, "content": "Number title"}',
+            '{"title": "List", "content": ["a"]}',
+            '{"title": "Object", "content": {"text": "b"}}',
+            '{"title": "Fine", "content": "Kept"}',
+        ])
+        resp = self.client.post("/users/testUser1/feedback/import", data=body, content_type="application/x-ndjson")
+        
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json["imported"], 1)
+        self.assertEqual(resp.json["rejected"], 3)
+        self.assertEqual([error["line"] for error in resp.json["errors"]], [1, 2, 3])
+        self.assertEqual(resp.json["errors"][0]["errors"], {"title": ["Must be a string."]})
+        self.assertEqual(Feedback.query.filter_by(title="Fine").one().content, "Kept")
+        
+    def test_import_rejects_control_characters(self):
+        """Testing imported rows can't carry control characters such as search's highlight markers."""
+        body = "\n".join([
+            '{"title": "Marked", "content": "\\u0002<b>bold</b>"}',
+            '{"title": "Lines", "content": "One\\r\\n\\tTwo"}',
+        ])
+        resp = self.client.post("/users/testUser1/feedback/import", data=body, content_type="application/x-ndjson")
+        
+        self.assertEqual(resp.json["imported"], 1)
+        self.assertEqual(resp.json["errors"], [{"line": 1, "errors": {"content": ["Can't contain control characters."]}}])
+        self.assertEqual(Feedback.query.filter_by(title="Lines").one().content, "One\r\n\tTwo")
+        
+    def test_import_csv_in_batches(self):
+        """Testing importing CSV feedback across several INSERT batches."""
+        app.config['FEEDBACK_IMPORT_BATCH_SIZE'] = 2
+        try:
+            body = "title,content\n" + "".join(f'Row {i},"Content, {i}"\n' for i in range(5))
+            resp = self.client.post("/users/testUser1/feedback/import", data=body, content_type="text/csv")
+        finally:
+            app.config['FEEDBACK_IMPORT_BATCH_SIZE'] = 1000
+        
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json["imported"], 5)
+        self.assertEqual(Feedback.query.filter_by(title="Row 4").one().content, "Content, 4")
+        
+    def test_import_rejects_form_uploads(self):
+        """Testing imports must be raw NDJSON or CSV bodies."""
+        resp = self.client.post("/users/testUser1/feedback/import", data={"title": "First", "content": "One"})
+        
+        self.assertEqual(resp.status_code, 415)
+        
+    def test_export(self):
+        """Testing exporting feedback as NDJSON and CSV."""
+        resp = self.client.get("/users/testUser1/feedback/export")
+        
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        self.assertIn('"title": "Test Feedback"', resp.get_data(as_text=True))
+        
+        resp = self.client.get("/users/testUser1/feedback/export?format=csv")
+        lines = resp.get_data(as_text=True).splitlines()
+        
+        self.assertEqual(lines[0], "id,title,content")
+        self.assertTrue(lines[1].endswith(",Test Feedback,This is only a test."))
+        
+    def test_bulk_not_logged_in(self):
+        """Testing bulk endpoints need the owner to be logged in."""
+        with app.test_client() as client:
+            resp = client.get("/users/testUser1/feedback/export")
+            self.assertEqual(resp.status_code, 401)
+            
+            resp = client.post("/users/testUser1/feedback/import", data="", content_type="text/csv")
+            self.assertEqual(resp.status_code, 401)
+            
+class FeedbackSearchTestCase(TestCase):
+    """Test searching feedback"""
+    
+    def setUp(self):
+        """Add two users with feedback, and log one in."""
+        
+        User.query.delete()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        test_user_2 = User.registerUser(username="testUser2", password="password", email="test2@email.com", first_name="Jane", last_name="Doe")
+        db.session.add_all([test_user_1, test_user_2])
+        db.session.commit()
+        
+        db.session.add_all([
+            Feedback(title='Kessel Run', content='Made the Kessel Run in less than twelve parsecs.', username="testUser1"),
+            Feedback(title='Test Feedback', content='This is only a test.', username="testUser1"),
+            Feedback(title='Parsecs', content='A parsecs is a unit of distance & not time.', username="testUser2"),
+        ])
+        db.session.commit()
+        
+        self.client = app.test_client()
+        self.client.post("/login", data={"username": "testUser1", "password": "password"})
+        
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        
+    def test_search(self):
+        """Testing search returns matching feedback with highlighted, escaped snippets."""
+        resp = self.client.get("/feedback/search?q=parsecs")
+        html = resp.get_data(as_text=True)
+        
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('<h5 class="card-subtitle">Kessel Run</h5>', html)
+        self.assertIn('<h5 class="card-subtitle">Parsecs</h5>', html)
+        self.assertNotIn('<h5 class="card-subtitle">Test Feedback</h5>', html)
+        self.assertIn('<mark>parsecs</mark>', html)
+        self.assertIn('&amp; not time', html)
+        
+    def test_stray_markers_in_content(self):
+        """Testing highlight markers already stored in content can't open <mark> tags of their own."""
+        db.session.add(Feedback(title='Stray', content='Twelve parsecs \x02and counting', username="testUser2"))
+        db.session.commit()
+        
+        html = self.client.get("/feedback/search?q=parsecs&username=testUser2").get_data(as_text=True)
+        
+        self.assertIn('<mark>parsecs</mark> and counting', html)
+        self.assertEqual(html.count('<mark>'), html.count('</mark>'))
+        
+    def test_search_by_username(self):
+        """Testing search can be limited to one user's feedback."""
+        resp = self.client.get("/feedback/search?q=parsecs&username=testUser2")
+        html = resp.get_data(as_text=True)
+        
+        self.assertIn('<h5 class="card-subtitle">Parsecs</h5>', html)
+        self.assertNotIn('<h5 class="card-subtitle">Kessel Run</h5>', html)
+        
+    def test_search_pages(self):
+        """Testing search results are paginated."""
+        app.config['FEEDBACK_PAGE_SIZE'] = 1
+        try:
+            html = self.client.get("/feedback/search?q=parsecs").get_data(as_text=True)
+            self.assertIn('page=2', html)
+            html = self.client.get("/feedback/search?q=parsecs&page=2").get_data(as_text=True)
+            self.assertIn('page=1', html)
+            self.assertNotIn('page=3', html)
+        finally:
+            app.config['FEEDBACK_PAGE_SIZE'] = 20
+            
+    def test_search_not_logged_in(self):
+        """Testing search needs a logged in user."""
+        with app.test_client() as client:
+            resp = client.get("/feedback/search?q=parsecs")
+            
+            self.assertEqual(resp.status_code, 401)
+            
+class APITestCase(TestCase):
+    """Test the JSON API"""
+    
+    def setUp(self):
+        """Add a test user with feedback, and log them in."""
+        
+        User.query.delete()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        db.session.add(test_user_1)
+        db.session.commit()
+        
+        feedback = [Feedback(title=f'Feedback {i}', content='API feedback.', username="testUser1") for i in range(3)]
+        db.session.add_all(feedback)
+        db.session.commit()
+        self.feedback_ids = [f.id for f in feedback]
+        
+        self.client = app.test_client()
+        self.client.post("/login", data={"username": "testUser1", "password": "password"})
+        
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        
+    def test_get_user(self):
+        """Testing a user's profile as JSON, with field selection."""
+        resp = self.client.get("/api/v1/users/testUser1")
+        
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json["email"], "test@email.com")
+        self.assertNotIn("password", resp.json)
+        self.assertTrue(resp.headers["ETag"])
+        
+        resp = self.client.get("/api/v1/users/testUser1?fields=first_name,last_name")
+        
+        self.assertEqual(resp.json, {"first_name": "John", "last_name": "Smith"})
+        self.assertEqual(self.client.get("/api/v1/users/testUser1?fields=password").status_code, 400)
+        self.assertEqual(self.client.get("/api/v1/users/nobody").status_code, 404)
+        
+    def test_empty_fields(self):
+        """Testing a fields list with nothing in it is refused rather than querying no columns."""
+        for url in ["/api/v1/users/testUser1?fields=,,", "/api/v1/users/testUser1?fields=%20",
+                    "/api/v1/users/testUser1/feedback?fields=,", f"/api/v1/feedback/{self.feedback_ids[0]}?fields=%20,"]:
+            resp = self.client.get(url)
+            
+            self.assertEqual(resp.status_code, 400)
+            self.assertIn("No fields requested.", resp.json["error"])
+        
+    def test_conditional_get(self):
+        """Testing a matching If-None-Match gets a 304 until the row changes."""
+        resp = self.client.get(f"/api/v1/feedback/{self.feedback_ids[0]}")
+        etag = resp.headers["ETag"]
+        
+        resp = self.client.get(f"/api/v1/feedback/{self.feedback_ids[0]}", headers={"If-None-Match": etag})
+        
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.get_data(), b"")
+        
+        self.client.post(f"/feedback/{self.feedback_ids[0]}/update", data={"title": "Changed", "content": "Changed."})
+        resp = self.client.get(f"/api/v1/feedback/{self.feedback_ids[0]}", headers={"If-None-Match": etag})
+        
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json["title"], "Changed")
+        
+    def test_feedback_pages(self):
+        """Testing feedback lists page with a cursor and revalidate per page."""
+        resp = self.client.get("/api/v1/users/testUser1/feedback?limit=2&fields=id,title")
+        
+        self.assertEqual(resp.json["feedback"], [{"id": self.feedback_ids[0], "title": "Feedback 0"}, {"id": self.feedback_ids[1], "title": "Feedback 1"}])
+        self.assertEqual(resp.json["next_cursor"], self.feedback_ids[1])
+        
+        resp = self.client.get(f"/api/v1/users/testUser1/feedback?limit=2&after={self.feedback_ids[1]}")
+        etag = resp.headers["ETag"]
+        
+        self.assertEqual([f["id"] for f in resp.json["feedback"]], self.feedback_ids[2:])
+        self.assertIsNone(resp.json["next_cursor"])
+        
+        resp = self.client.get(f"/api/v1/users/testUser1/feedback?limit=2&after={self.feedback_ids[1]}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+        
+        self.client.post(f"/feedback/{self.feedback_ids[2]}/delete")
+        resp = self.client.get(f"/api/v1/users/testUser1/feedback?limit=2&after={self.feedback_ids[1]}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json["feedback"], [])
+        
+    def test_api_not_logged_in(self):
+        """Testing the API needs a logged in user."""
+        with app.test_client() as client:
+            resp = client.get("/api/v1/users/testUser1")
+            
+            self.assertEqual(resp.status_code, 401)
+            
+class FragmentCacheTestCase(TestCase):
+    """Test caching of the user detail page fragments"""
+    
+    def setUp(self):
+        """Add a test user and feedback, and log them in."""
+        
+        User.query.delete()
+        fragment_cache.clear()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        db.session.add(test_user_1)
+        db.session.commit()
+        
+        feedback = Feedback(title='Test Feedback', content='This is only a test.', username=test_user_1.username)
+        db.session.add(feedback)
+        db.session.commit()
+        
+        self.feedback_id = feedback.id
+        self.client = app.test_client()
+        self.client.post("/login", data={"username": "testUser1", "password": "password"})
+        
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        
+    def test_cached_page_served_without_database(self):
+        """Testing a cached user page is served even when the rows change behind the cache's back."""
+        self.client.get("/users/testUser1")
+        Feedback.query.filter_by(id=self.feedback_id).update({"title": "Changed Directly"})
+        db.session.commit()
+        resp = self.client.get("/users/testUser1")
+        html = resp.get_data(as_text=True)
+        
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('<h5 class="card-subtitle">Test Feedback</h5>', html)
+        
+    def test_feedback_writes_invalidate_cache(self):
+        """Testing adding, updating and deleting feedback are visible straight away."""
+        self.client.get("/users/testUser1")
+        
+        resp = self.client.post("/users/testUser1/feedback/add", data={"title": "Brand New", "content": "New."}, follow_redirects=True)
+        self.assertIn('<h5 class="card-subtitle">Brand New</h5>', resp.get_data(as_text=True))
+        
+        resp = self.client.post(f"/feedback/{self.feedback_id}/update", data={"title": "Edited", "content": "Edited."}, follow_redirects=True)
+        self.assertIn('<h5 class="card-subtitle">Edited</h5>', resp.get_data(as_text=True))
+        
+        resp = self.client.post(f"/feedback/{self.feedback_id}/delete", follow_redirects=True)
+        self.assertNotIn('<h5 class="card-subtitle">Edited</h5>', resp.get_data(as_text=True))
+        
+    def test_shared_backend(self):
+        """Testing fragments can live in a pluggable shared backend."""
+        class StandInBackend(dict):
+            def set(self, key, value, ttl=None):
+                self[key] = value
+            def delete(self, key):
+                self.pop(key, None)
+        
+        backend, fragment_cache.backend = fragment_cache.backend, StandInBackend()
+        try:
+            self.client.get("/users/testUser1")
+            self.assertTrue(any(key.startswith("fragment:testUser1:") for key in fragment_cache.backend))
+        finally:
+            fragment_cache.backend = backend
+            
+class DBInstrumentationTestCase(TestCase):
+    """Test per-request DB instrumentation"""
+    
+    def setUp(self):
+        """Add a test user and feedback, and log them in."""
+        
+        User.query.delete()
+        fragment_cache.clear()
+        db_instrumentation.reset()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        db.session.add(test_user_1)
+        db.session.commit()
+        
+        self.client = app.test_client()
+        self.client.post("/login", data={"username": "testUser1", "password": "password"})
+        
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        
+    def test_query_headers(self):
+        """Testing responses report their query count and DB time."""
+        resp = self.client.get("/users/testUser1")
+        
+        self.assertEqual(resp.headers["X-DB-Query-Count"], "2")
+        self.assertGreater(float(resp.headers["X-DB-Time-Ms"]), 0)
+        self.assertLessEqual(float(resp.headers["X-DB-Slowest-Ms"]), float(resp.headers["X-DB-Time-Ms"]))
+        
+        # served from the fragment cache
+        resp = self.client.get("/users/testUser1")
+        
+        self.assertEqual(resp.headers["X-DB-Query-Count"], "0")
+        
+    def test_metrics_endpoint(self):
+        """Testing per-endpoint totals are served from /metrics/db."""
+        self.client.get("/users/testUser1")
+        self.client.get("/users/testUser1")
+        resp = self.client.get("/metrics/db")
+        
+        self.assertEqual(resp.json["users.show_secrets_page"]["requests"], 2)
+        self.assertEqual(resp.json["users.show_secrets_page"]["queries"], 2)
+        self.assertIn("SELECT", resp.json["users.show_secrets_page"]["slowest_statement"])
+        
+    def test_hidden_from_other_clients(self):
+        """Testing clients outside METRICS_ALLOWED_IPS get neither the headers nor the endpoint."""
+        outside = {"REMOTE_ADDR": "203.0.113.7"}
+        resp = self.client.get("/users/testUser1", environ_base=outside)
+        
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn("X-DB-Query-Count", resp.headers)
+        
+        resp = self.client.get("/metrics/db", environ_base=outside)
+        
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn("Page not found!", resp.get_data(as_text=True))
+        self.assertNotIn("SELECT", resp.get_data(as_text=True))
+        
+    def test_off_by_default(self):
+        """Testing an app that doesn't ask for them has no headers and no /metrics/db route."""
+        other = Flask(__name__)
+        DBInstrumentation(other)
+        
+        self.assertFalse(other.config["DB_INSTRUMENTATION_HEADERS"])
+        self.assertNotIn("/metrics/db", [rule.rule for rule in other.url_map.iter_rules()])
+        
+class FeedbackPaginationTestCase(TestCase):
+    """Test keyset pagination of feedback on the user detail page"""
+    
+    def setUp(self):
+        """Add a test user with enough feedback for several pages."""
+        
+        User.query.delete()
+        fragment_cache.clear()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        db.session.add(test_user_1)
+        db.session.commit()
+        
+        db.session.add_all([Feedback(title=f'Feedback {i}', content='Paged feedback.', username=test_user_1.username) for i in range(25)])
+        db.session.commit()
+        
+        self.ids = [f.id for f in Feedback.query.filter_by(username="testUser1").order_by(Feedback.id)]
+        
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        
+    def test_page_for_user(self):
+        """Testing walking forwards and backwards through pages of feedback."""
+        first = Feedback.page_for_user("testUser1", per_page=10)
+        self.assertEqual([f.id for f in first.items], self.ids[:10])
+        self.assertIsNone(first.prev_cursor)
+        self.assertEqual(first.next_cursor, self.ids[9])
+        
+        last = Feedback.page_for_user("testUser1", after=self.ids[19], per_page=10)
+        self.assertEqual([f.id for f in last.items], self.ids[20:])
+        self.assertIsNone(last.next_cursor)
+        
+        middle = Feedback.page_for_user("testUser1", before=last.prev_cursor, per_page=10)
+        self.assertEqual([f.id for f in middle.items], self.ids[10:20])
+        self.assertEqual(middle.prev_cursor, self.ids[10])
+        self.assertEqual(middle.next_cursor, self.ids[19])
+        
+    def test_no_prev_cursor_without_earlier_feedback(self):
+        """Testing a page after a cursor only links back when there's feedback before it."""
+        self.assertIsNone(Feedback.page_for_user("testUser1", after=0, per_page=10).prev_cursor)
+        
+        Feedback.query.filter(Feedback.id.in_(self.ids[:10])).update({"deleted_at": datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        page = Feedback.page_for_user("testUser1", after=self.ids[9], per_page=10)
+        self.assertEqual([f.id for f in page.items], self.ids[10:20])
+        self.assertIsNone(page.prev_cursor)
+        
+    def test_user_detail_page_size(self):
+        """Testing the user detail page only shows one page of feedback with pagination links."""
+        with app.test_client() as client:
+            data = {"username": "testUser1", "password": "password"}
+            client.post("/login", data=data, follow_redirects=True)
+            resp = client.get("/users/testUser1?per_page=10")
+            html = resp.get_data(as_text=True)
+            
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('<h5 class="card-subtitle">Feedback 9</h5>', html)
+            self.assertNotIn('<h5 class="card-subtitle">Feedback 10</h5>', html)
+            self.assertIn(f'?after={self.ids[9]}&per_page=10', html)
+            
+            resp = client.get(f"/users/testUser1?after={self.ids[19]}&per_page=1000")
+            html = resp.get_data(as_text=True)
+            
+            self.assertIn('<h5 class="card-subtitle">Feedback 24</h5>', html)
+            self.assertNotIn('<h5 class="card-subtitle">Feedback 19</h5>', html)
+            self.assertIn(f'?before={self.ids[20]}&per_page=100', html)
+
+class PasswordHashingTestCase(TestCase):
+    """Test password hashing on the hashing pool"""
+    
+    def setUp(self):
+        """Add a test user."""
+        
+        User.query.delete()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        db.session.add(test_user_1)
+        db.session.commit()
+        
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        
+    def tearDown(self):
+        """Clean up any fouled transaction and restore the bcrypt cost."""
+
+        db.session.rollback()
+        app.config['BCRYPT_LOG_ROUNDS'] = self.rounds
+            
+    def test_rehash_on_login(self):
+        """Testing logging in upgrades a hash made with an old bcrypt cost."""
+        app.config['BCRYPT_LOG_ROUNDS'] = self.rounds + 1
+        with app.test_client() as client:
+            data = {"username": "testUser1", "password": "password"}
+            resp = client.post("/login", data=data)
+            
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(hash_rounds(User.query.get("testUser1").password), self.rounds + 1)
+            self.assertTrue(User.authenticate("testUser1", "password"))
+            
+    def test_dummy_hash_made_at_startup(self):
+        """Testing the first unknown username doesn't pay for making the dummy hash."""
+        other = Flask(__name__)
+        other.config['BCRYPT_LOG_ROUNDS'] = 5
+        hasher = PasswordHasher(other)
+        
+        with other.app_context(), patch.object(hasher, "generate_password_hash") as generate:
+            self.assertEqual(hash_rounds(hasher.dummy_hash()), 5)
+            
+            generate.assert_not_called()
+            
+    def test_login_when_hashing_queue_full(self):
+        """Testing logins are turned away with a 503 while the hashing queue is full."""
+        with app.app_context():
+            _, slots = password_hasher._get_executor()
+            taken = 0
+            while slots.acquire(blocking=False):
+                taken += 1
+        try:
+            with app.test_client() as client:
+                data = {"username": "testUser1", "password": "password"}
+                resp = client.post("/login", data=data)
+                
+                self.assertEqual(resp.status_code, 503)
+                self.assertEqual(resp.headers["Retry-After"], "1")
+        finally:
+            for _ in range(taken):
+                slots.release()
+
+class AsyncFeedbackViewsTestCase(TestCase):
+    """Test the async feedback views used in ASYNC_MODE"""
+    
+    def setUp(self):
+        """Add a test user and feedback, and log them in."""
+        
+        User.query.delete()
+        fragment_cache.clear()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        db.session.add(test_user_1)
+        db.session.commit()
+        
+        feedback = Feedback(title='Test Feedback', content='This is only a test.', username=test_user_1.username)
+        db.session.add(feedback)
+        db.session.commit()
+        
+        self.feedback_id = feedback.id
+        self.client = async_app.test_client()
+        self.client.post("/login", data={"username": "testUser1", "password": "password"})
+        
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        
+    def test_async_views_installed(self):
+        """Testing ASYNC_MODE swaps in the async views under the same endpoints."""
+        self.assertTrue(inspect.iscoroutinefunction(async_app.view_functions["feedback.delete_feedback"]))
+        self.assertFalse(inspect.iscoroutinefunction(app.view_functions["feedback.delete_feedback"]))
+        
+    def test_add_update_delete(self):
+        """Testing adding, updating and deleting feedback through the async views."""
+        resp = self.client.post("/users/testUser1/feedback/add", data={"title": "Brand New", "content": "New."}, follow_redirects=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('<h5 class="card-subtitle">Brand New</h5>', resp.get_data(as_text=True))
+        
+        resp = self.client.post(f"/feedback/{self.feedback_id}/update", data={"title": "Edited", "content": "Edited."}, follow_redirects=True)
+        self.assertIn('<h5 class="card-subtitle">Edited</h5>', resp.get_data(as_text=True))
+        self.assertEqual(Feedback.query.get(self.feedback_id).title, "Edited")
+        
+        resp = self.client.post(f"/feedback/{self.feedback_id}/delete", follow_redirects=True)
+        self.assertNotIn('<h5 class="card-subtitle">Edited</h5>', resp.get_data(as_text=True))
+        self.assertIsNone(Feedback.query.get(self.feedback_id))
+        
+    def test_served_on_the_asgi_loop(self):
+        """Testing the ASGI entry point awaits the async views, with the logged in session."""
+        cookie = next(cookie for cookie in self.client.cookie_jar if cookie.name == async_app.session_cookie_name)
+        headers = [(b"cookie", f"{cookie.name}={cookie.value}".encode())]
+        
+        status, _ = asyncio.run(asgi_request(AsyncViewsAsgi(async_app), f"/feedback/{self.feedback_id}/delete", method="POST"))
+        self.assertEqual(status, 401)
+        
+        status, _ = asyncio.run(asgi_request(AsyncViewsAsgi(async_app), f"/feedback/{self.feedback_id}/delete", method="POST", headers=headers))
+        
+        self.assertEqual(status, 302)
+        self.assertIsNone(Feedback.query.get(self.feedback_id))
+        
+    def test_write_behind_submitted_off_the_loop(self):
+        """Testing the async add view hands new feedback to the write-behind queue from a thread, not the event loop."""
+        loops = []
+        def submit(title, content, username):
+            loops.append(asyncio._get_running_loop())
+        
+        async_app.config["FEEDBACK_WRITE_BEHIND"] = True
+        try:
+            with patch.object(write_behind, "submit", side_effect=submit):
+                resp = self.client.post("/users/testUser1/feedback/add", data={"title": "Buffered", "content": "Later."})
+        finally:
+            async_app.config["FEEDBACK_WRITE_BEHIND"] = False
+        
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(loops, [None])
+        
+    def test_missing_and_unauthorized(self):
+        """Testing the async views keep the not found and 401 pages."""
+        resp = self.client.post("/feedback/999999/delete")
+        self.assertIn('Page not found!', resp.get_data(as_text=True))
+        
+        self.client.post("/logout")
+        resp = self.client.post(f"/feedback/{self.feedback_id}/delete")
+        self.assertEqual(resp.status_code, 401)
+        self.assertIsNotNone(Feedback.query.get(self.feedback_id))
+
+class RelationshipLoadingTestCase(TestCase):
+    """Test how User/Feedback relationships are loaded"""
+    
+    def setUp(self):
+        """Add three users with feedback, and log one in."""
+        
+        User.query.delete()
+        fragment_cache.clear()
+        
+        for n, name in enumerate(["John", "Jane", "Jim"], start=1):
+            user = User.registerUser(username=f"testUser{n}", password="password", email=f"test{n}@email.com", first_name=name, last_name="Smith")
+            db.session.add(user)
+        db.session.commit()
+        
+        db.session.add_all([Feedback(title=f'Parsecs {n}', content='Twelve parsecs.', username=f"testUser{n % 3 + 1}") for n in range(30)])
+        db.session.commit()
+        
+        self.client = app.test_client()
+        self.client.post("/login", data={"username": "testUser1", "password": "password"})
+        
+    def tearDown(self):
+        """Clean up any fouled transaction and restore the loading strategy."""
+
+        db.session.rollback()
+        app.config['DB_RELATIONSHIP_LOADING'] = "selectin"
+        
+    def test_search_loading_strategies(self):
+        """Testing search results load their users without a query per row."""
+        expected = {"selectin": 2, "joined": 1, "select": 4}
+        for strategy, queries in expected.items():
+            app.config['DB_RELATIONSHIP_LOADING'] = strategy
+            resp = self.client.get("/feedback/search?q=parsecs")
+            html = resp.get_data(as_text=True)
+            
+            self.assertEqual(resp.headers["X-DB-Query-Count"], str(queries), strategy)
+            self.assertIn("Jane Smith", html)
+            self.assertIn("Jim Smith", html)
+            
+    def test_delete_user_leaves_feedback_to_purge(self):
+        """Testing deleting a user doesn't load or delete their feedback, which is hidden until it's purged."""
+        resp = self.client.post("/users/testUser1/delete")
+        
+        self.assertEqual(resp.headers["X-DB-Query-Count"], "2")
+        self.assertEqual(Feedback.query.filter_by(username="testUser1").count(), 0)
+        self.assertEqual(Feedback.query.count(), 20)
+        
+    def test_delete_feedback_skips_content(self):
+        """Testing the ownership check on delete doesn't fetch the feedback content."""
+        feedback_id = Feedback.query.filter_by(username="testUser1").first().id
+        statements = []
+        
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            resp = self.client.post(f"/feedback/{feedback_id}/delete")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        
+        self.assertEqual(resp.status_code, 302)
+        self.assertIsNone(Feedback.query.get(feedback_id))
+        self.assertFalse(any("content" in statement for statement in statements))
+
+class WriteBehindTestCase(TestCase):
+    """Test write-behind batching of new feedback"""
+    
+    def setUp(self):
+        """Add a test user, log them in and turn write-behind on with a private spill directory."""
+        
+        User.query.delete()
+        fragment_cache.clear()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        db.session.add(test_user_1)
+        db.session.commit()
+        
+        self.spill_dir = tempfile.mkdtemp()
+        self.config = {key: app.config[key] for key in app.config if key.startswith("FEEDBACK_WRITE_BEHIND")}
+        app.config.update(
+            FEEDBACK_WRITE_BEHIND=True,
+            FEEDBACK_WRITE_BEHIND_SPILL_DIR=self.spill_dir,
+            # long enough that only the tests (or a full batch) trigger a flush
+            FEEDBACK_WRITE_BEHIND_INTERVAL_MS=60000,
+        )
+        
+        self.client = app.test_client()
+        self.client.post("/login", data={"username": "testUser1", "password": "password"})
+        
+    def tearDown(self):
+        """Stop the queue and restore its settings."""
+
+        write_behind.shutdown()
+        db.session.rollback()
+        app.config.update(self.config)
+        shutil.rmtree(self.spill_dir)
+        
+    def spilled_rows(self):
+        rows = []
+        for name in os.listdir(self.spill_dir):
+            with open(os.path.join(self.spill_dir, name)) as f:
+                rows.extend(f.readlines())
+        return rows
+        
+    def test_acknowledged_then_flushed(self):
+        """Testing new feedback is acknowledged and spilled to disk before it's inserted."""
+        resp = self.client.post("/users/testUser1/feedback/add", data={"title": "Buffered", "content": "Later."})
+        
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(Feedback.query.count(), 0)
+        self.assertEqual(write_behind.pending(), 1)
+        self.assertEqual(len(self.spilled_rows()), 1)
+        
+        self.assertTrue(write_behind.flush())
+        
+        self.assertEqual(Feedback.query.one().title, "Buffered")
+        self.assertEqual(write_behind.pending(), 0)
+        self.assertEqual(self.spilled_rows(), [])
+        html = self.client.get("/users/testUser1").get_data(as_text=True)
+        self.assertIn('<h5 class="card-subtitle">Buffered</h5>', html)
+        
+    def test_flushes_full_batches(self):
+        """Testing the background thread flushes as soon as a batch fills up."""
+        app.config['FEEDBACK_WRITE_BEHIND_BATCH_SIZE'] = 3
+        for n in range(3):
+            self.client.post("/users/testUser1/feedback/add", data={"title": f"Burst {n}", "content": "Burst."})
+        
+        deadline = time.monotonic() + 5
+        while write_behind.pending() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        
+        self.assertEqual(Feedback.query.count(), 3)
+        
+    def test_back_pressure(self):
+        """Testing submissions get a 503 while the buffer is full."""
+        app.config['FEEDBACK_WRITE_BEHIND_MAX_PENDING'] = 2
+        for n in range(2):
+            self.client.post("/users/testUser1/feedback/add", data={"title": f"Burst {n}", "content": "Burst."})
+        resp = self.client.post("/users/testUser1/feedback/add", data={"title": "One Too Many", "content": "Burst."})
+        
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers["Retry-After"], "1")
+        
+    def test_spill_fsyncs_are_shared(self):
+        """Testing one fsync covers every row appended before it, so waiting submitters don't each pay for one."""
+        spill = SpillFile(os.path.join(self.spill_dir, "grouped.ndjson"))
+        first = spill.append({"title": "One"})
+        second = spill.append({"title": "Two"})
+        
+        with patch("os.fsync") as fsync:
+            spill.sync(second)
+            spill.sync(first)
+            
+            fsync.assert_called_once()
+        spill.discard()
+        spill.sync(second)
+        
+    def test_replays_spill_files(self):
+        """Testing rows spilled by a process that died are inserted by the next one."""
+        with open(os.path.join(self.spill_dir, "1-1-1.ndjson"), "w") as f:
+            f.write('{"title": "Spilled 1", "content": "Crash.", "username": "testUser1"}\n')
+            f.write('{"title": "Spilled 2", "content": "Crash.", "username": "testUser1"}\n')
+            f.write('{"title": "Cut sh')
+        
+        self.client.post("/users/testUser1/feedback/add", data={"title": "After", "content": "Restart."})
+        self.assertEqual(write_behind.pending(), 3)
+        write_behind.flush()
+        
+        self.assertEqual(sorted(f.title for f in Feedback.query), ["After", "Spilled 1", "Spilled 2"])
+        self.assertEqual(self.spilled_rows(), [])
+        
+    def test_replay_command(self):
+        """Testing spill files left by a process that died can be replayed on boot, before any new feedback."""
+        with open(os.path.join(self.spill_dir, "1-1-1.ndjson"), "w") as f:
+            f.write('{"title": "Spilled", "content": "Crash.", "username": "testUser1"}\n')
+        
+        result = app.test_cli_runner().invoke(args=["replay-feedback"])
+        
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Replayed 1 feedback rows.", result.output)
+        self.assertEqual([f.title for f in Feedback.query], ["Spilled"])
+        self.assertEqual(self.spilled_rows(), [])
+        self.assertEqual(write_behind.pending(), 0)
+        
+    def test_drops_rows_for_deleted_users(self):
+        """Testing feedback for a user deleted before the flush doesn't block the batch."""
+        write_behind.submit("Orphan", "Gone.", "nobody")
+        write_behind.submit("Kept", "Here.", "testUser1")
+        
+        self.assertTrue(write_behind.flush())
+        self.assertEqual([f.title for f in Feedback.query], ["Kept"])
+
+class RateLimitTestCase(TestCase):
+    """Test rate limiting of form submissions"""
+    
+    def setUp(self):
+        """Add a test user and turn rate limiting on."""
+        
+        User.query.delete()
+        rate_limiter.reset()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        db.session.add(test_user_1)
+        db.session.commit()
+        
+        self.limits = app.config['RATELIMITS']
+        app.config['RATELIMIT_ENABLED'] = True
+        app.config['RATELIMITS'] = {"users.login_user": "2/minute", "feedback.show_new_feedback_form": "1/minute"}
+        
+    def tearDown(self):
+        """Turn rate limiting back off."""
+
+        db.session.rollback()
+        app.config['RATELIMIT_ENABLED'] = False
+        app.config['RATELIMITS'] = self.limits
+        rate_limiter.reset()
+        
+    def test_login_limited_per_ip(self):
+        """Testing login attempts past the limit get a 429 before the form is looked at."""
+        with app.test_client() as client:
+            data = {"username": "testUser1", "password": "wrong"}
+            self.assertEqual(client.post("/login", data=data).status_code, 200)
+            self.assertEqual(client.post("/login", data=data).status_code, 200)
+            
+            with patch.object(User, "authenticate") as authenticate:
+                resp = client.post("/login", data=data)
+            self.assertEqual(resp.status_code, 429)
+            self.assertEqual(resp.headers["Retry-After"], "30")
+            authenticate.assert_not_called()
+            
+            # other addresses still get through, and GETs aren't counted
+            resp = client.post("/login", data=data, environ_base={"REMOTE_ADDR": "10.0.0.2"})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(client.get("/login").status_code, 200)
+            
+    def test_feedback_limited_per_user(self):
+        """Testing logged in users are limited however many addresses they use."""
+        with app.test_client() as client:
+            client.post("/login", data={"username": "testUser1", "password": "password"})
+            data = {"title": "Spam", "content": "Spam."}
+            resp = client.post("/users/testUser1/feedback/add", data=data, environ_base={"REMOTE_ADDR": "10.0.0.3"})
+            self.assertEqual(resp.status_code, 302)
+            
+            resp = client.post("/users/testUser1/feedback/add", data=data, environ_base={"REMOTE_ADDR": "10.0.0.4"})
+            self.assertEqual(resp.status_code, 429)
+            self.assertEqual(Feedback.query.count(), 1)
+
+class UserStatsTestCase(TestCase):
+    """Test the per-user feedback counters and the stats page"""
+    
+    def setUp(self):
+        """Add two users with feedback, and log one in."""
+        
+        User.query.delete()
+        fragment_cache.clear()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        test_user_2 = User.registerUser(username="testUser2", password="password", email="test2@email.com", first_name="Jane", last_name="Doe")
+        db.session.add_all([test_user_1, test_user_2])
+        db.session.commit()
+        
+        db.session.add_all([Feedback(title=f'Feedback {n}', content='Counted.', username="testUser2") for n in range(3)])
+        db.session.commit()
+        
+        self.client = app.test_client()
+        self.client.post("/login", data={"username": "testUser1", "password": "password"})
+        
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        
+    def stats(self, username):
+        db.session.expire_all()
+        return UserStats.query.get(username)
+        
+    def test_feedback_writes_update_counters(self):
+        """Testing adding, editing and deleting feedback keeps the counters current."""
+        self.assertEqual(self.stats("testUser1").feedback_count, 0)
+        self.assertIsNone(self.stats("testUser1").last_feedback_at)
+        self.assertEqual(self.stats("testUser2").feedback_count, 3)
+        
+        self.client.post("/users/testUser1/feedback/add", data={"title": "First", "content": "One."})
+        self.client.post("/users/testUser1/feedback/add", data={"title": "Second", "content": "Two."})
+        first, second = db.session.query(Feedback.id, Feedback.updated_at).filter_by(username="testUser1").order_by(Feedback.id).all()
+        self.assertEqual(self.stats("testUser1").feedback_count, 2)
+        self.assertEqual(self.stats("testUser1").last_feedback_at, second.updated_at)
+        
+        self.client.post(f"/feedback/{first.id}/update", data={"title": "First Edited", "content": "One."})
+        edited_at = db.session.query(Feedback.updated_at).filter_by(id=first.id).scalar()
+        self.assertEqual(self.stats("testUser1").last_feedback_at, edited_at)
+        
+        self.client.post(f"/feedback/{first.id}/delete")
+        self.assertEqual(self.stats("testUser1").feedback_count, 1)
+        self.assertEqual(self.stats("testUser1").last_feedback_at, second.updated_at)
+        
+    def test_bulk_paths_update_counters(self):
+        """Testing bulk imports and write-behind batches are counted too."""
+        body = '{"title": "Imported 1", "content": "Bulk."}\n{"title": "Imported 2", "content": "Bulk."}\n'
+        self.client.post("/users/testUser1/feedback/import", data=body, content_type="application/x-ndjson")
+        self.assertEqual(self.stats("testUser1").feedback_count, 2)
+        
+        spill_dir = tempfile.mkdtemp()
+        app.config['FEEDBACK_WRITE_BEHIND_SPILL_DIR'] = spill_dir
+        try:
+            write_behind.submit("Buffered", "Later.", "testUser1")
+            write_behind.flush()
+        finally:
+            write_behind.shutdown()
+            shutil.rmtree(spill_dir)
+        self.assertEqual(self.stats("testUser1").feedback_count, 3)
+        
+    def test_reconcile(self):
+        """Testing reconciliation repairs counters that drifted or went missing."""
+        UserStats.query.filter_by(username="testUser1").delete()
+        UserStats.query.filter_by(username="testUser2").update({"feedback_count": 42})
+        db.session.commit()
+        
+        result = app.test_cli_runner().invoke(args=["stats", "reconcile", "--batch-size", "1"])
+        
+        self.assertIn("Fixed 2 user_stats rows.", result.output)
+        self.assertEqual(self.stats("testUser1").feedback_count, 0)
+        self.assertEqual(self.stats("testUser2").feedback_count, 3)
+        self.assertEqual(self.stats("testUser2").last_feedback_at, db.session.query(db.func.max(Feedback.updated_at)).scalar())
+        
+    def test_stats_page(self):
+        """Testing the stats page reads only the counters table."""
+        resp = self.client.get("/stats")
+        html = resp.get_data(as_text=True)
+        
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("You've left 0 feedback.", html)
+        self.assertIn('<span class="badge bg-primary rounded-pill">3</span>', html)
+        self.assertLess(html.index('href="/users/testUser2"'), html.index('href="/users/testUser1"'))
+        self.assertEqual(resp.headers["X-DB-Query-Count"], "3")
+        
+    def test_stats_not_logged_in(self):
+        """Testing the stats page needs a logged in user."""
+        with app.test_client() as client:
+            resp = client.get("/stats")
+            
+            self.assertEqual(resp.status_code, 401)
+
+class StaticAssetsTestCase(TestCase):
+    """Test fingerprinted static files and the vendored asset fallbacks"""
+    
+    def setUp(self):
+        """Point the app at a scratch static folder holding one stylesheet."""
+        
+        self.static_folder = app.static_folder
+        app.static_folder = tempfile.mkdtemp()
+        # the URL rule stays /static whatever the folder is called
+        app.static_url_path = "/static"
+        with open(os.path.join(app.static_folder, "site.css"), "w") as f:
+            f.write("body { color: black; }")
+        self.rescan()
+        self.client = app.test_client()
+        
+    def tearDown(self):
+        """Restore the real static folder."""
+        
+        shutil.rmtree(app.static_folder)
+        app.static_folder = self.static_folder
+        self.rescan()
+        
+    def rescan(self):
+        app.extensions["static_digests"] = static_assets.scan(app.static_folder)
+        
+    def test_fingerprinted_url(self):
+        """Testing fingerprinted URLs are cached forever and stale fingerprints aren't served."""
+        with app.test_request_context():
+            url = static_assets.url("site.css")
+        
+        self.assertRegex(url, r"^/static/site\.[0-9a-f]{16}\.css$")
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("immutable", resp.headers["Cache-Control"])
+        self.assertIn("max-age=31536000", resp.headers["Cache-Control"])
+        resp.close()
+        
+        resp = self.client.get("/static/site.0123456789abcdef.css")
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn("Page not found!", resp.get_data(as_text=True))
+        
+        resp = self.client.get("/static/site.css")
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn("immutable", resp.headers.get("Cache-Control", ""))
+        resp.close()
+        
+    def test_vendored_assets(self):
+        """Testing pages use vendored Bootstrap when it's there and the CDN when it isn't."""
+        html = self.client.get("/login").get_data(as_text=True)
+        self.assertIn("https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css", html)
+        
+        os.makedirs(os.path.join(app.static_folder, "vendor/bootstrap-5.1.3/css"))
+        with open(os.path.join(app.static_folder, "vendor/bootstrap-5.1.3/css/bootstrap.min.css"), "w") as f:
+            f.write("/* bootstrap */")
+        self.rescan()
+        
+        html = self.client.get("/login").get_data(as_text=True)
+        self.assertRegex(html, r'href="/static/vendor/bootstrap-5\.1\.3/css/bootstrap\.min\.[0-9a-f]{16}\.css"')
+        self.assertNotIn("https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css", html)
+        
+    def test_vendor_fallback(self):
+        """Testing a vendor asset that hasn't been fetched falls back to its CDN URL and integrity hash."""
+        path = "vendor/bootstrap-5.1.3/js/bootstrap.bundle.min.js"
+        with app.test_request_context():
+            url, integrity = static_assets.vendor(path)
+        
+        self.assertEqual(url, "https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js")
+        self.assertEqual(integrity, "sha384-ka7Sk0Gln4gmtz2MlQnikT1wXgYsOg+OMhuP+IlRH9sENBO0LRn5q+8nbTov4+1p")
+        html = self.client.get("/login").get_data(as_text=True)
+        self.assertIn(f'src="{url}"', html)
+        self.assertIn(f'integrity="{integrity}"', html)
+        
+        os.makedirs(os.path.join(app.static_folder, "vendor/bootstrap-5.1.3/js"))
+        with open(os.path.join(app.static_folder, path), "w") as f:
+            f.write("/* bootstrap */")
+        self.rescan()
+        
+        with app.test_request_context():
+            url, integrity = static_assets.vendor(path)
+        
+        self.assertRegex(url, r"^/static/vendor/bootstrap-5\.1\.3/js/bootstrap\.bundle\.min\.[0-9a-f]{16}\.js$")
+        self.assertIsNone(integrity)
+        
+    def test_check_integrity(self):
+        """Testing downloads are checked against their subresource integrity hashes."""
+        self.assertTrue(check_integrity(b"alert(1)", "sha384-HT2E9NfWiuQ/w1PRai+hTyqW16NIoCGA/m8VQDUopfAtcz6YQjtsMmQd5uRbVDpW"))
+        self.assertFalse(check_integrity(b"alert(2)", "sha384-HT2E9NfWiuQ/w1PRai+hTyqW16NIoCGA/m8VQDUopfAtcz6YQjtsMmQd5uRbVDpW"))
+
+class PrerenderedPagesTestCase(TestCase):
+    """Test the pre-rendered 401 and 404 pages"""
+    
+    def setUp(self):
+        """Add a test user."""
+        
+        User.query.delete()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        db.session.add(test_user_1)
+        db.session.commit()
+        
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        
+    def test_pages_rendered_at_startup(self):
+        """Testing error pages come from the startup render without touching the templates."""
+        self.assertIn(("404.html", False), app.extensions["prerendered"])
+        with patch("assets.render_template") as render:
+            resp = app.test_client().get("/no/such/page")
+            
+            render.assert_not_called()
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn("Page not found!", resp.get_data(as_text=True))
+        
+    def test_navbar_and_flashes(self):
+        """Testing pre-rendered pages show the right navbar and this request's flashed messages, once."""
+        with app.test_client() as client:
+            html = client.get("/no/such/page").get_data(as_text=True)
+            self.assertIn("Log In", html)
+            
+            resp = client.post("/users/someoneElse/feedback/add", data={"title": "Nope", "content": "Nope."})
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 401)
+            self.assertIn("Please log in before adding new feedback.", html)
+            
+            client.post("/login", data={"username": "testUser1", "password": "password"})
+            client.get("/users/testUser1")
+            html = client.get("/no/such/page").get_data(as_text=True)
+            self.assertIn("Log Out", html)
+            self.assertNotIn("Please log in before adding new feedback.", html)
+            self.assertNotIn("<!-- flashes -->", html)
+            
+    def test_bytecode_cache(self):
+        """Testing compiled templates are kept on disk for the next worker."""
+        app.test_client().get("/login")
+        
+        self.assertTrue(os.listdir(app.config['JINJA_BYTECODE_CACHE_DIR']))
+
+class ReadReplicaTestCase(TestCase):
+    """Test sending read-only views to replicas, using separate SQLite files as stand-in replicas"""
+    
+    def setUp(self):
+        """Add a test user with feedback to the primary and to two replicas, each with its own feedback title."""
+        
+        User.query.delete()
+        fragment_cache.clear()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        db.session.add(test_user_1)
+        db.session.commit()
+        db.session.add(Feedback(title='Primary Feedback', content='From the primary.', username="testUser1"))
+        db.session.commit()
+        user_row = {column.name: getattr(test_user_1, column.name) for column in User.__table__.columns}
+        
+        self.tmpdir = tempfile.mkdtemp()
+        self.replica_uris = []
+        for name in ("replica1", "replica2"):
+            uri = f"sqlite:///{os.path.join(self.tmpdir, name)}.db"
+            engine = create_engine(uri)
+            db.metadata.create_all(engine)
+            with engine.begin() as connection:
+                connection.execute(User.__table__.insert().values(user_row))
+                connection.execute(Feedback.__table__.insert().values(title=f'{name} Feedback', content='From a replica.', username="testUser1"))
+            engine.dispose()
+            self.replica_uris.append(uri)
+        
+        self.use_replicas(self.replica_uris)
+        self.client = app.test_client()
+        self.client.post("/login", data={"username": "testUser1", "password": "password"})
+        
+    def tearDown(self):
+        """Go back to the primary alone."""
+
+        db.session.rollback()
+        self.use_replicas([])
+        shutil.rmtree(self.tmpdir)
+        
+    def use_replicas(self, uris):
+        app.config['SQLALCHEMY_REPLICA_URIS'] = uris
+        db_replicas.reset(app)
+        
+    def user_page(self):
+        fragment_cache.clear()
+        return self.client.get("/users/testUser1").get_data(as_text=True)
+        
+    def test_reads_round_robin_over_replicas(self):
+        """Testing read-only GETs take turns between the replicas."""
+        pages = [self.user_page() for _ in range(2)]
+        
+        self.assertTrue(any("replica1 Feedback" in html for html in pages))
+        self.assertTrue(any("replica2 Feedback" in html for html in pages))
+        self.assertFalse(any("Primary Feedback" in html for html in pages))
+        
+    def test_writes_and_own_reads_use_primary(self):
+        """Testing writes go to the primary and the writer then reads from the primary for a while."""
+        resp = self.client.post("/users/testUser1/feedback/add", data={"title": "Brand New", "content": "New."}, follow_redirects=True)
+        html = resp.get_data(as_text=True)
+        
+        self.assertIn('<h5 class="card-subtitle">Brand New</h5>', html)
+        self.assertIn("Primary Feedback", html)
+        self.assertEqual(Feedback.query.filter_by(title="Brand New").count(), 1)
+        
+        app.config['REPLICA_STICKY_SECONDS'] = 0
+        try:
+            self.assertIn("Feedback", self.user_page())
+            self.assertNotIn("Brand New", self.user_page())
+        finally:
+            app.config['REPLICA_STICKY_SECONDS'] = 5
+            
+    def test_async_writes_use_primary(self):
+        """Testing a write through the async views also keeps the writer reading from the primary."""
+        async_app.config['SQLALCHEMY_REPLICA_URIS'] = self.replica_uris
+        db_replicas.reset(async_app)
+        try:
+            client = async_app.test_client()
+            client.post("/login", data={"username": "testUser1", "password": "password"})
+            resp = client.post("/users/testUser1/feedback/add", data={"title": "Brand New", "content": "New."})
+            
+            self.assertEqual(resp.status_code, 302)
+            fragment_cache.clear()
+            self.assertIn("Brand New", client.get("/users/testUser1").get_data(as_text=True))
+        finally:
+            async_app.config['SQLALCHEMY_REPLICA_URIS'] = []
+            db_replicas.reset(async_app)
+            
+    def test_views_not_marked_read_only_use_primary(self):
+        """Testing only views marked read_only are routed to replicas."""
+        with patch.object(app.view_functions["users.show_secrets_page"], "read_only", False):
+            self.assertIn("Primary Feedback", self.user_page())
+            
+    def test_unhealthy_replicas_skipped(self):
+        """Testing a replica that can't be reached is skipped, falling back to the primary when none are left."""
+        self.use_replicas([f"sqlite:///{os.path.join(self.tmpdir, 'missing', 'replica.db')}", self.replica_uris[0]])
+        pages = [self.user_page() for _ in range(2)]
+        self.assertTrue(all("replica1 Feedback" in html for html in pages))
+        
+        self.use_replicas([f"sqlite:///{os.path.join(self.tmpdir, 'missing', 'replica.db')}"])
+        self.assertIn("Primary Feedback", self.user_page())
+
+class SoftDeleteTestCase(TestCase):
+    """Test tombstoning deleted users and feedback, and purging them later"""
+    
+    def setUp(self):
+        """Add two users with feedback, and log one in."""
+        
+        User.query.delete()
+        fragment_cache.clear()
+        unknown_usernames.clear()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        test_user_2 = User.registerUser(username="testUser2", password="password", email="test2@email.com", first_name="Jane", last_name="Doe")
+        db.session.add_all([test_user_1, test_user_2])
+        db.session.commit()
+        
+        db.session.add_all([Feedback(title=f'Tombstone {n}', content='Still here?', username=f"testUser{n % 2 + 1}") for n in range(6)])
+        db.session.commit()
+        self.feedback_id = db.session.query(Feedback.id).filter_by(username="testUser1").order_by(Feedback.id).first().id
+        
+        self.client = app.test_client()
+        self.client.post("/login", data={"username": "testUser1", "password": "password"})
+        
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        app.config['PURGE_IN_BACKGROUND'] = False
+        
+    def count(self, model, **filters):
+        return db.session.query(model).execution_options(include_deleted=True).filter_by(**filters).count()
+        
+    def test_delete_feedback_tombstones_it(self):
+        """Testing deleted feedback stays in the table but disappears from pages, the API and the counters."""
+        self.client.post(f"/feedback/{self.feedback_id}/delete")
+        
+        self.assertEqual(self.count(Feedback, id=self.feedback_id), 1)
+        self.assertIsNone(Feedback.query.get(self.feedback_id))
+        self.assertEqual(self.client.get(f"/api/v1/feedback/{self.feedback_id}").status_code, 404)
+        self.assertNotIn("Tombstone 0<", self.client.get("/feedback/search?q=tombstone").get_data(as_text=True))
+        self.assertEqual(db.session.query(UserStats.feedback_count).filter_by(username="testUser1").scalar(), 2)
+        
+        resp = self.client.post(f"/feedback/{self.feedback_id}/delete")
+        self.assertIn("Page not found!", resp.get_data(as_text=True))
+        
+    def test_delete_user_tombstones_them(self):
+        """Testing a deleted user and their feedback are hidden everywhere until purged."""
+        self.client.post("/users/testUser1/delete")
+        
+        self.assertEqual(self.count(User, username="testUser1"), 1)
+        self.assertEqual(self.count(Feedback, username="testUser1"), 3)
+        self.assertIsNone(User.query.get("testUser1"))
+        self.assertEqual(Feedback.query.count(), 3)
+        self.assertIsNone(UserStats.query.get("testUser1"))
+        
+        other = app.test_client()
+        other.post("/login", data={"username": "testUser2", "password": "password"})
+        self.assertEqual(other.get("/api/v1/users/testUser1").status_code, 404)
+        self.assertEqual(other.get("/feedback/search?q=tombstone").get_data(as_text=True).count("Jane Doe"), 3)
+        self.assertNotIn("John Smith", other.get("/feedback/search?q=tombstone").get_data(as_text=True))
+        self.assertNotIn('href="/users/testUser1"', other.get("/stats").get_data(as_text=True))
+        
+        resp = app.test_client().post("/login", data={"username": "testUser1", "password": "password"})
+        self.assertIn("Invalid username/password.", resp.get_data(as_text=True))
+        
+    def test_purge(self):
+        """Testing purging hard-deletes tombstoned rows in batches, and leaves the rest alone."""
+        feedback_id_2 = db.session.query(Feedback.id).filter_by(username="testUser2").first().id
+        self.client.post(f"/feedback/{self.feedback_id}/delete")
+        self.client.post("/users/testUser1/delete")
+        other = app.test_client()
+        other.post("/login", data={"username": "testUser2", "password": "password"})
+        other.post(f"/feedback/{feedback_id_2}/delete")
+        
+        self.assertEqual(purge_deleted(batch_size=1, older_than=60), (0, 0))
+        self.assertEqual(purge_deleted(batch_size=1), (4, 1))
+        
+        self.assertEqual(self.count(User, username="testUser1"), 0)
+        self.assertEqual(self.count(Feedback, username="testUser1"), 0)
+        self.assertEqual(self.count(Feedback, username="testUser2"), 2)
+        self.assertEqual(db.session.query(UserStats.feedback_count).filter_by(username="testUser2").scalar(), 2)
+        
+        result = app.test_cli_runner().invoke(args=["purge-deleted"])
+        self.assertIn("Purged 0 feedback rows and 0 users.", result.output)
+        
+    def test_background_purge(self):
+        """Testing deleting wakes the background purger."""
+        app.config['PURGE_IN_BACKGROUND'] = True
+        try:
+            self.client.post("/users/testUser1/delete")
+        finally:
+            purger.shutdown()
+        
+        self.assertEqual(self.count(User, username="testUser1"), 0)
+        self.assertEqual(self.count(Feedback, username="testUser1"), 0)
+        
+    def test_username_free_after_purge(self):
+        """Testing a deleted user's username can be registered again once they're purged."""
+        self.client.post("/users/testUser1/delete")
+        purge_deleted()
+        
+        resp = app.test_client().post("/register", data={"username": "testUser1", "password": "password", "email": "test@email.com", "first_name": "Johnny", "last_name": "Smith"}, follow_redirects=True)
+        
+        self.assertIn("Your account has successfully been created!", resp.get_data(as_text=True))
+        self.assertEqual(Feedback.query.filter_by(username="testUser1").count(), 0)
+
+class ProfilingTestCase(TestCase):
+    """Test sampled request profiling"""
+    
+    def setUp(self):
+        """Add a test user, and profile every request into a scratch directory."""
+        
+        User.query.delete()
+        fragment_cache.clear()
+        request_profiler.reset()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        db.session.add(test_user_1)
+        db.session.commit()
+        
+        self.tmpdir = tempfile.mkdtemp()
+        app.config['PROFILING_DIR'] = self.tmpdir
+        app.config['PROFILING_SAMPLE_RATE'] = 1
+        # files are only written by the tests' own flush() calls
+        app.config['PROFILING_FLUSH_INTERVAL'] = 0
+        self.client = app.test_client()
+        
+    def tearDown(self):
+        """Turn profiling back off."""
+
+        db.session.rollback()
+        app.config['PROFILING_SAMPLE_RATE'] = 0
+        app.config['PROFILING_FLUSH_INTERVAL'] = 10
+        request_profiler.reset()
+        shutil.rmtree(self.tmpdir)
+        
+    def test_phases(self):
+        """Testing a login's time is split between hashing, forms, the database and templates."""
+        self.client.post("/login", data={"username": "testUser1", "password": "password"})
+        self.client.post("/login", data={"username": "testUser1", "password": "wrong"})
+        summary = self.client.get("/metrics/profile").json["users.login_user"]
+        
+        self.assertEqual(summary["sampled_requests"], 2)
+        for phase in ("hashing", "forms", "db", "template", "other"):
+            self.assertGreater(summary["phases_avg_ms"][phase], 0, phase)
+        self.assertAlmostEqual(sum(summary["phases_avg_ms"].values()), summary["avg_ms"], places=3)
+        self.assertGreaterEqual(summary["max_ms"], summary["avg_ms"])
+        
+    def test_collapsed_stacks(self):
+        """Testing sampled stacks are written out as collapsed-stack files and served per endpoint."""
+        def slow_authenticate(username, password):
+            time.sleep(0.05)
+            return False
+        
+        with patch.object(User, "authenticate", side_effect=slow_authenticate):
+            self.client.post("/login", data={"username": "testUser1", "password": "password"})
+        
+        folded = self.client.get("/metrics/profile/users.login_user.folded").get_data(as_text=True)
+        self.assertIn("slow_authenticate (test_app.py);[other]", folded)
+        for line in folded.splitlines():
+            stack, count = line.rsplit(" ", 1)
+            self.assertTrue(stack.startswith("users.login_user;"))
+            self.assertGreater(int(count), 0)
+        
+        # written by the flusher, not by the request
+        self.assertEqual(os.listdir(self.tmpdir), [])
+        request_profiler.flush()
+        with open(os.path.join(self.tmpdir, f"users.login_user.{os.getpid()}.folded")) as f:
+            self.assertEqual(f.read(), folded)
+        
+    def test_background_flush(self):
+        """Testing the flusher thread writes the stacks of endpoints sampled since its last pass."""
+        app.config['PROFILING_FLUSH_INTERVAL'] = 0.01
+        try:
+            self.client.get("/login")
+            path = os.path.join(self.tmpdir, f"users.login_user.{os.getpid()}.folded")
+            for _ in range(200):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.01)
+            
+            self.assertTrue(os.path.exists(path))
+        finally:
+            # stops the flusher on its next pass
+            app.config['PROFILING_FLUSH_INTERVAL'] = 0
+            time.sleep(0.05)
+        
+    def test_unsampled_requests(self):
+        """Testing requests outside the sample aren't profiled."""
+        app.config['PROFILING_SAMPLE_RATE'] = 0
+        self.client.get("/login")
+        
+        self.assertEqual(self.client.get("/metrics/profile").json, {})
+        self.assertIn("Page not found!", self.client.get("/metrics/profile/users.login_user.folded").get_data(as_text=True))
+        self.assertEqual(os.listdir(self.tmpdir), [])
+        
+    def test_hidden_from_other_clients(self):
+        """Testing clients outside METRICS_ALLOWED_IPS can't read the summary or the stacks."""
+        outside = {"REMOTE_ADDR": "203.0.113.7"}
+        self.client.get("/login")
+        
+        resp = self.client.get("/metrics/profile", environ_base=outside)
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn("Page not found!", resp.get_data(as_text=True))
+        resp = self.client.get("/metrics/profile/users.login_user.folded", environ_base=outside)
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn("Page not found!", resp.get_data(as_text=True))
+        self.assertIn("users.login_user", self.client.get("/metrics/profile").json)
+        
+    def test_off_by_default(self):
+        """Testing an app that doesn't ask for them has no profiling routes."""
+        other = Flask(__name__)
+        RequestProfiler(other)
+        
+        self.assertNotIn("/metrics/profile", [rule.rule for rule in other.url_map.iter_rules()])
+
+class FeedbackRevisionTestCase(TestCase):
+    """Test feedback revision history"""
+    
+    def setUp(self):
+        """Add a test user with feedback, and log them in."""
+        
+        User.query.delete()
+        fragment_cache.clear()
+        
+        test_user_1 = User.registerUser(username="testUser1", password="password", email="test@email.com", first_name="John", last_name="Smith")
+        db.session.add(test_user_1)
+        db.session.commit()
+        
+        feedback = Feedback(title='Version 0', content='The original text of this feedback.', username="testUser1")
+        db.session.add(feedback)
+        db.session.commit()
+        self.feedback_id = feedback.id
+        
+        self.client = app.test_client()
+        self.client.post("/login", data={"username": "testUser1", "password": "password"})
+        
+    def tearDown(self):
+        """Clean up any fouled transaction and restore the snapshot interval."""
+
+        db.session.rollback()
+        app.config['FEEDBACK_REVISION_SNAPSHOT_EVERY'] = 10
+        
+    def edit(self, n):
+        self.client.post(f"/feedback/{self.feedback_id}/update", data={"title": f"Version {n}", "content": f"The text of this feedback, edit {n}."})
+        
+    def revisions(self):
+        return db.session.query(FeedbackRevision.number, FeedbackRevision.is_snapshot).filter_by(feedback_id=self.feedback_id).order_by(FeedbackRevision.number).all()
+        
+    def test_edits_recorded(self):
+        """Testing each edit adds a revision, with the original kept as revision 1."""
+        html = self.client.get(f"/feedback/{self.feedback_id}/history").get_data(as_text=True)
+        self.assertIn("This feedback hasn't been edited.", html)
+        
+        for n in range(1, 4):
+            self.edit(n)
+        
+        self.assertEqual([number for number, _ in self.revisions()], [1, 2, 3, 4])
+        html = self.client.get(f"/feedback/{self.feedback_id}/history").get_data(as_text=True)
+        self.assertLess(html.index("Revision 4"), html.index("Revision 1"))
+        self.assertIn("current", html)
+        
+        html = self.client.get(f"/feedback/{self.feedback_id}/revisions/1").get_data(as_text=True)
+        self.assertIn("Version 0", html)
+        self.assertIn("The original text of this feedback.", html)
+        self.assertNotIn(">Older<", html)
+        html = self.client.get(f"/feedback/{self.feedback_id}/revisions/4").get_data(as_text=True)
+        self.assertIn("The text of this feedback, edit 3.", html)
+        self.assertIn(">Older<", html)
+        self.assertNotIn(">Newer<", html)
+        self.assertEqual(FeedbackRevision.query.get((self.feedback_id, 4)).created_at, Feedback.query.get(self.feedback_id).updated_at)
+        
+    def test_snapshots(self):
+        """Testing a full snapshot is stored periodically and any revision is rebuilt with one query."""
+        app.config['FEEDBACK_REVISION_SNAPSHOT_EVERY'] = 3
+        for n in range(1, 8):
+            self.edit(n)
+        
+        self.assertEqual([is_snapshot for _, is_snapshot in self.revisions()], [True, False, False, True, False, False, True, False])
+        for number in range(2, 9):
+            with app.test_request_context():
+                db.session.expire_all()
+                statements = []
+                def record(conn, cursor, statement, parameters, context, executemany):
+                    statements.append(statement)
+                event.listen(db.engine, "before_cursor_execute", record)
+                try:
+                    revision, content = FeedbackRevision.get_with_content(self.feedback_id, number)
+                finally:
+                    event.remove(db.engine, "before_cursor_execute", record)
+            self.assertEqual(content, f"The text of this feedback, edit {number - 1}.")
+            self.assertEqual(revision.title, f"Version {number - 1}")
+            self.assertEqual(len(statements), 1)
+        self.assertIsNone(FeedbackRevision.get_with_content(self.feedback_id, 9))
+        
+    def test_only_title_or_content_edits_recorded(self):
+        """Testing a write that doesn't touch the title or content, such as a delete, adds no revision."""
+        self.edit(1)
+        self.client.post(f"/feedback/{self.feedback_id}/delete")
+        
+        self.assertEqual(len(self.revisions()), 2)
+        html = self.client.get(f"/feedback/{self.feedback_id}/history").get_data(as_text=True)
+        self.assertIn("Page not found!", html)
+        
+    def test_async_edits_recorded(self):
+        """Testing edits through the async views are recorded too."""
+        client = async_app.test_client()
+        client.post("/login", data={"username": "testUser1", "password": "password"})
+        client.post(f"/feedback/{self.feedback_id}/update", data={"title": "Async", "content": "Edited asynchronously."})
+        
+        self.assertEqual(FeedbackRevision.get_with_content(self.feedback_id, 2)[1], "Edited asynchronously.")
+        
+    def test_unloaded_original_recorded(self):
+        """Testing an edit that never loaded the old title or content still keeps it as revision 1."""
+        with app.app_context():
+            feedback = Feedback.query.options(load_only(Feedback.id, Feedback.username)).get(self.feedback_id)
+            feedback.title = "Blind edit"
+            feedback.content = "Written without reading the original."
+            db.session.commit()
+        
+        revision, content = FeedbackRevision.get_with_content(self.feedback_id, 1)
+        self.assertEqual((revision.title, content), ("Version 0", "The original text of this feedback."))
+        self.assertEqual(FeedbackRevision.get_with_content(self.feedback_id, 2)[1], "Written without reading the original.")
+        
+    def test_edits_take_turns(self):
+        """Testing the feedback row is locked before the next revision number is read."""
+        statements = []
+        def record(conn, clauseelement, multiparams, params, execution_options):
+            statements.append(str(clauseelement.compile(dialect=postgresql.dialect())))
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, "before_execute", record)
+        try:
+            self.edit(1)
+        finally:
+            event.remove(engine, "before_execute", record)
+        
+        lock = next(n for n, statement in enumerate(statements) if "FROM feedback" in statement and statement.endswith("FOR UPDATE"))
+        number = next(n for n, statement in enumerate(statements) if "max(feedback_revisions.number)" in statement)
+        self.assertLess(lock, number)
+        
+    def test_history_not_logged_in(self):
+        """Testing the history needs a logged in user."""
+        with app.test_client() as client:
+            resp = client.get(f"/feedback/{self.feedback_id}/history")
+            
+            self.assertEqual(resp.status_code, 401)
+
+class ShardingTestCase(TestCase):
+    """Test sharding users and their feedback by username, using separate SQLite files as the shards"""
+    
+    def setUp(self):
+        """Set up two shards and add a user with feedback to each, logging the first one in."""
+        
+        User.query.delete()
+        db.session.commit()
+        fragment_cache.clear()
+        unknown_usernames.clear()
+        
+        self.tmpdir = tempfile.mkdtemp()
+        self.use_shards([f"sqlite:///{os.path.join(self.tmpdir, name)}.db" for name in ("shard0", "shard1")])
+        with app.app_context():
+            shard_router.create_all()
+            # the first two usernames that hash onto different shards
+            candidates = [f"shardUser{n}" for n in range(20)]
+            self.user1 = next(name for name in candidates if shard_router.shard_for_username(name) == 0)
+            self.user2 = next(name for name in candidates if shard_router.shard_for_username(name) == 1)
+            for n, username in enumerate((self.user1, self.user2)):
+                db.session.add(User.registerUser(username=username, password="password", email=f"{username}@email.com", first_name="Shard", last_name=f"Owner{n}"))
+            db.session.commit()
+            for username in (self.user1, self.user2):
+                db.session.add(Feedback(title=f"Sharded feedback of {username}", content="Where does this live?", username=username))
+            db.session.commit()
+            with shard_router.using(username=self.user1):
+                self.feedback_id = db.session.query(Feedback.id).filter_by(username=self.user1).scalar()
+        
+        self.client = app.test_client()
+        self.client.post("/login", data={"username": self.user1, "password": "password"})
+        
+    def tearDown(self):
+        """Go back to the main database alone."""
+        
+        db.session.rollback()
+        with app.app_context():
+            ShardBucket.query.delete()
+            UserEmail.query.delete()
+            MovedFeedback.query.delete()
+            db.session.commit()
+        self.use_shards([], buckets=1024)
+        shutil.rmtree(self.tmpdir)
+        
+    def use_shards(self, uris, buckets=8):
+        app.config.update(SQLALCHEMY_SHARD_URIS=uris, SHARD_BUCKETS=buckets, SHARD_MAP_TTL=0)
+        shard_router.reset(app)
+        
+    def rows(self, shard, table):
+        with app.app_context():
+            with shard_router.engines()[shard].connect() as connection:
+                return connection.execute(table.select()).mappings().all()
+        
+    def test_rows_land_on_their_users_shard(self):
+        """Testing users, their stats and feedback live only on their own shard, with feedback ids ending in their bucket."""
+        for shard, username in enumerate((self.user1, self.user2)):
+            self.assertEqual([(row["username"], row["shard_bucket"]) for row in self.rows(shard, User.__table__)], [(username, shard_router.bucket_for_username(username))])
+            self.assertEqual([row["username"] for row in self.rows(shard, UserStats.__table__)], [username])
+            feedback = self.rows(shard, Feedback.__table__)
+            self.assertEqual([row["username"] for row in feedback], [username])
+            with app.app_context():
+                self.assertEqual(feedback[0]["id"] % 8, shard_router.bucket_for_username(username))
+        
+        with app.app_context(), db.engine.connect() as connection:
+            self.assertEqual(connection.execute(User.__table__.select()).all(), [])
+        
+    def test_user_page_touches_one_shard(self):
+        """Testing a user's page and their feedback's routes only query that user's shard."""
+        statements = {0: 0, 1: 0}
+        def counter(shard):
+            def count(conn, cursor, statement, parameters, context, executemany):
+                statements[shard] += 1
+            return count
+        with app.app_context():
+            engines = shard_router.engines()
+        listeners = [(engine, counter(shard)) for shard, engine in enumerate(engines)]
+        for engine, listener in listeners:
+            event.listen(engine, "before_cursor_execute", listener)
+        try:
+            html = self.client.get(f"/users/{self.user1}").get_data(as_text=True)
+            resp = self.client.post(f"/feedback/{self.feedback_id}/update", data={"title": "Edited on its shard", "content": "Still here."})
+        finally:
+            for engine, listener in listeners:
+                event.remove(engine, "before_cursor_execute", listener)
+        
+        self.assertIn(f"Sharded feedback of {self.user1}", html)
+        self.assertEqual(resp.status_code, 302)
+        self.assertGreater(statements[0], 0)
+        self.assertEqual(statements[1], 0)
+        self.assertEqual([row["title"] for row in self.rows(0, Feedback.__table__)], ["Edited on its shard"])
+        self.assertEqual(len(self.rows(0, FeedbackRevision.__table__)), 2)
+        
+    def test_add_and_delete_feedback(self):
+        """Testing feedback added and deleted through the site stays on its user's shard."""
+        self.client.post(f"/users/{self.user1}/feedback/add", data={"title": "Another one", "content": "Also on shard 0."})
+        self.client.post(f"/feedback/{self.feedback_id}/delete")
+        
+        html = self.client.get(f"/users/{self.user1}").get_data(as_text=True)
+        self.assertIn("Another one", html)
+        self.assertNotIn(f"Sharded feedback of {self.user1}", html)
+        self.assertEqual(len(self.rows(0, Feedback.__table__)), 2)
+        self.assertEqual(self.rows(1, Feedback.__table__)[0]["username"], self.user2)
+        self.assertEqual(self.rows(0, UserStats.__table__)[0]["feedback_count"], 1)
+        
+    def test_search_and_stats_span_shards(self):
+        """Testing search and the leaderboard gather every shard's rows, and a user's search stays on their shard."""
+        html = self.client.get("/feedback/search?q=sharded").get_data(as_text=True)
+        self.assertIn(f'href="/users/{self.user1}"', html)
+        self.assertIn(f'href="/users/{self.user2}"', html)
+        
+        html = self.client.get(f"/feedback/search?q=sharded&username={self.user2}").get_data(as_text=True)
+        self.assertIn(f'href="/users/{self.user2}"', html)
+        self.assertNotIn(f'href="/users/{self.user1}"', html)
+        
+        html = self.client.get("/stats").get_data(as_text=True)
+        self.assertIn(f'href="/users/{self.user1}"', html)
+        self.assertIn(f'href="/users/{self.user2}"', html)
+        
+    def test_search_across_mixed_databases(self):
+        """Testing search merges ranked rows from a Postgres shard with unranked ones from another database."""
+        def ranked(*args):
+            # what a Postgres shard returns: ranked (rank, id) keys
+            return [((0.5, feedback.id), feedback, snippet) for _, feedback, snippet in search._search_like(*args)]
+        
+        with patch("search._search_backend", side_effect=[search._search_like, ranked]):
+            html = self.client.get("/feedback/search?q=sharded").get_data(as_text=True)
+        
+        self.assertIn(f'href="/users/{self.user1}"', html)
+        self.assertLess(html.index(f'href="/users/{self.user2}"'), html.index(f'href="/users/{self.user1}"'))
+        
+    def test_unrouted_query_refused(self):
+        """Testing a query on a sharded table has to say which shard it's for, unless it's reloading an object."""
+        with app.test_request_context("/stats"):
+            with self.assertRaises(ShardNotChosen):
+                User.query.all()
+            with shard_router.using(shard=1):
+                users = User.query.all()
+            self.assertEqual([user.username for user in users], [self.user2])
+            
+            # reloading an object goes back to its own shard
+            db.session.expire(users[0])
+            self.assertEqual(users[0].last_name, "Owner1")
+        
+    def register(self, username, email):
+        return app.test_client().post("/register", data={"username": username, "password": "password", "email": email, "first_name": "New", "last_name": "User"})
+        
+    def test_emails_unique_across_shards(self):
+        """Testing an email already used on one shard can't be registered again on another."""
+        with app.app_context():
+            username = next(f"newUser{n}" for n in range(50) if shard_router.shard_for_username(f"newUser{n}") == 1)
+        
+        html = self.register(username, f"{self.user1}@email.com").get_data(as_text=True)
+        self.assertIn("The username is already taken.", html)
+        self.assertEqual([row["username"] for row in self.rows(1, User.__table__)], [self.user2])
+        
+        self.assertEqual(self.register(username, "fresh@email.com").status_code, 302)
+        with app.app_context():
+            self.assertEqual(UserEmail.query.get("fresh@email.com").username, username)
+            self.assertEqual(UserEmail.query.get(f"{self.user1}@email.com").username, self.user1)
+        
+    def test_stale_email_claim_taken_over(self):
+        """Testing a claim left by a registration that never reached its shard doesn't block the email for good."""
+        with app.app_context():
+            db.session.add(UserEmail(email="orphan@email.com", username="neverSaved", claimed_at=datetime(2020, 1, 1)))
+            db.session.add(UserEmail(email="pending@email.com", username="stillSaving", claimed_at=datetime.utcnow()))
+            db.session.commit()
+        
+        self.assertEqual(self.register("takesOver", "orphan@email.com").status_code, 302)
+        self.assertIn("The username is already taken.", self.register("waitsTurn", "pending@email.com").get_data(as_text=True))
+        with app.app_context():
+            self.assertEqual(UserEmail.query.get("orphan@email.com").username, "takesOver")
+        
+    def test_migrate_main_database(self):
+        """Testing users from before sharding are moved onto their shards, with links to their old feedback redirected."""
+        uris = app.config["SQLALCHEMY_SHARD_URIS"]
+        with app.app_context():
+            legacy = next(f"legacyUser{n}" for n in range(50) if shard_router.shard_for_username(f"legacyUser{n}") == 1)
+        self.use_shards([])
+        with app.app_context():
+            # the second one's username has since been taken on the shards
+            for username in (legacy, self.user1):
+                db.session.add(User.registerUser(username=username, password="password", email=f"old.{username}@email.com", first_name="Legacy", last_name="User"))
+            db.session.commit()
+            feedback = Feedback(title="From before sharding", content="Written to the main database.", username=legacy)
+            db.session.add(feedback)
+            db.session.commit()
+            feedback.content = "Edited in the main database."
+            db.session.commit()
+            old_id = feedback.id
+        self.use_shards(uris)
+        
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=["shards", "migrate", "--batch-size", "1"])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn(f"their username or email is taken on the shards: {self.user1}", result.output)
+        self.assertEqual(runner.invoke(args=["shards", "migrate"]).exit_code, 1)
+        
+        self.assertEqual({row["username"] for row in self.rows(1, User.__table__)}, {legacy, self.user2})
+        moved = [row for row in self.rows(1, Feedback.__table__) if row["username"] == legacy]
+        self.assertEqual(len(moved), 1)
+        new_id = moved[0]["id"]
+        with app.app_context():
+            self.assertEqual(new_id % 8, shard_router.bucket_for_username(legacy))
+            self.assertEqual(MovedFeedback.query.get(old_id).new_id, new_id)
+            self.assertEqual(UserEmail.query.get(f"old.{legacy}@email.com").username, legacy)
+            with db.engine.connect() as connection:
+                self.assertEqual(connection.execute(User.__table__.select()).mappings().one()["username"], self.user1)
+                self.assertEqual(connection.execute(Feedback.__table__.select()).all(), [])
+        
+        client = app.test_client()
+        client.post("/login", data={"username": legacy, "password": "password"})
+        resp = client.get(f"/feedback/{old_id}/revisions/1?view=full")
+        self.assertEqual(resp.status_code, 308)
+        self.assertTrue(resp.location.endswith(f"/feedback/{new_id}/revisions/1?view=full"))
+        self.assertIn("Written to the main database.", client.get(resp.location).get_data(as_text=True))
+        self.assertIn("Edited in the main database.", client.get(f"/feedback/{new_id}/revisions/2").get_data(as_text=True))
+        self.assertEqual(client.get(f"/api/v1/feedback/{old_id}", follow_redirects=True).json["title"], "From before sharding")
+        
+    def test_writes_refused_while_moving(self):
+        """Testing a bucket being moved can still be read, but not written."""
+        with app.app_context():
+            ShardBucket.query.filter_by(bucket=shard_router.bucket_for_username(self.user1)).update({"moving_to": 1})
+            db.session.commit()
+        
+        resp = self.client.post(f"/users/{self.user1}/feedback/add", data={"title": "Not now", "content": "Moving."})
+        self.assertEqual(resp.status_code, 503)
+        self.assertIn("Retry-After", resp.headers)
+        self.assertIn(f"Sharded feedback of {self.user1}", self.client.get(f"/users/{self.user1}").get_data(as_text=True))
+        
+    def test_move_bucket(self):
+        """Testing moving a bucket copies its users with everything of theirs and then removes them from the old shard."""
+        self.client.post(f"/feedback/{self.feedback_id}/update", data={"title": "Edited before moving", "content": "Moving soon."})
+        with app.app_context():
+            bucket = shard_router.bucket_for_username(self.user1)
+            # on the same shard, in another bucket
+            neighbour = next(f"newUser{n}" for n in range(50) if shard_router.shard_for_username(f"newUser{n}") == 0 and shard_router.bucket_for_username(f"newUser{n}") != bucket)
+        self.register(neighbour, "neighbour@email.com")
+        with app.app_context():
+            self.assertEqual(move_buckets([bucket], 1, batch_size=1), 1)
+            self.assertEqual(shard_router.shard_for_username(self.user1), 1)
+        
+        self.assertEqual([row["username"] for row in self.rows(0, User.__table__)], [neighbour])
+        self.assertEqual(self.rows(0, Feedback.__table__), [])
+        self.assertEqual(self.rows(0, FeedbackRevision.__table__), [])
+        self.assertEqual({row["username"] for row in self.rows(1, User.__table__)}, {self.user1, self.user2})
+        self.assertEqual(len(self.rows(1, FeedbackRevision.__table__)), 2)
+        self.assertEqual(len(self.rows(1, UserStats.__table__)), 2)
+        
+        client = app.test_client()
+        client.post("/login", data={"username": self.user1, "password": "password"})
+        self.assertIn("Edited before moving", client.get(f"/users/{self.user1}").get_data(as_text=True))
+        self.assertIn("Moving soon.", client.get(f"/feedback/{self.feedback_id}/revisions/2").get_data(as_text=True))
+        
+    def test_rebalance_onto_new_shard(self):
+        """Testing adding a shard and rebalancing moves a fair share of buckets onto it and loses no one."""
+        self.use_shards(app.config["SQLALCHEMY_SHARD_URIS"] + [f"sqlite:///{os.path.join(self.tmpdir, 'shard2')}.db"])
+        runner = app.test_cli_runner()
+        runner.invoke(args=["shards", "init"])
+        
+        result = runner.invoke(args=["shards", "rebalance", "--dry-run"])
+        self.assertIn("buckets from shard 0 to shard 2", result.output)
+        result = runner.invoke(args=["shards", "rebalance"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        
+        result = runner.invoke(args=["shards", "status"])
+        self.assertIn("shard 0: 3 buckets", result.output)
+        self.assertIn("shard 1: 3 buckets", result.output)
+        self.assertIn("shard 2: 2 buckets", result.output)
+        with app.app_context():
+            for username in (self.user1, self.user2):
+                with shard_router.using(username=username):
+                    self.assertEqual(Feedback.query.filter_by(username=username).count(), 1)
+        
+    def test_purge_and_reconcile_every_shard(self):
+        """Testing purging and reconciling visit each shard."""
+        other = app.test_client()
+        other.post("/login", data={"username": self.user2, "password": "password"})
+        other.post(f"/users/{self.user2}/delete")
+        with app.app_context():
+            self.assertEqual(purge_deleted(), (1, 1))
+            self.assertEqual(self.rows(1, User.__table__), [])
+            self.assertEqual([claim.username for claim in UserEmail.query.all()], [self.user1])
+            
+            with shard_router.engines()[0].begin() as connection:
+                connection.execute(UserStats.__table__.update().values(feedback_count=5))
+            result = app.test_cli_runner().invoke(args=["stats", "reconcile"])
+            self.assertIn("Fixed 1 user_stats rows.", result.output)
+
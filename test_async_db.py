@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+from unittest import TestCase
+
+from flask import Flask, abort, request
+
+from async_db import AsyncDatabase, AsyncViewsAsgi, ThreadedWsgiToAsgi
+
+DELAY = 0.3
+REQUESTS = 4
+
+async def asgi_request(asgi_app, path, method="GET", body=b"", headers=()):
+    """Send a request to asgi_app, returning (status, response body)."""
+    scope = {"type": "http", "method": method, "path": path, "root_path": "", "query_string": b"",
+             "http_version": "1.1", "headers": list(headers), "client": ("127.0.0.1", 1234)}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body}
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi_app(scope, receive, send)
+    return sent[0]["status"], b"".join(message.get("body", b"") for message in sent)
+
+async def asgi_get(asgi_app, path):
+    """GET path from asgi_app, returning the response body."""
+    return (await asgi_request(asgi_app, path))[1]
+
+class ThreadedWsgiToAsgiTestCase(TestCase):
+    """Test serving the app to ASGI servers"""
+
+    def test_slow_requests_overlap(self):
+        """Testing slow requests are served side by side rather than one after another."""
+        app = Flask(__name__)
+
+        @app.route("/slow")
+        def slow():
+            time.sleep(DELAY)
+            return "done"
+
+        async def serve_all():
+            return await asyncio.gather(*(asgi_get(ThreadedWsgiToAsgi(app), "/slow") for _ in range(REQUESTS)))
+
+        start = time.perf_counter()
+        bodies = asyncio.run(serve_all())
+
+        self.assertEqual(bodies, [b"done"] * REQUESTS)
+        self.assertLess(time.perf_counter() - start, DELAY * REQUESTS / 2)
+
+class AsyncViewsAsgiTestCase(TestCase):
+    """Test awaiting async views on the ASGI server's event loop"""
+
+    def setUp(self):
+        """An app with a slow async view and a sync one, noting the thread each ran on."""
+        self.app = Flask(__name__)
+        self.threads = []
+
+        @self.app.route("/slow")
+        async def slow():
+            self.threads.append(threading.get_ident())
+            await asyncio.sleep(DELAY)
+            return request.path
+
+        @self.app.route("/missing")
+        async def missing():
+            abort(404)
+
+        @self.app.route("/sync")
+        def sync():
+            self.threads.append(threading.get_ident())
+            return "sync"
+
+    def test_async_views_on_the_loop(self):
+        """Testing async views are awaited on the server's loop side by side, without a thread each."""
+        async def serve_all():
+            return await asyncio.gather(*(asgi_get(AsyncViewsAsgi(self.app), "/slow") for _ in range(REQUESTS)))
+
+        start = time.perf_counter()
+        bodies = asyncio.run(serve_all())
+
+        self.assertEqual(bodies, [b"/slow"] * REQUESTS)
+        self.assertLess(time.perf_counter() - start, DELAY * REQUESTS / 2)
+        self.assertEqual(set(self.threads), {threading.get_ident()})
+
+    def test_sync_views_on_the_pool(self):
+        """Testing sync views still run on a pool thread."""
+        self.assertEqual(asyncio.run(asgi_get(AsyncViewsAsgi(self.app), "/sync")), b"sync")
+        self.assertNotEqual(self.threads, [threading.get_ident()])
+
+    def test_errors(self):
+        """Testing errors raised by async views and unknown URLs get their usual responses."""
+        status, _ = asyncio.run(asgi_request(AsyncViewsAsgi(self.app), "/missing"))
+        self.assertEqual(status, 404)
+        status, _ = asyncio.run(asgi_request(AsyncViewsAsgi(self.app), "/nowhere"))
+        self.assertEqual(status, 404)
+        status, _ = asyncio.run(asgi_request(AsyncViewsAsgi(self.app), "/slow", method="POST"))
+        self.assertEqual(status, 405)
+
+class AsyncViewsLoopTestCase(TestCase):
+    """Test running async views on the shared event loop"""
+
+    def setUp(self):
+        """An app whose async views run on a fresh AsyncDatabase's loop."""
+        self.async_db = AsyncDatabase()
+        self.app = Flask(__name__)
+        self.app.async_to_sync = self.async_db.async_to_sync
+        self.loops = []
+
+        @self.app.route("/slow")
+        async def slow():
+            self.loops.append(asyncio.get_running_loop())
+            await asyncio.sleep(DELAY)
+            return request.path
+
+    def test_views_share_one_loop(self):
+        """Testing every async view runs on the same loop, with its request context."""
+        client = self.app.test_client()
+
+        self.assertEqual(client.get("/slow").get_data(as_text=True), "/slow")
+        self.assertEqual(client.get("/slow").get_data(as_text=True), "/slow")
+        self.assertIs(self.loops[0], self.loops[1])
+        self.assertIs(self.loops[0], self.async_db.loop())
+
+    def test_views_overlap(self):
+        """Testing async views called from several threads wait on the loop together."""
+        bodies = []
+
+        def get():
+            bodies.append(self.app.test_client().get("/slow").get_data(as_text=True))
+
+        threads = [threading.Thread(target=get) for _ in range(REQUESTS)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(bodies, ["/slow"] * REQUESTS)
+        self.assertLess(time.perf_counter() - start, DELAY * REQUESTS / 2)
@@ -0,0 +1,25 @@
+from unittest import TestCase
+
+from bench import percentile, summarize, compare
+
+class BenchReportTestCase(TestCase):
+    """Test benchmark report maths"""
+    
+    def test_summarize(self):
+        """Testing latencies are summarized as millisecond percentiles and throughput."""
+        result = summarize([i / 1000 for i in range(100, 0, -1)], errors=1, elapsed=2)
+        
+        self.assertEqual(result["requests"], 100)
+        self.assertEqual(result["p50_ms"], 50)
+        self.assertEqual(result["p90_ms"], 90)
+        self.assertEqual(result["p99_ms"], 99)
+        self.assertEqual(result["rps"], 50)
+        self.assertEqual(result["errors"], 1)
+        self.assertEqual(percentile([], 90), 0.0)
+        
+    def test_compare(self):
+        """Testing only routes slower than the threshold count as regressions."""
+        baseline = {"routes": {"login": {"p90_ms": 10.0}, "user_page": {"p90_ms": 10.0}, "gone": {"p90_ms": 1.0}}}
+        report = {"routes": {"login": {"p90_ms": 12.0}, "user_page": {"p90_ms": 13.0}}}
+        
+        self.assertEqual(compare(report, baseline, threshold=0.25), ["user_page"])
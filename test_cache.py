@@ -0,0 +1,77 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import Flask
+
+from cache import LRUCache, FragmentCache
+
+class LRUCacheTestCase(TestCase):
+    """Test the in-process LRU cache"""
+    
+    def test_evicts_least_recently_used(self):
+        """Testing the oldest untouched entry is evicted when the cache is full."""
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(len(cache), 2)
+        
+    def test_expires_entries(self):
+        """Testing entries are dropped once their ttl has passed."""
+        cache = LRUCache(ttl=10)
+        with patch("cache.time.monotonic", return_value=100):
+            cache.set("a", 1)
+            cache.set("b", 2, ttl=60)
+        with patch("cache.time.monotonic", return_value=111):
+            self.assertNotIn("a", cache)
+            self.assertIn("b", cache)
+            
+    def test_set_prunes_expired_entries(self):
+        """Testing expired entries that are never read again are dropped as new ones are set."""
+        cache = LRUCache(maxsize=1000, ttl=10)
+        with patch("cache.time.monotonic", return_value=100):
+            for n in range(100):
+                cache.set(n, n)
+        with patch("cache.time.monotonic", return_value=105):
+            cache.set("recent", 1)
+        with patch("cache.time.monotonic", return_value=111):
+            cache.set("new", 1)
+            
+            self.assertEqual(len(cache), 2)
+            self.assertIn("recent", cache)
+            
+    def test_delete_and_clear(self):
+        """Testing entries can be removed one at a time or all at once."""
+        cache = LRUCache()
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.delete("a")
+        cache.delete("missing")
+        
+        self.assertNotIn("a", cache)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+class FragmentCacheConfigTestCase(TestCase):
+    """Test the fragment cache's defaults"""
+    
+    def test_in_process_backend_expires_quickly(self):
+        """Testing the per-process default keeps entries briefly, as other workers can't invalidate them."""
+        cache = FragmentCache(Flask(__name__))
+        
+        self.assertIsInstance(cache.backend, LRUCache)
+        self.assertEqual(cache.backend.ttl, 5)
+        
+    def test_shared_backend_keeps_entries_longer(self):
+        """Testing a shared backend, which sees every worker's bumps, gets the longer default."""
+        app = Flask(__name__)
+        app.config["FRAGMENT_CACHE_BACKEND"] = backend = LRUCache()
+        cache = FragmentCache(app)
+        
+        self.assertIs(cache.backend, backend)
+        self.assertEqual(app.config["FRAGMENT_CACHE_TTL"], 300)
@@ -0,0 +1,26 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from config import Config, DevelopmentConfig, TestingConfig, config_from_env
+
+class ConfigFromEnvTestCase(TestCase):
+    """Test picking the config class from the environment"""
+
+    def test_defaults_to_production(self):
+        """Testing the base Config is used when nothing asks for another."""
+        with patch.dict("os.environ", {}, clear=True):
+            self.assertIs(config_from_env(), Config)
+
+    def test_flask_env_development(self):
+        """Testing FLASK_ENV=development gets the development config, which lets redirects through the toolbar."""
+        with patch.dict("os.environ", {"FLASK_ENV": "development"}, clear=True):
+            self.assertIs(config_from_env(), DevelopmentConfig)
+        self.assertFalse(DevelopmentConfig.DEBUG_TB_INTERCEPT_REDIRECTS)
+
+    def test_flask_config_wins(self):
+        """Testing FLASK_CONFIG names the config outright, and an unknown name is refused."""
+        with patch.dict("os.environ", {"FLASK_ENV": "development", "FLASK_CONFIG": "testing"}, clear=True):
+            self.assertIs(config_from_env(), TestingConfig)
+        with patch.dict("os.environ", {"FLASK_CONFIG": "staging"}, clear=True):
+            with self.assertRaises(ValueError):
+                config_from_env()
@@ -0,0 +1,45 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from ratelimit import ShardedBuckets, parse_limit
+
+class ParseLimitTestCase(TestCase):
+    """Test parsing rate limit strings"""
+    
+    def test_parse(self):
+        """Testing limits parse into a count and a period in seconds."""
+        self.assertEqual(parse_limit("10/minute"), (10, 60))
+        self.assertEqual(parse_limit("1/second"), (1, 1))
+        
+    def test_bad_limit(self):
+        """Testing malformed limits are rejected."""
+        with self.assertRaises(ValueError):
+            parse_limit("ten/minute")
+        with self.assertRaises(ValueError):
+            parse_limit("10/fortnight")
+
+class ShardedBucketsTestCase(TestCase):
+    """Test the in-process token buckets"""
+    
+    def test_burst_then_refill(self):
+        """Testing a bucket allows a burst of count requests, then refills at the steady rate."""
+        buckets = ShardedBuckets()
+        with patch("ratelimit.time.monotonic", return_value=100):
+            self.assertEqual([buckets.take("a", 3, 60) for _ in range(3)], [0, 0, 0])
+            self.assertEqual(buckets.take("a", 3, 60), 20)
+            # other clients have their own bucket
+            self.assertEqual(buckets.take("b", 3, 60), 0)
+        with patch("ratelimit.time.monotonic", return_value=120):
+            self.assertEqual(buckets.take("a", 3, 60), 0)
+            self.assertGreater(buckets.take("a", 3, 60), 0)
+            
+    def test_bounded(self):
+        """Testing each shard forgets its least recently used buckets past maxsize."""
+        buckets = ShardedBuckets(shards=1, maxsize=2)
+        with patch("ratelimit.time.monotonic", return_value=100):
+            buckets.take("a", 1, 60)
+            buckets.take("b", 1, 60)
+            buckets.take("c", 1, 60)
+            # a was dropped, so it starts with a full bucket again
+            self.assertEqual(buckets.take("a", 1, 60), 0)
+            self.assertGreater(buckets.take("c", 1, 60), 0)
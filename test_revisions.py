@@ -0,0 +1,57 @@
+import json
+import time
+import zlib
+from unittest import TestCase
+
+from revisions import tokenize, make_snapshot, read_snapshot, make_delta, apply_delta
+
+class DeltaTestCase(TestCase):
+    """Test the compressed deltas feedback revisions are stored as"""
+    
+    def test_tokens_keep_whitespace(self):
+        """Testing tokens join back into exactly the original text."""
+        for text in ["", "one", "  leading and trailing  ", "two\n\nlines\twith  tabs"]:
+            self.assertEqual("".join(tokenize(text)), text)
+            
+    def test_round_trip(self):
+        """Testing a delta rebuilds the new text from the old one."""
+        edits = [
+            ("", "Brand new."),
+            ("Going away.", ""),
+            ("The quick brown fox.", "The quick red fox jumps."),
+            ("Same.", "Same."),
+            ("Line one\nLine two\n", "Line zero\nLine one\nLine two, edited\n"),
+        ]
+        for old, new in edits:
+            self.assertEqual(apply_delta(old, make_delta(old, new)), new)
+            
+    def test_small_edit_small_delta(self):
+        """Testing a small edit to a long text stores far less than a snapshot would."""
+        old = " ".join(f"word{n}" for n in range(5000))
+        new = old.replace("word2500", "edited")
+        
+        self.assertLess(len(make_delta(old, new)), len(make_snapshot(new)) // 10)
+        self.assertEqual(read_snapshot(make_snapshot(new)), new)
+            
+    def test_large_content_stays_fast(self):
+        """Testing edits to very long texts are diffed in about linear time, whatever the edit."""
+        old = " ".join(f"word{n % 997}" for n in range(40000))
+        edits = [
+            old.replace("word500 ", "edited ", 1),
+            "Prepended. " + old + " Appended.",
+            " ".join(reversed(old.split(" "))),
+        ]
+        for new in edits:
+            start = time.perf_counter()
+            delta = make_delta(old, new)
+            
+            self.assertLess(time.perf_counter() - start, 1)
+            self.assertEqual(apply_delta(old, delta), new)
+            
+    def test_long_changed_stretch_inserted_whole(self):
+        """Testing a changed stretch longer than max_tokens is stored as one insert around the unchanged ends."""
+        old = "Start. " + "old " * 50 + "End."
+        new = "Start. " + "new " * 50 + "End."
+        
+        self.assertEqual(json.loads(zlib.decompress(make_delta(old, new, max_tokens=10))), [[0, 1], "new " * 50, [51, 52]])
+        self.assertEqual(apply_delta(old, make_delta(old, new, max_tokens=10)), new)
@@ -0,0 +1,22 @@
+from unittest import TestCase
+
+from sharding import plan_rebalance
+
+class RebalanceTestCase(TestCase):
+    """Test planning which buckets move when shards are added"""
+    
+    def test_even_shares(self):
+        """Testing every shard ends up with its share, and buckets only move off overfull shards."""
+        bucket_map = {bucket: bucket % 2 for bucket in range(10)}
+        moves = plan_rebalance(bucket_map, 3)
+        
+        for bucket, source, target in moves:
+            self.assertEqual(bucket_map[bucket], source)
+            bucket_map[bucket] = target
+        self.assertEqual(sorted(list(bucket_map.values()).count(shard) for shard in range(3)), [3, 3, 4])
+        self.assertEqual(len(moves), 3)
+        self.assertTrue(all(target == 2 for _, _, target in moves))
+        
+    def test_balanced_stays_put(self):
+        """Testing an already even spread plans no moves."""
+        self.assertEqual(plan_rebalance({bucket: bucket % 4 for bucket in range(16)}, 4), [])
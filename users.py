@@ -0,0 +1,135 @@
+from datetime import datetime
+from flask import Blueprint, abort, current_app, render_template, redirect, session, flash, request
+from sqlalchemy.exc import IntegrityError
+from models import Feedback, db, User, UserStats, unknown_usernames
+from purge import purger
+from cache import fragment_cache
+from sessions import revoke_user_sessions
+from forms import UserLoginForm, UserRegistrationForm
+from assets import prerendered
+from replicas import read_only, used_replica
+from sharding import shard_router
+
+users_bp = Blueprint("users", __name__)
+
+def replica_ttl():
+    """How long to cache a fragment for: briefly if it may have been rendered from a lagging replica."""
+    return current_app.config["REPLICA_STICKY_SECONDS"] if used_replica() else None
+
+@users_bp.route('/')
+def index():
+    """Redirect to /register."""
+    return redirect("/register")
+
+@users_bp.route("/register", methods=["GET", "POST"])
+def register_user():
+    """Show form to register users and add them to the database."""
+    form = UserRegistrationForm()
+    if form.validate_on_submit():
+        username = form.username.data
+        password = form.password.data
+        email = form.email.data
+        first_name = form.first_name.data
+        last_name = form.last_name.data
+         
+         # User register class method to hash password and create new user model instance
+        new_user = User.registerUser(username, password, email, first_name, last_name)
+        db.session.add(new_user)
+         
+        try:
+            db.session.commit()
+            unknown_usernames.delete(new_user.username)
+            session.regenerate()
+            session['username'] = new_user.username
+            flash(f'Thanks for joining {new_user.username}!  Your account has successfully been created!', 'success')
+            return redirect(f'/users/{new_user.username}')
+        except IntegrityError:
+            # If there's an error adding username to db, show error and render register
+            form.username.errors.append('The username is already taken.  Please choose another.')
+            return render_template('register.html', form=form)
+
+    return render_template('register.html', form=form)
+
+@users_bp.route('/login', methods=["GET", "POST"])
+def login_user():
+    """Show form to login users and add their username to the session."""
+    form = UserLoginForm()
+    if form.validate_on_submit():
+        username = form.username.data
+        password = form.password.data
+
+        with shard_router.using(username=username):
+            user = User.authenticate(username, password)
+        if user:
+            flash(f"Welcome Back, {user.username}! You've been successfully logged in.", "success")
+            session.regenerate()
+            session['username'] = user.username
+            return redirect(f'/users/{user.username}')
+        else:
+            form.username.errors = ['Invalid username/password.']
+            
+    return render_template('login.html', form=form)
+
+@users_bp.route('/users/<username>')
+@read_only
+def show_secrets_page(username):
+    """Show secret page if authorized."""
+    if 'username' not in session:
+        # If the user is not logged in/username not in session redirect to /register
+        flash("Please register or login first!", "danger")
+        return redirect('/register')
+
+    # Clamp the page size so one request can't ask for every row a user has
+    per_page = request.args.get('per_page', current_app.config["FEEDBACK_PAGE_SIZE"], type=int)
+    per_page = max(1, min(per_page, current_app.config["FEEDBACK_MAX_PAGE_SIZE"]))
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    
+    # Rendered fragments are cached per user version, so a hit on both skips the database entirely
+    header_key = fragment_cache.key(username, 'header')
+    listing_key = fragment_cache.key(username, 'feedback', after, before, per_page)
+    header = fragment_cache.get(header_key)
+    feedback_list = fragment_cache.get(listing_key)
+    
+    if header is None:
+        user = User.query.get_or_404(username)
+        header = fragment_cache.set(header_key, render_template('user_header.html', user=user), ttl=replica_ttl())
+    
+    if feedback_list is None:
+        page = Feedback.page_for_user(username, after=after, before=before, per_page=per_page)
+        feedback_list = fragment_cache.set(listing_key, render_template('feedback_list.html', username=username, feedback=page.items, page=page, per_page=per_page), ttl=replica_ttl())
+    
+    return render_template('user_detail.html', username=username, header=header, feedback_list=feedback_list)
+
+@users_bp.route('/users/<username>/delete', methods=["POST"])
+def delete_user(username):
+    """Delete user only if authorized."""
+    if 'username' not in session:
+        flash("Please log in before deleting your user profile.", "danger")
+        return prerendered('401.html'), 401
+
+    # Only tombstone the user here, their feedback is hidden with them and purged in the background
+    tombstoned = User.query.filter_by(username=username, deleted_at=None).update({"deleted_at": datetime.utcnow()})
+    if not tombstoned:
+        abort(404)
+    session.pop('username')
+    
+    # off the leaderboard now rather than once the purge gets to them
+    UserStats.query.filter_by(username=username).delete()
+    db.session.commit()
+    purger.wake()
+    unknown_usernames.delete(username)
+    fragment_cache.bump(username)
+    # Log the user out on every other device too
+    revoke_user_sessions(username)
+    
+    flash('Your account has successfully been deleted.', 'success')
+    
+    return redirect('/')
+
+@users_bp.route('/logout', methods=["POST"])
+def logout_user():
+    """Logout user."""
+    session.pop('username')
+    flash("You've been successfully logged out.", "info")
+    return redirect('/')
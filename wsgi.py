@@ -0,0 +1,16 @@
+"""Entry point for WSGI servers.
+
+Building the app here lets gunicorn --preload create it once in the master process and fork
+it into every worker, e.g.
+
+    gunicorn --preload wsgi:app
+
+With more than one worker, point SESSION_STORE and FRAGMENT_CACHE_BACKEND at a shared store;
+their in-process defaults only see what happened in their own worker.
+
+With FEEDBACK_WRITE_BEHIND on, run `flask replay-feedback` before starting the server, so
+feedback spilled by workers that crashed is inserted straight away.
+"""
+from app import create_app
+
+app = create_app()